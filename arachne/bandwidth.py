@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bandwidth limits of the transfers of the protocol handlers.
+"""
+
+import time
+import logging
+import multiprocessing
+
+
+class TokenBucket(object):
+    """Token bucket.
+
+    Tokens are the bytes that can be received.  They are added at `rate`
+    tokens per second, up to `capacity` tokens (one second of transfer by
+    default).  The bytes received are taken from the bucket even if there are
+    not enough tokens, the transfer should wait until the debt is paid.  The
+    state of the bucket is kept in shared memory, it is shared with the
+    processes forked after creating the bucket.  It is not synchronized.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """Initialize the bucket full of tokens.
+        """
+        self._rate = float(rate)
+        self._capacity = capacity if capacity is not None else rate
+        # Tokens and time of the last update.
+        self._state = multiprocessing.RawArray('d', [self._capacity,
+                                                     time.time()])
+
+    def consume(self, amount):
+        """Take the given number of tokens from the bucket.
+
+        It returns a tuple with the number of seconds to wait before receiving
+        more data (0 if there were enough tokens) and the part of this time
+        added by these tokens, the rest is the debt of previous transfers.
+        """
+        self._fill()
+        tokens = self._state[0]
+        self._state[0] = tokens - amount
+        if tokens >= amount:
+            return 0, 0
+        return ((amount - tokens) / self._rate,
+                (amount - max(0, tokens)) / self._rate)
+
+    def _fill(self):
+        """Add the tokens generated since the last update.
+        """
+        now = time.time()
+        self._state[0] = min(self._capacity, self._state[0]
+                             + (now - self._state[1]) * self._rate)
+        self._state[1] = now
+
+
+class BandwidthLimiter(object):
+    """Bandwidth limiter shared by the protocol handlers.
+
+    There is a `TokenBucket` for each site with a `max_rate` option greater
+    than zero (bytes per second) and another one for all the sites if the
+    `max_rate` argument is greater than zero.  Handlers report the bytes
+    received from a site, the transfer waits until both buckets have tokens.
+    The time the transfers of each site were delayed (throttled time) is
+    returned by `get_throttled()` and logged every `_LOG_INTERVAL` seconds.
+
+    The limiter can be used by the processes forked after creating it (e.g.
+    the content workers), the buckets and the throttled times are shared.
+    """
+
+    _LOG_INTERVAL = 600
+
+    def __init__(self, sites_info, max_rate=0):
+        """Initialize the buckets.
+        """
+        self._sites_info = sites_info
+        self._buckets = {}
+        for site_id, site_info in sites_info.iteritems():
+            site_rate = site_info.get('max_rate', 0)
+            if site_rate > 0:
+                self._buckets[site_id] = TokenBucket(site_rate)
+        self._bucket = TokenBucket(max_rate) if max_rate > 0 else None
+        # Throttled time of each site and when it was last logged.
+        self._throttled = {}
+        for site_id in sites_info:
+            self._throttled[site_id] = multiprocessing.RawArray('d', 2)
+        self._mutex = multiprocessing.Lock()
+
+    def reserve(self, site_id, size):
+        """Take the tokens for `size` bytes received from a site.
+
+        It returns the number of seconds the transfer should wait before
+        receiving more data.  Used by the handlers that can not block (see
+        `throttle()`).  Only the part of the wait added by these bytes is
+        counted as throttled time, the rest was already counted.
+        """
+        now = time.time()
+        throttled = None
+        self._mutex.acquire()
+        try:
+            delay = added = 0
+            for bucket in (self._buckets.get(site_id), self._bucket):
+                if bucket is not None:
+                    bucket_delay, bucket_added = bucket.consume(size)
+                    delay = max(delay, bucket_delay)
+                    added = max(added, bucket_added)
+            if added > 0:
+                counters = self._throttled[site_id]
+                counters[0] += added
+                if now - counters[1] >= self._LOG_INTERVAL:
+                    counters[1] = now
+                    throttled = counters[0]
+        finally:
+            self._mutex.release()
+        if throttled is not None:
+            logging.info('Transfers from "%s" throttled for %d seconds'
+                         % (self._sites_info[site_id]['url'], throttled))
+        return delay
+
+    def throttle(self, site_id, size):
+        """Take the tokens for `size` bytes received from a site.
+
+        It sleeps the time needed to keep the transfers within the limits and
+        returns the number of seconds slept.
+        """
+        delay = self.reserve(site_id, size)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def get_throttled(self, site_id):
+        """Return the seconds the transfers from a site were delayed.
+        """
+        self._mutex.acquire()
+        try:
+            return self._throttled[site_id][0]
+        finally:
+            self._mutex.release()
@@ -0,0 +1,847 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Extraction of the text to be indexed from the content of files.
+
+Extractors never download whole files.  They read only the byte ranges they
+need through a `RangeReader`.  The `ContentManager` runs the extractors in a
+pool of worker processes and caches the extracted contents.
+"""
+
+import re
+import time
+import bsddb
+import signal
+import socket
+import struct
+import ftplib
+import urllib2
+import cPickle
+import logging
+import threading
+import multiprocessing
+
+from arachne.error import ContentError
+from arachne.pool import FTPConnectionPool, HTTPConnectionPool
+from arachne.pool import build_http_opener
+
+
+class RangeReader(object):
+    """Reader of byte ranges of a remote file.
+
+    Abstract class that should be subclassed for each protocol.  The
+    subclasses should override `_read()` and `_request_size()`.
+    """
+
+    def __init__(self, size=None, budget=None, throttle=None):
+        """Initialize the reader.
+
+        The `size` argument is the size of the file in bytes if it is already
+        known (e.g. from the directory listing).  The `budget` argument is the
+        maximum number of bytes that can be read from the file (`None` means
+        no limit).  The `throttle` argument is a function called with the
+        number of bytes of each block received, used to limit the bandwidth
+        (see `arachne.handler.ProtocolHandler._get_throttle()`).
+        """
+        self._size = size
+        self._budget = budget
+        self._throttle = throttle
+        self._bytes_read = 0
+
+    def read(self, offset, length):
+        """Read up to `length` bytes starting at `offset`.
+
+        Fewer bytes are returned if the end of the file is reached.  A
+        `ContentError` is raised if the read would exceed the byte budget.
+        """
+        if length <= 0:
+            return ''
+        self._check_budget(length)
+        data = self._read(offset, length)
+        self._bytes_read += len(data)
+        return data
+
+    def read_tail(self, length):
+        """Read the last `length` bytes of the file.
+
+        Fewer bytes are returned if the file is smaller.
+        """
+        if length <= 0:
+            return ''
+        self._check_budget(length)
+        data = self._read_tail(length)
+        self._bytes_read += len(data)
+        return data
+
+    def _check_budget(self, length):
+        """Raise `ContentError` if reading `length` bytes exceeds the budget.
+        """
+        if self._budget is not None and self._bytes_read + length > self._budget:
+            raise ContentError('The byte budget of the file was exceeded.')
+
+    def _throttle_block(self, length):
+        """Throttle the transfer after receiving a block of `length` bytes.
+
+        Subclasses should invoke this method for each block, as it is
+        received.
+        """
+        if self._throttle is not None:
+            self._throttle(length)
+
+    def _get_size(self):
+        """Get method for the `size` property.
+
+        The size is requested to the server only if it is not known.
+        """
+        if self._size is None:
+            self._size = self._request_size()
+        return self._size
+
+    size = property(_get_size)
+
+    def _get_remaining(self):
+        """Get method for the `remaining` property.
+
+        Number of bytes that can be read before exceeding the budget, `None`
+        if there is no limit.
+        """
+        if self._budget is None:
+            return None
+        return self._budget - self._bytes_read
+
+    remaining = property(_get_remaining)
+
+    def _read_tail(self, length):
+        """Read the last bytes of the file from the server.
+        """
+        size = self.size
+        length = min(length, size)
+        return self._read(size - length, length) if length > 0 else ''
+
+    def _read(self, offset, length):
+        """Read a byte range from the server.
+        """
+        raise NotImplementedError('A subclass must override this method.')
+
+    def _request_size(self):
+        """Request the size of the file to the server.
+        """
+        raise NotImplementedError('A subclass must override this method.')
+
+
+class FTPRangeReader(RangeReader):
+    """Reader of byte ranges of a file using an FTP session.
+
+    It uses the REST command to start the transfer at the given offset and
+    closes the data connection as soon as enough bytes are received.  The
+    transfer is then aborted and the pending replies are read, so the
+    control connection can be used for the following commands.
+    """
+
+    def __init__(self, ftp, path, size=None, budget=None, throttle=None):
+        """Initialize the reader for the file at the encoded `path`.
+        """
+        RangeReader.__init__(self, size, budget, throttle)
+        self._ftp = ftp
+        self._path = path
+        self._block_size = 8192
+
+    def _read(self, offset, length):
+        ftp = self._ftp
+        ftp.voidcmd('TYPE I')
+        conn = ftp.transfercmd('RETR %s' % self._path, offset)
+        chunks = []
+        received = 0
+        finished = False
+        try:
+            while received < length:
+                chunk = conn.recv(min(self._block_size, length - received))
+                if not chunk:
+                    finished = True
+                    break
+                chunks.append(chunk)
+                received += len(chunk)
+                self._throttle_block(len(chunk))
+        finally:
+            conn.close()
+        if finished:
+            try:
+                ftp.voidresp()
+            except (ftplib.error_temp, ftplib.error_perm):
+                # The server reports that the transfer failed.
+                pass
+        else:
+            self._abort()
+        return ''.join(chunks)
+
+    def _abort(self):
+        """Abort a transfer cut short and read the pending replies.
+
+        Depending on the server and on whether the transfer completed, ABOR
+        gets one or two replies (e.g. 426 and 226, or 226 and 225).  A NOOP
+        command is sent after it and the replies are read up to the one of
+        the NOOP, leaving the control connection in sync.
+        """
+        ftp = self._ftp
+        try:
+            ftp.abort()
+        except ftplib.error_proto:
+            # Unexpected reply for the interrupted transfer (e.g. 451).
+            pass
+        ftp.putcmd('NOOP')
+        while not ftp.getmultiline().startswith('200'):
+            pass
+
+    def _request_size(self):
+        self._ftp.voidcmd('TYPE I')
+        size = self._ftp.size(self._path)
+        if size is None:
+            raise ContentError('Could not get the size of the file.')
+        return size
+
+
+class HTTPRangeReader(RangeReader):
+    """Reader of byte ranges of a file using HTTP Range requests.
+
+    The size of the file is taken from the Content-Range header of the
+    responses.  The last bytes of the file are requested using a suffix
+    range, without knowing the size of the file.
+    """
+
+    _CONTENT_RANGE_RE = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+    def __init__(self, opener, url, size=None, budget=None, throttle=None):
+        """Initialize the reader for the file at the encoded `url`.
+
+        The `opener` argument is the `urllib2.OpenerDirector` used to send
+        the requests.
+        """
+        RangeReader.__init__(self, size, budget, throttle)
+        self._opener = opener
+        self._url = url
+        self._block_size = 8192
+
+    def _read(self, offset, length):
+        return self._request('%d-%d' % (offset, offset + length - 1), length)
+
+    def _read_tail(self, length):
+        if self._size is None:
+            return self._request('-%d' % length, length)
+        return RangeReader._read_tail(self, length)
+
+    def _request_size(self):
+        request = urllib2.Request(self._url)
+        request.get_method = lambda: 'HEAD'
+        response = self._opener.open(request)
+        try:
+            size = response.info().getheader('Content-Length')
+        finally:
+            response.close()
+        if size is None or not size.isdigit():
+            raise ContentError('Could not get the size of the file.')
+        return int(size)
+
+    def _request(self, byte_range, length):
+        """Send a request for the given byte range and read the response.
+        """
+        request = urllib2.Request(self._url)
+        request.add_header('Range', 'bytes=%s' % byte_range)
+        response = self._opener.open(request)
+        try:
+            if response.code != 206:
+                # Do not download the whole file.
+                raise ContentError('The server does not support byte ranges.')
+            content_range = response.info().getheader('Content-Range', '')
+            match = self._CONTENT_RANGE_RE.match(content_range)
+            if match is not None:
+                self._size = int(match.group(1))
+            chunks = []
+            received = 0
+            while received < length:
+                chunk = response.read(min(self._block_size, length - received))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                received += len(chunk)
+                self._throttle_block(len(chunk))
+            return ''.join(chunks)
+        finally:
+            response.close()
+
+
+class ContentExtractor(object):
+    """Content extractor.
+
+    Abstract class that should be subclassed for each supported file type.
+    The subclasses should set the `extensions` attribute to a tuple with the
+    lowercase extensions of the supported files and override `extract()`.
+    """
+
+    extensions = ()
+
+    def extract(self, reader):
+        """Return the text to be indexed for the file.
+
+        The content of the file should be read using the given `RangeReader`.
+        A `ContentError` should be raised if the content is not valid.
+        """
+        raise NotImplementedError('A subclass must override this method.')
+
+
+class ID3Extractor(ContentExtractor):
+    """Extractor for the artist, album and title of MP3 files.
+
+    The ID3v2 tag is read from the head of the file.  If some of the fields
+    are missing, the ID3v1 tag is read from the last 128 bytes.
+    """
+
+    extensions = ('.mp3', )
+
+    # Fields indexed, in order, and identifiers of their frames in ID3v2.2
+    # and ID3v2.3/ID3v2.4 tags.
+    _FIELDS = ('artist', 'album', 'title')
+
+    _FRAMES = {
+        'TP1': 'artist', 'TAL': 'album', 'TT2': 'title',
+        'TPE1': 'artist', 'TALB': 'album', 'TIT2': 'title',
+    }
+
+    # Encodings of the text frames.
+    _ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+    def __init__(self):
+        """Initialize the extractor.
+        """
+        # Bytes read with the first request, enough for most tags without
+        # pictures.  The text frames are usually at the start of the tag.
+        self._head_size = 4096
+        self._max_tag_size = 64 * 1024
+
+    def extract(self, reader):
+        fields = {}
+        head = reader.read(0, self._head_size)
+        if len(head) >= 10 and head.startswith('ID3'):
+            tag_size = self._syncsafe(head[6:10])
+            end = 10 + min(tag_size, self._max_tag_size)
+            if end > len(head) and len(head) == self._head_size:
+                head += reader.read(len(head), end - len(head))
+            fields = self._parse_id3v2(head[:end])
+        if len(fields) < len(self._FIELDS):
+            tail = reader.read_tail(128)
+            for field, value in self._parse_id3v1(tail).iteritems():
+                fields.setdefault(field, value)
+        return u' '.join(fields[field] for field in self._FIELDS
+                         if field in fields)
+
+    def _parse_id3v2(self, tag):
+        """Parse the text frames of an ID3v2 tag (possibly truncated).
+        """
+        fields = {}
+        version, flags = ord(tag[3]), ord(tag[5])
+        data = tag[10:]
+        if flags & 0x80 and version < 4:
+            # Unsynchronisation applied to the whole tag.
+            data = data.replace('\xff\x00', '\xff')
+        if flags & 0x40 and version >= 3 and len(data) >= 4:
+            # Skip the extended header.
+            if version == 3:
+                data = data[4 + self._int(data[:4]):]
+            else:
+                data = data[self._syncsafe(data[:4]):]
+        if version == 2:
+            id_size, header_size = 3, 6
+        else:
+            id_size, header_size = 4, 10
+        pos = 0
+        while pos + header_size <= len(data):
+            frame_id = data[pos:pos + id_size]
+            if not frame_id.strip('\x00') or not frame_id.isalnum():
+                # Padding or garbage.
+                break
+            size_bytes = data[pos + id_size:pos + 2 * id_size]
+            if version == 4:
+                frame_size = self._syncsafe(size_bytes)
+            else:
+                frame_size = self._int(size_bytes)
+            frame = data[pos + header_size:pos + header_size + frame_size]
+            pos += header_size + frame_size
+            field = self._FRAMES.get(frame_id)
+            if field is None or not frame:
+                continue
+            if version == 4:
+                frame_flags = ord(data[pos - frame_size - 1])
+                if frame_flags & 0x0c:
+                    # Compressed or encrypted frame.
+                    continue
+                if frame_flags & 0x01:
+                    # Data length indicator.
+                    frame = frame[4:]
+                if frame_flags & 0x02:
+                    frame = frame.replace('\xff\x00', '\xff')
+            value = self._decode_text(frame)
+            if value:
+                fields[field] = value
+        return fields
+
+    def _parse_id3v1(self, tail):
+        """Parse an ID3v1 tag.
+        """
+        fields = {}
+        if len(tail) == 128 and tail.startswith('TAG'):
+            for field, start in (('title', 3), ('artist', 33), ('album', 63)):
+                value = tail[start:start + 30].split('\x00')[0].strip()
+                if value:
+                    fields[field] = value.decode('latin-1')
+        return fields
+
+    def _decode_text(self, frame):
+        """Decode the content of a text frame.
+        """
+        try:
+            encoding = self._ENCODINGS[ord(frame[0])]
+            text = frame[1:].decode(encoding)
+        except (IndexError, UnicodeDecodeError):
+            return u''
+        # ID3v2.4 separates multiple values with null characters.
+        return u' '.join(value.strip() for value in text.split(u'\x00')
+                         if value.strip())
+
+    @staticmethod
+    def _syncsafe(data):
+        """Decode a synchsafe integer.
+        """
+        value = 0
+        for byte in data:
+            value = (value << 7) | (ord(byte) & 0x7f)
+        return value
+
+    @staticmethod
+    def _int(data):
+        """Decode a big-endian integer.
+        """
+        value = 0
+        for byte in data:
+            value = (value << 8) | ord(byte)
+        return value
+
+
+class ZipExtractor(ContentExtractor):
+    """Extractor for the names of the files inside ZIP archives.
+
+    Only the End of Central Directory record and the central directory are
+    read from the end of the archive.  If the central directory does not fit
+    in the byte budget, the names of the first members are indexed.
+    """
+
+    extensions = ('.zip', )
+
+    _EOCD_SIGNATURE = 'PK\x05\x06'
+    _EOCD_FORMAT = '<4s4H2LH'
+    _EOCD_SIZE = struct.calcsize(_EOCD_FORMAT)
+
+    _ZIP64_LOCATOR_SIGNATURE = 'PK\x06\x07'
+    _ZIP64_LOCATOR_FORMAT = '<4sLQL'
+    _ZIP64_LOCATOR_SIZE = struct.calcsize(_ZIP64_LOCATOR_FORMAT)
+
+    _ZIP64_EOCD_SIGNATURE = 'PK\x06\x06'
+    _ZIP64_EOCD_FORMAT = '<4sQ2H2L4Q'
+    _ZIP64_EOCD_SIZE = struct.calcsize(_ZIP64_EOCD_FORMAT)
+
+    _HEADER_SIGNATURE = 'PK\x01\x02'
+    _HEADER_FORMAT = '<4s6H3L5H2L'
+    _HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+    # The archive comment can be up to 64 KB long.
+    _MAX_COMMENT_SIZE = 0xffff
+
+    def __init__(self):
+        """Initialize the extractor.
+        """
+        # Bytes read with the first request.  Usually enough for the End of
+        # Central Directory record and the central directory of small
+        # archives.
+        self._tail_size = 8192
+
+    def extract(self, reader):
+        tail = reader.read_tail(self._tail_size)
+        pos = tail.rfind(self._EOCD_SIGNATURE)
+        if pos < 0 and len(tail) == self._tail_size:
+            # The archive may have a long comment.
+            tail = reader.read_tail(self._EOCD_SIZE + self._MAX_COMMENT_SIZE)
+            pos = tail.rfind(self._EOCD_SIGNATURE)
+        if pos < 0 or len(tail) - pos < self._EOCD_SIZE:
+            raise ContentError('End of Central Directory record not found.')
+        tail_offset = reader.size - len(tail)
+        eocd = struct.unpack(self._EOCD_FORMAT,
+                             tail[pos:pos + self._EOCD_SIZE])
+        cd_size, cd_offset = eocd[5], eocd[6]
+        # Archives with data prepended (e.g. self-extracting archives) have
+        # the central directory just before the End of Central Directory.
+        cd_start = tail_offset + pos - cd_size
+        if cd_offset == 0xffffffff or cd_size == 0xffffffff:
+            cd_start, cd_size = self._read_zip64(reader, tail, tail_offset,
+                                                 pos)
+        if cd_start < 0:
+            raise ContentError('Invalid central directory.')
+        if cd_start >= tail_offset:
+            data = tail[cd_start - tail_offset:cd_start - tail_offset + cd_size]
+        else:
+            if reader.remaining is not None:
+                cd_size = min(cd_size, reader.remaining)
+            data = reader.read(cd_start, cd_size)
+        return u'\n'.join(self._parse_central_directory(data))
+
+    def _read_zip64(self, reader, tail, tail_offset, pos):
+        """Return the offset and size of the central directory of a ZIP64
+        archive.
+        """
+        pos -= self._ZIP64_LOCATOR_SIZE
+        locator = tail[pos:pos + self._ZIP64_LOCATOR_SIZE]
+        if pos < 0 or not locator.startswith(self._ZIP64_LOCATOR_SIGNATURE):
+            raise ContentError('ZIP64 End of Central Directory not found.')
+        eocd_offset = struct.unpack(self._ZIP64_LOCATOR_FORMAT, locator)[2]
+        if eocd_offset >= tail_offset:
+            start = eocd_offset - tail_offset
+            eocd = tail[start:start + self._ZIP64_EOCD_SIZE]
+        else:
+            eocd = reader.read(eocd_offset, self._ZIP64_EOCD_SIZE)
+        if (len(eocd) < self._ZIP64_EOCD_SIZE or
+                not eocd.startswith(self._ZIP64_EOCD_SIGNATURE)):
+            raise ContentError('ZIP64 End of Central Directory not found.')
+        eocd = struct.unpack(self._ZIP64_EOCD_FORMAT, eocd)
+        return eocd[9], eocd[8]
+
+    def _parse_central_directory(self, data):
+        """Return the names of the members in a (possibly truncated) central
+        directory.
+        """
+        names = []
+        seen = set()
+        pos = 0
+        while pos + self._HEADER_SIZE <= len(data):
+            header = struct.unpack(self._HEADER_FORMAT,
+                                   data[pos:pos + self._HEADER_SIZE])
+            if header[0] != self._HEADER_SIGNATURE:
+                break
+            flags, name_size, extra_size, comment_size = (header[3], header[10],
+                                                          header[11], header[12])
+            start = pos + self._HEADER_SIZE
+            name = data[start:start + name_size]
+            if len(name) < name_size:
+                break
+            pos = start + name_size + extra_size + comment_size
+            # Bit 11 of the flags indicates that the name is UTF-8 encoded.
+            encoding = 'utf-8' if flags & 0x800 else 'cp437'
+            name = name.decode(encoding, 'replace').rstrip(u'/')
+            if name and name not in seen:
+                seen.add(name)
+                names.append(name)
+        return names
+
+
+# Registered extractors.
+EXTRACTORS = (ID3Extractor(), ZipExtractor())
+
+
+def get_extractor(name):
+    """Return the registered extractor for the file with the given name.
+
+    `None` is returned if the file type is not supported.
+    """
+    name = name.lower()
+    for extractor in EXTRACTORS:
+        for extension in extractor.extensions:
+            if name.endswith(extension):
+                return extractor
+    return None
+
+
+class ContentManager(object):
+    """Content extraction manager.
+
+    Runs the content extractors in a pool of worker processes, so slow
+    transfers do not stall the site crawlers.  The extracted contents are
+    saved in a persistent cache keyed by the URL, size and modification time
+    of the files.  Unchanged files are not read again when their directories
+    are revisited.  The least recently used entries are evicted when the
+    cache is full.
+    """
+
+    def __init__(self, sites_info, num_workers, db_home, max_entries,
+                 bandwidth=None):
+        """Initialize the manager.
+
+        Starts `num_workers` worker processes.  The cache is saved in the
+        `db_home` directory and holds up to `max_entries` files.  The
+        `bandwidth` argument is the `BandwidthLimiter` used to throttle the
+        transfers of the workers, `None` if the bandwidth is not limited.
+        """
+        # The workers are forked before opening the Berkeley DB environment,
+        # they should not inherit its handles.  They share the buckets of the
+        # bandwidth limiter with the daemon.
+        self._pool = multiprocessing.Pool(num_workers, _init_worker,
+                                          (bandwidth,))
+        # Initialize the Berkeley DB environment.  The cache database maps
+        # the URL of the files to the size, modification time, content and
+        # LRU key.  The LRU database maps the LRU keys (integers as strings)
+        # to the URL of the files, ordered from the least recently used.
+        self._db_env = bsddb.db.DBEnv()
+        self._db_env.open(db_home, bsddb.db.DB_CREATE | bsddb.db.DB_RECOVER
+                          | bsddb.db.DB_INIT_TXN | bsddb.db.DB_INIT_LOG
+                          | bsddb.db.DB_INIT_MPOOL | bsddb.db.DB_THREAD)
+        self._cache_db = bsddb.db.DB(self._db_env)
+        self._cache_db.open('cache.db', bsddb.db.DB_BTREE, bsddb.db.DB_CREATE
+                            | bsddb.db.DB_AUTO_COMMIT | bsddb.db.DB_THREAD)
+        self._lru_db = bsddb.db.DB(self._db_env)
+        self._lru_db.open('lru.db', bsddb.db.DB_BTREE, bsddb.db.DB_CREATE
+                          | bsddb.db.DB_AUTO_COMMIT | bsddb.db.DB_THREAD)
+        self._key_length = 20
+        cursor = self._lru_db.cursor()
+        record = cursor.last()
+        cursor.close()
+        self._next_key = int(record[0]) + 1 if record else 0
+        self._num_entries = len(self._cache_db)
+        self._max_entries = max_entries
+        self._sites_info = sites_info
+        # Extractions in progress.  It maps the URL of the file to a tuple
+        # with the size, modification time and `AsyncResult` instance.
+        self._pending = {}
+        self._max_pending = 8 * num_workers
+        self._mutex = threading.Lock()
+
+    def get_contents(self, site_id, files, timeout):
+        """Return the contents of a group of files.
+
+        `files` should be a list of tuples containing the `URL` of the file,
+        its location (the encoded path for FTP, the encoded URL for HTTP), its
+        size and its modification time (`None` if unknown).  It returns a list
+        with the contents of the files, `None` for the files whose content is
+        not cached and could not be extracted within `timeout` seconds.  These
+        files are still extracted in background and cached for the next visit
+        if the workers are not too busy.
+        """
+        site_info = self._sites_info[site_id]
+        budget = site_info['content_budget']
+        max_idle = site_info.get('http_keepalive_timeout', 0)
+        contents = [None] * len(files)
+        waiting = []
+        self._mutex.acquire()
+        try:
+            for i, (url, location, size, mtime) in enumerate(files):
+                key = str(url)
+                contents[i] = self._lookup(key, size, mtime)
+                if contents[i] is not None:
+                    continue
+                pending = self._pending.get(key)
+                if pending is None or pending[:2] != (size, mtime):
+                    if len(self._pending) >= self._max_pending:
+                        continue
+                    callback = (lambda result, key=key, size=size, mtime=mtime:
+                                self._store(key, size, mtime, result))
+                    job = self._pool.apply_async(_extract,
+                                                 (url, location, size, budget,
+                                                  max_idle, site_id),
+                                                 callback=callback)
+                    pending = (size, mtime, job)
+                    self._pending[key] = pending
+                waiting.append((i, pending[2]))
+        finally:
+            self._mutex.release()
+        deadline = time.time() + timeout
+        for i, job in waiting:
+            job.wait(max(0, deadline - time.time()))
+            if job.ready() and job.successful():
+                contents[i] = job.get()[0]
+        return contents
+
+    def close(self):
+        """Stop the workers and close the cache.
+        """
+        self._pool.terminate()
+        self._pool.join()
+        self._mutex.acquire()
+        try:
+            self._cache_db.close()
+            self._lru_db.close()
+            self._db_env.close()
+        finally:
+            self._mutex.release()
+
+    def _lookup(self, key, size, mtime):
+        """Return the cached content of a file or `None` if it is not cached.
+
+        The entry of the file becomes the most recently used.
+        """
+        if size is None and mtime is None:
+            return None
+        record = self._cache_db.get(key)
+        if record is None:
+            return None
+        record = cPickle.loads(record)
+        if record[:2] != (size, mtime):
+            return None
+        self._save(key, size, mtime, record[2])
+        return record[2]
+
+    def _store(self, key, size, mtime, result):
+        """Save the content extracted by a worker in the cache.
+
+        Invoked by the pool when the extraction finishes.
+        """
+        content, error = result
+        self._mutex.acquire()
+        try:
+            pending = self._pending.get(key)
+            if pending is not None and pending[:2] == (size, mtime):
+                del self._pending[key]
+            if error is not None:
+                logging.debug('Could not extract the content of "%s": %s'
+                              % (key, error))
+            elif size is not None or mtime is not None:
+                self._save(key, size, mtime, content)
+        finally:
+            self._mutex.release()
+
+    def _save(self, key, size, mtime, content):
+        """Put an entry in the cache as the most recently used.
+
+        The least recently used entries are evicted if the cache is full.
+        """
+        txn = self._db_env.txn_begin()
+        try:
+            record = self._cache_db.get(key, txn=txn)
+            if record is not None:
+                self._lru_db.delete(cPickle.loads(record)[3], txn=txn)
+            else:
+                self._num_entries += 1
+            lru_key = self._get_key()
+            self._cache_db.put(key, cPickle.dumps((size, mtime, content, lru_key),
+                                                  cPickle.HIGHEST_PROTOCOL), txn=txn)
+            self._lru_db.put(lru_key, key, txn=txn)
+            cursor = self._lru_db.cursor(txn)
+            try:
+                while self._num_entries > self._max_entries:
+                    record = cursor.first()
+                    if record is None:
+                        break
+                    evicted = record[1]
+                    cursor.delete()
+                    self._cache_db.delete(evicted, txn=txn)
+                    self._num_entries -= 1
+            finally:
+                cursor.close()
+        except:
+            txn.abort()
+            raise
+        else:
+            txn.commit()
+
+    def _get_key(self):
+        """Return a new LRU key, greater than the previous ones.
+        """
+        key = str(self._next_key).zfill(self._key_length)
+        self._next_key += 1
+        return key
+
+
+# Idle FTP sessions and HTTP connections of a worker process, and the
+# bandwidth limiter shared with the daemon.
+_sessions = None
+_connections = None
+_bandwidth = None
+
+
+def _init_worker(bandwidth=None):
+    """Initialize a worker process of the `ContentManager`.
+
+    The workers are stopped by the manager, not by the signals sent to the
+    daemon.
+    """
+    global _bandwidth
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _bandwidth = bandwidth
+
+
+def _extract(url, location, size, budget, max_idle, site_id):
+    """Extract the content of a file in a worker process.
+
+    It returns a tuple with the content and an error message.  The error
+    message is `None` if the content was extracted or the file is not valid
+    (in this case the content is empty), otherwise the extraction can be
+    retried later.  HTTP connections are reused if they were idle less than
+    `max_idle` seconds.  Each block read is throttled with the bandwidth
+    limits of the site.
+    """
+    global _sessions, _connections
+    extractor = get_extractor(url.basename)
+    if extractor is None:
+        return (u'', None)
+    throttle = None
+    if _bandwidth is not None:
+        throttle = lambda length: _bandwidth.throttle(site_id, length)
+    try:
+        if url.scheme == 'ftp':
+            if _sessions is None:
+                _sessions = FTPConnectionPool(1)
+            key = str(url)[:-len(url.path.encode('utf-8'))]
+            ftp = _sessions.get(key, 60)
+            if ftp is None:
+                ftp = _connect(url)
+            try:
+                reader = FTPRangeReader(ftp, location, size, budget,
+                                        throttle)
+                content = extractor.extract(reader)
+            except (ContentError, ftplib.error_perm):
+                _sessions.put(key, ftp)
+                raise
+            except:
+                ftp.close()
+                raise
+            _sessions.put(key, ftp)
+        else:
+            if _connections is None:
+                _connections = HTTPConnectionPool(1)
+            key = str(url)[:-len(url.path.encode('utf-8'))]
+            opener = build_http_opener(_connections, key, max_idle)
+            reader = HTTPRangeReader(opener, location, size, budget,
+                                     throttle)
+            content = extractor.extract(reader)
+    except (ContentError, ftplib.error_perm):
+        return (u'', None)
+    except Exception, error:
+        return (None, '%s: %s' % (error.__class__.__name__, error))
+    return (content, None)
+
+
+def _connect(url):
+    """Open a new FTP session in a worker process.
+    """
+    ftp = ftplib.FTP()
+    ftp.connect(url.hostname.encode('utf-8'), url.port or ftplib.FTP_PORT)
+    try:
+        if url.username:
+            ftp.login(url.username.encode('utf-8'),
+                      url.password.encode('utf-8'))
+        else:
+            ftp.login()
+    except:
+        ftp.close()
+        raise
+    return ftp
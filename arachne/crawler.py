@@ -20,12 +20,12 @@
 """Components related with the crawling process.
 """
 
-import time
 import logging
 import threading
 
 from arachne.error import EmptyQueue
 from arachne.handler import ProtocolHandler
+from arachne.eventloop import EventLoop, AsyncProtocolHandler
 
 
 class SiteCrawler(threading.Thread):
@@ -37,17 +37,23 @@ class SiteCrawler(threading.Thread):
     independent thread of execution.
     """
 
-    def __init__(self, sites_info, tasks, results):
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 site_ids=None, bandwidth=None):
         """Initialize attributes.
+
+        The `contents` argument is the `ContentManager` and `bandwidth` the
+        `BandwidthLimiter` given to the protocol handlers (optional).  If
+        `site_ids` is given only the tasks of these sites are executed.
         """
         threading.Thread.__init__(self)
-        self._sleep = 1
         self._sites_info = sites_info
         self._tasks = tasks
         self._results = results
+        self._site_ids = site_ids
         self._handlers = {}
         for handler_class in self._get_handler_classes():
-            handler = handler_class(sites_info, tasks, results)
+            handler = handler_class(sites_info, tasks, results, contents,
+                                    bandwidth)
             self._handlers[handler_class.name] = handler
         # Flag used to stop the loop started by the run() method.
         self._running = False
@@ -59,11 +65,13 @@ class SiteCrawler(threading.Thread):
             self._running = True
             while self._running:
                 try:
-                    task = self._tasks.get()
+                    tasks = self._tasks.get_batch(self._site_ids)
                 except EmptyQueue:
-                    time.sleep(self._sleep)
+                    self._tasks.wait(self._site_ids)
                 else:
-                    self._execute(task)
+                    self._execute(tasks)
+            for handler in self._handlers.itervalues():
+                handler.close()
         except:
             logging.exception('Unhandled exception, printing traceback')
 
@@ -71,25 +79,32 @@ class SiteCrawler(threading.Thread):
         """Order the main loop to end.
         """
         self._running = False
+        self._tasks.interrupt()
 
-    def _execute(self, task):
-        """Execute a crawl task.
+    def _execute(self, tasks):
+        """Execute a batch of crawl tasks for the same site.
 
-        Call the handler to execute the crawl task.
+        Call the handler to execute the crawl tasks.
         """
-        site_info = self._sites_info[task.site_id]
-        handler_name = site_info.get('handler', task.url.scheme)
+        site_info = self._sites_info[tasks[0].site_id]
+        handler_name = site_info.get('handler', tasks[0].url.scheme)
         try:
             handler = self._handlers[handler_name]
         except KeyError:
-            self._tasks.report_error_site(task)
+            for task in tasks:
+                self._tasks.report_error_site(task)
             logging.error('Could not find a handler for "%s"' % handler_name)
         else:
-            if task.revisit_count == -1:
-                logging.info('Visiting "%s"' % task.url)
+            for task in tasks:
+                if task.revisit_count == -1:
+                    logging.info('Visiting "%s"' % task.url)
+                else:
+                    logging.info('Revisiting "%s"' % task.url)
+            if len(tasks) == 1:
+                handler.execute(tasks[0])
             else:
-                logging.info('Revisiting "%s"' % task.url)
-            handler.execute(task)
+                wait = self._tasks.get_request_wait(tasks[0].site_id)
+                handler.execute_batch(tasks, wait)
 
     def _get_handler_classes(self):
         """Get the classes of the protocol handlers.
@@ -101,6 +116,105 @@ class SiteCrawler(threading.Thread):
                     yield subsubclass
         return f(ProtocolHandler)
 
+
+class EventLoopCrawler(threading.Thread):
+    """Event-loop crawler.
+
+    Executes the crawl tasks of up to `max_sites` sites at the same time in a
+    single thread, using the handlers of the `arachne.eventloop` module.
+    Only the sites in `site_ids` are crawled, their handlers should be
+    returned by `get_handler_names()`.  The `bandwidth` argument is the
+    `BandwidthLimiter` given to the handlers (optional).  When the `stop()`
+    method is invoked it stops getting tasks and exits once the running
+    tasks are reported.
+    """
+
+    def __init__(self, sites_info, max_sites, tasks, results, site_ids,
+                 bandwidth=None):
+        """Initialize attributes.
+        """
+        threading.Thread.__init__(self)
+        # Maximum time between checks of the queue.  The loop sleeps until
+        # the first task becomes executable (see get_wait()), but the tasks
+        # put by other threads are only noticed after this time.
+        self._max_sleep = 1
+        self._sites_info = sites_info
+        self._max_sites = max_sites
+        self._tasks = tasks
+        self._site_ids = site_ids
+        self._loop = EventLoop()
+        self._handlers = {}
+        for handler_class in AsyncProtocolHandler.__subclasses__():
+            handler = handler_class(sites_info, tasks, results, self._loop,
+                                    bandwidth)
+            self._handlers[handler_class.name] = handler
+        # Number of batches being executed.
+        self._running_batches = 0
+        # Flag used to stop the loop started by the run() method.
+        self._running = False
+
+    @staticmethod
+    def get_handler_names():
+        """Return the names of the handlers supported by the crawler.
+        """
+        return set(handler_class.name for handler_class
+                   in AsyncProtocolHandler.__subclasses__())
+
+    def run(self):
+        """Run the main loop.
+        """
+        try:
+            self._running = True
+            while self._running or self._running_batches:
+                while (self._running
+                       and self._running_batches < self._max_sites
+                       and self._tasks.get_wait(self._site_ids) == 0):
+                    try:
+                        tasks = self._tasks.get_batch(self._site_ids)
+                    except EmptyQueue:
+                        pass
+                    else:
+                        self._execute(tasks)
+                timeout = self._max_sleep
+                if (self._running
+                        and self._running_batches < self._max_sites):
+                    wait = self._tasks.get_wait(self._site_ids)
+                    if wait is not None:
+                        timeout = min(wait, timeout)
+                self._loop.run_once(timeout)
+            for handler in self._handlers.itervalues():
+                handler.close()
+            self._loop.close()
+        except:
+            logging.exception('Unhandled exception, printing traceback')
+
+    def stop(self):
+        """Order the main loop to end.
+        """
+        self._running = False
+
+    def _execute(self, tasks):
+        """Start the execution of a batch of crawl tasks for the same site.
+        """
+        site_info = self._sites_info[tasks[0].site_id]
+        handler = self._handlers[site_info.get('handler',
+                                               tasks[0].url.scheme)]
+        for task in tasks:
+            if task.revisit_count == -1:
+                logging.info('Visiting "%s"' % task.url)
+            else:
+                logging.info('Revisiting "%s"' % task.url)
+        self._running_batches += 1
+        handler.execute_batch(tasks,
+                              self._tasks.get_request_wait(tasks[0].site_id),
+                              self._batch_done)
+
+    def _batch_done(self):
+        """Callback invoked by the handlers when a batch is reported.
+        """
+        self._running_batches -= 1
+
+
 class CrawlerManager(object):
     """Crawler manager.
 
@@ -108,14 +222,36 @@ class CrawlerManager(object):
     group of crawlers as a single component.
     """
 
-    def __init__(self, sites_info, num_crawlers, tasks, results):
+    def __init__(self, sites_info, num_crawlers, tasks, results,
+                 contents=None, event_loop_sites=0, bandwidth=None):
         """Initialize the site crawlers.
 
         Create a group of site crawlers according the the value of the
-        `num_crawlers` argument.
+        `num_crawlers` argument.  If `event_loop_sites` is greater than zero
+        an `EventLoopCrawler` crawls up to this number of sites at the same
+        time, the site crawlers are used for the sites with handlers not
+        supported by it.  The `bandwidth` argument is the `BandwidthLimiter`
+        shared by all the crawlers (optional).
         """
-        self._crawlers = [SiteCrawler(sites_info, tasks, results)
-                          for i in range(num_crawlers)]
+        site_ids = None
+        self._crawlers = []
+        if event_loop_sites > 0:
+            names = EventLoopCrawler.get_handler_names()
+            event_loop_ids = set()
+            for site_id, site_info in sites_info.iteritems():
+                if site_info.get('handler', site_info['url'].scheme) in names:
+                    event_loop_ids.add(site_id)
+            site_ids = set(sites_info.iterkeys()) - event_loop_ids
+            self._crawlers.append(EventLoopCrawler(sites_info,
+                                                   event_loop_sites, tasks,
+                                                   results, event_loop_ids,
+                                                   bandwidth))
+            logging.info('Using an event-loop crawler for %d sites (up to '
+                         '%d at the same time)' % (len(event_loop_ids),
+                                                   event_loop_sites))
+        self._crawlers.extend(SiteCrawler(sites_info, tasks, results,
+                                          contents, site_ids, bandwidth)
+                              for i in range(num_crawlers))
         if num_crawlers > 0:
             logging.info('Using %d site crawlers' % num_crawlers)
         else:
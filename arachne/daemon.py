@@ -26,12 +26,16 @@ import logging
 import signal
 
 from arachne import __version__
+from arachne.bandwidth import BandwidthLimiter
+from arachne.content import ContentManager
 from arachne.crawler import CrawlerManager
 from arachne.processor import ProcessorManager
 from arachne.result import ResultQueue
 from arachne.task import TaskQueue
 from arachne.url import URL
 from arachne.util.daemon import Daemon
+from arachne.util.inotify import InotifyError
+from arachne.watcher import DirectoryWatcher
 
 
 class ArachneDaemon(Daemon):
@@ -43,12 +47,18 @@ class ArachneDaemon(Daemon):
     """
 
     def __init__(self, sites, num_crawlers, spool_dir, database_dir, log_file,
-                 log_level, pid_file):
+                 log_level, pid_file, num_extractors=0,
+                 content_cache_size=100000, event_loop_sites=0, max_rate=0):
         """Initialize the daemon.
 
         Creates the `TaskQueue`, `ResultQueue`, `CrawlerManager` and
         `ProcessorManager` instances.  The `sites` argument should be a list
-        with the information for each site.
+        with the information for each site.  A `ContentManager` is created if
+        `num_extractors` is greater than zero and a `DirectoryWatcher` if a
+        local site should be watched.  See `CrawlerManager` for the
+        `event_loop_sites` argument.  A `BandwidthLimiter` is created if
+        `max_rate` (bytes per second for all the sites) or the `max_rate`
+        option of a site is greater than zero.
         """
         Daemon.__init__(self, pid_file=pid_file)
         logging.basicConfig(filename=log_file, level=log_level,
@@ -68,8 +78,15 @@ class ArachneDaemon(Daemon):
         self._tasks_dir = os.path.join(spool_dir, 'tasks')
         if not os.path.isdir(self._tasks_dir):
             os.mkdir(self._tasks_dir)
+        self._content_dir = os.path.join(spool_dir, 'content')
+        if num_extractors > 0 and not os.path.isdir(self._content_dir):
+            os.mkdir(self._content_dir)
         self._database_dir = database_dir
         self._num_crawlers = num_crawlers
+        self._num_extractors = num_extractors
+        self._content_cache_size = content_cache_size
+        self._event_loop_sites = event_loop_sites
+        self._max_rate = max_rate
         self._running = False
 
     def run(self):
@@ -78,27 +95,69 @@ class ArachneDaemon(Daemon):
         try:
             self._running = True
             # Initialize components.
+            if self._max_rate > 0 or [site_info for site_info
+                                      in self._sites_info.itervalues()
+                                      if site_info.get('max_rate', 0) > 0]:
+                bandwidth = BandwidthLimiter(self._sites_info, self._max_rate)
+            else:
+                bandwidth = None
+            if self._num_extractors > 0:
+                # Started before the crawler threads and before opening the
+                # queues, the worker processes are forked from this process
+                # and should not inherit the Berkeley DB environments.
+                contents = ContentManager(self._sites_info,
+                                          self._num_extractors,
+                                          self._content_dir,
+                                          self._content_cache_size,
+                                          bandwidth)
+                logging.info('Using %d content extractors'
+                             % self._num_extractors)
+            else:
+                contents = None
             tasks = TaskQueue(self._sites_info, self._tasks_dir)
             logging.info('There are %d tasks waiting for execution'
                          % len(tasks))
             results = ResultQueue(self._sites_info, self._results_dir)
             logging.info('There are %d results waiting for processing'
                          % len(results))
+            watcher = None
+            if [site_info for site_info in self._sites_info.itervalues()
+                if site_info.get('watch') and site_info['url'].scheme == 'file']:
+                try:
+                    watcher = DirectoryWatcher(self._sites_info, tasks)
+                except InotifyError, error:
+                    logging.error('Could not watch the local sites (%s), '
+                                  'polling them' % error.strerror)
             crawlers = CrawlerManager(self._sites_info, self._num_crawlers,
-                                      tasks, results)
+                                      tasks, results, contents,
+                                      self._event_loop_sites, bandwidth)
             processor = ProcessorManager(self._sites_info, self._database_dir,
                                          tasks, results)
             # Start components.
+            if watcher is not None:
+                watcher.start()
             crawlers.start()
             processor.start()
             # Run the main loop.
             while self._running:
                 signal.pause()
             # Stop and close components.
+            if watcher is not None:
+                watcher.stop()
             crawlers.stop()
             processor.stop()
+            if watcher is not None:
+                watcher.join()
             crawlers.join()
             processor.join()
+            if contents is not None:
+                contents.close()
+            if bandwidth is not None:
+                for site_id, site_info in self._sites_info.iteritems():
+                    seconds = bandwidth.get_throttled(site_id)
+                    if seconds > 0:
+                        logging.info('Transfers from "%s" throttled for %d '
+                                     'seconds' % (site_info['url'], seconds))
             results.close()
             tasks.close()
             logging.info('Daemon stopped, exiting')
@@ -32,3 +32,19 @@ class EmptyQueue(ArachneException):
     Exception raised by the `get()` methods of the `TaskQueue` and
     `ResultQueue` if no item is available.
     """
+
+
+class ContentError(ArachneException):
+    """Content extraction error.
+
+    Exception raised by the content extractors if the content of a file is
+    not valid or could not be read.
+    """
+
+
+class ListingError(ArachneException):
+    """Directory listing error.
+
+    Exception raised by the protocol handlers if the listing of a directory
+    can not be used (e.g. it is larger than the configured limit).
+    """
@@ -0,0 +1,1143 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Protocol handlers driven by an event loop.
+
+The handlers of this module execute the crawl tasks as coroutines using
+non-blocking sockets, allowing a single thread (the `EventLoopCrawler`) to
+contact many sites at the same time.  The coroutines are generators yielding
+the operations they wait for (see `Coroutine`).  The listings are parsed and
+reported using the code of the handlers of the `arachne.handler` module.
+"""
+
+import os
+import sys
+import time
+import zlib
+import types
+import heapq
+import socket
+import ftplib
+import httplib
+import asyncore
+import asynchat
+import logging
+import urlparse
+import mimetools
+import threading
+import cStringIO
+
+from arachne import __version__
+from arachne.error import ListingError
+from arachne.handler import FTPHandler, ApacheHandler
+from arachne.result import CrawlResult
+
+
+class EventLoop(object):
+    """Event loop.
+
+    Dispatches the events of the channels of the coroutines and runs the
+    functions scheduled with `call_later()`.  The `timeout` attribute is the
+    time a channel waits for activity before failing with `socket.timeout`,
+    the same timeout used by the sockets of the other handlers.
+    """
+
+    # Seconds the resolved addresses of the hosts are cached.
+    _ADDRESS_TTL = 300
+
+    # Seconds between the checks of the names being resolved.
+    _RESOLVE_POLL = 0.05
+
+    def __init__(self):
+        """Initialize the loop.
+        """
+        self.channels = {}
+        self.timeout = socket.getdefaulttimeout()
+        self._timers = []
+        # Addresses of each host and port, with the time they expire.
+        self._addresses = {}
+        # Coroutines waiting for each host and port being resolved by a
+        # helper thread, and the resolutions finished by the threads.
+        self._resolving = {}
+        self._resolved = []
+        self._resolved_mutex = threading.Lock()
+
+    def call_later(self, seconds, function, *args):
+        """Call the function with the given arguments after some seconds.
+        """
+        heapq.heappush(self._timers, (time.time() + seconds, function, args))
+
+    def sleep(self, seconds):
+        """Operation used by coroutines to wait some seconds.
+        """
+        def operation(coroutine):
+            self.call_later(seconds, coroutine.resume)
+        return operation
+
+    def resolve(self, host, port):
+        """Operation resolving the address of a host.
+
+        The value of the operation is the first address returned by
+        `socket.getaddrinfo()` for a stream socket.  Names of hosts are
+        resolved by helper threads, so a slow lookup does not stop the other
+        coroutines, and their addresses are cached for `_ADDRESS_TTL`
+        seconds.
+        """
+        def operation(coroutine):
+            key = (host, port)
+            try:
+                address = socket.getaddrinfo(host, port, 0,
+                                             socket.SOCK_STREAM, 0,
+                                             socket.AI_NUMERICHOST)[0]
+            except socket.gaierror:
+                # Not a numeric address.
+                address, expires = self._addresses.get(key, (None, 0))
+                if expires <= time.time():
+                    address = None
+            if address is not None:
+                self.call_later(0, coroutine.resume, address)
+            elif key in self._resolving:
+                self._resolving[key].append(coroutine)
+            else:
+                self._resolving[key] = [coroutine]
+                thread = threading.Thread(target=self._resolve, args=(key,))
+                thread.setDaemon(True)
+                thread.start()
+        return operation
+
+    def run_once(self, timeout):
+        """Dispatch the events ready during up to `timeout` seconds.
+
+        Returns earlier if a scheduled function should be called.
+        """
+        now = time.time()
+        if self._timers:
+            timeout = max(0, min(timeout, self._timers[0][0] - now))
+        if self._resolving:
+            timeout = min(timeout, self._RESOLVE_POLL)
+        if self.channels:
+            asyncore.loop(timeout, True, self.channels, 1)
+        else:
+            time.sleep(timeout)
+        self._deliver_resolved()
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            function, args = heapq.heappop(self._timers)[1:]
+            function(*args)
+        for channel in self.channels.values():
+            channel.check_timeout(now)
+
+    def close(self):
+        """Close all the channels.
+        """
+        for channel in self.channels.values():
+            channel.close()
+        self._timers = []
+
+    def _resolve(self, key):
+        """Resolve the address of a host and port in a helper thread.
+        """
+        host, port = key
+        try:
+            address = socket.getaddrinfo(host, port, 0,
+                                         socket.SOCK_STREAM)[0]
+        except socket.error, error:
+            resolution = (key, None, error)
+        else:
+            resolution = (key, address, None)
+        self._resolved_mutex.acquire()
+        try:
+            self._resolved.append(resolution)
+        finally:
+            self._resolved_mutex.release()
+
+    def _deliver_resolved(self):
+        """Resume the coroutines waiting for the resolved addresses.
+        """
+        self._resolved_mutex.acquire()
+        try:
+            resolved, self._resolved = self._resolved, []
+        finally:
+            self._resolved_mutex.release()
+        for key, address, error in resolved:
+            if address is not None:
+                self._addresses[key] = (address,
+                                        time.time() + self._ADDRESS_TTL)
+            for coroutine in self._resolving.pop(key, []):
+                coroutine.resume(address, error)
+
+
+class Coroutine(object):
+    """Coroutine executed by the event loop.
+
+    Wraps a generator that yields the operations it waits for.  An operation
+    is a callable receiving the coroutine, it should call `resume()` later
+    with the value the yield expression takes (or the exception it raises).
+    Generators can also yield another generator to run it as a subroutine,
+    which in turn can yield `Return` to give a value to the caller.
+    Exceptions not handled by the generators are logged.
+    """
+
+    def __init__(self, generator):
+        """Initialize the coroutine.
+        """
+        self._stack = [generator]
+
+    def start(self):
+        """Run the coroutine until it waits for the first operation.
+        """
+        self.resume()
+
+    def resume(self, value=None, error=None):
+        """Resume the coroutine with the value or error of an operation.
+        """
+        while self._stack:
+            generator = self._stack[-1]
+            try:
+                if error is None:
+                    request = generator.send(value)
+                else:
+                    request = generator.throw(error)
+            except StopIteration:
+                self._stack.pop()
+                value, error = None, None
+            except Exception, error:
+                self._stack.pop()
+                value = None
+                if not self._stack:
+                    logging.error('Unhandled exception in coroutine (%s: %s)'
+                                  % (error.__class__.__name__, error))
+            else:
+                value, error = None, None
+                if isinstance(request, types.GeneratorType):
+                    self._stack.append(request)
+                elif isinstance(request, Return):
+                    self._stack.pop()
+                    generator.close()
+                    value = request.value
+                else:
+                    try:
+                        request(self)
+                    except Exception, error:
+                        # Raise the error in the generator.
+                        continue
+                    return
+
+
+class Return(object):
+    """Value returned by a generator executed as a subroutine.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class _Channel(asynchat.async_chat):
+    """Connection used by a coroutine.
+
+    Coroutines wait for the operations of the channel.  Errors of the
+    connection are raised in the waiting coroutine (or in the next one that
+    waits), the channel is closed.  `socket.timeout` is raised if there is not
+    activity during the timeout of the event loop while a coroutine waits.
+
+    If `throttle` is not `None` it is called with the number of bytes
+    received and returns the seconds the channel should stop reading to keep
+    the bandwidth limits (see `arachne.bandwidth.BandwidthLimiter.reserve()`).
+    The `throttled` attribute counts the seconds the channel stopped reading.
+    """
+
+    def __init__(self, loop, throttle=None):
+        asynchat.async_chat.__init__(self, map=loop.channels)
+        self._loop = loop
+        self._timeout = loop.timeout
+        self._deadline = None
+        self._waiter = None
+        self._error = None
+        self._throttle = throttle
+        # Time when the channel can read again after being throttled.
+        self._paused = 0
+        self.throttled = 0
+
+    def connect_to(self, address):
+        """Start the connection to the given address.
+
+        The address is a tuple as returned by `socket.getaddrinfo()` (see
+        `EventLoop.resolve()`).
+        """
+        family, socktype, proto, canonname, sockaddr = address
+        self.create_socket(family, socktype)
+        self._touch()
+        self.connect(sockaddr)
+
+    def close(self):
+        if self.socket is not None:
+            asynchat.async_chat.close(self)
+
+    def check_timeout(self, now):
+        """Raise `socket.timeout` in the waiting coroutine if it timed out.
+        """
+        if (self._waiter is not None and now >= self._deadline
+            and now >= self._paused):
+            self._fail(socket.timeout('timed out'))
+
+    def readable(self):
+        return time.time() >= self._paused
+
+    def recv(self, buffer_size):
+        data = asynchat.async_chat.recv(self, buffer_size)
+        if data and self._throttle is not None:
+            delay = self._throttle(len(data))
+            if delay > 0:
+                self._paused = time.time() + delay
+                self.throttled += delay
+                # Wake up the loop when the channel can read again.
+                self._loop.call_later(delay, self._touch)
+        return data
+
+    def handle_connect(self):
+        self._touch()
+
+    def handle_read(self):
+        self._touch()
+        asynchat.async_chat.handle_read(self)
+
+    def initiate_send(self):
+        self._touch()
+        asynchat.async_chat.initiate_send(self)
+
+    def handle_close(self):
+        if self.connecting:
+            errno = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            self._fail(socket.error(errno, os.strerror(errno)))
+        else:
+            self._handle_eof()
+
+    def handle_error(self):
+        self._fail(sys.exc_info()[1])
+
+    def _handle_eof(self):
+        """Called when the connection is closed by the other end.
+        """
+        self._fail(EOFError())
+
+    def _fail(self, error):
+        """Close the channel and raise the error in the waiting coroutine.
+        """
+        if self._error is None:
+            self._error = error
+        self.close()
+        self._deliver()
+
+    def _wait(self, coroutine):
+        """Make the coroutine wait for the next value of the channel.
+        """
+        self._waiter = coroutine
+        self._touch()
+        self._deliver()
+
+    def _resume(self, value=None, error=None):
+        """Resume the waiting coroutine.
+        """
+        coroutine, self._waiter = self._waiter, None
+        coroutine.resume(value, error)
+
+    def _deliver(self):
+        """Resume the waiting coroutine if the value it waits is available.
+        """
+        if self._waiter is not None and self._error is not None:
+            self._resume(None, self._error)
+
+    def _touch(self):
+        """Restart the timeout after an activity of the connection.
+        """
+        self._deadline = time.time() + self._timeout
+
+
+class _FTPChannel(_Channel):
+    """Control connection of a FTP session.
+
+    The replies are checked as in `ftplib.FTP.sendcmd()`, raising
+    `ftplib.error_temp`, `ftplib.error_perm` or `ftplib.error_proto`.
+    """
+
+    def __init__(self, loop, throttle=None):
+        _Channel.__init__(self, loop, throttle)
+        self.set_terminator('\n')
+        self._data = []
+        self._lines = []
+        self._replies = []
+
+    def command(self, line):
+        """Operation sending a command and waiting for its reply.
+        """
+        def operation(coroutine):
+            if self._error is None:
+                self.push(line + '\r\n')
+            self._wait(coroutine)
+        return operation
+
+    def reply(self):
+        """Operation waiting for the next reply.
+        """
+        return self._wait
+
+    def reusable(self):
+        """Check if the session can be used for the next commands.
+        """
+        return self.connected and not self._replies and not self._lines
+
+    def quit(self):
+        """Close the session without waiting for the reply.
+        """
+        if self._error is None and self.connected:
+            self.push('QUIT\r\n')
+            self.close_when_done()
+        else:
+            self.close()
+
+    def collect_incoming_data(self, data):
+        self._data.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self._data).rstrip('\r')
+        self._data = []
+        self._lines.append(line)
+        first = self._lines[0]
+        if first[3:4] != '-' or (len(self._lines) > 1 and line[:3] == first[:3]
+                                 and line[3:4] != '-'):
+            self._replies.append('\n'.join(self._lines))
+            self._lines = []
+            self._deliver()
+
+    def _deliver(self):
+        if self._waiter is not None and self._replies:
+            reply = self._replies.pop(0)
+            code = reply[:1]
+            if code == '4':
+                self._resume(None, ftplib.error_temp(reply))
+            elif code == '5':
+                self._resume(None, ftplib.error_perm(reply))
+            elif code not in ('1', '2', '3'):
+                self._resume(None, ftplib.error_proto(reply))
+            else:
+                self._resume(reply)
+        else:
+            _Channel._deliver(self)
+
+
+class _DataChannel(_Channel):
+    """Data connection of a FTP session.
+    """
+
+    def __init__(self, loop, throttle=None):
+        _Channel.__init__(self, loop, throttle)
+        self.set_terminator(None)
+        self._chunks = []
+        self._done = False
+
+    def read_all(self):
+        """Operation waiting for all the data sent until the connection is
+        closed.
+        """
+        return self._wait
+
+    def collect_incoming_data(self, data):
+        self._chunks.append(data)
+
+    def _handle_eof(self):
+        # Read the data received before the connection was closed.
+        try:
+            while True:
+                data = self.socket.recv(self.ac_in_buffer_size)
+                if not data:
+                    break
+                self.ac_in_buffer += data
+        except socket.error:
+            pass
+        if self.ac_in_buffer:
+            if self._throttle is not None:
+                self._throttle(len(self.ac_in_buffer))
+            self.collect_incoming_data(self.ac_in_buffer)
+            self.ac_in_buffer = ''
+        self._done = True
+        self.close()
+        self._deliver()
+
+    def _deliver(self):
+        if self._waiter is not None and self._done:
+            self._resume(''.join(self._chunks))
+        else:
+            _Channel._deliver(self)
+
+
+class _HTTPChannel(_Channel):
+    """Connection used for a HTTP/1.0 request.
+    """
+
+    def __init__(self, loop, throttle=None):
+        _Channel.__init__(self, loop, throttle)
+        self.set_terminator('\r\n\r\n')
+        self._data = []
+        self._response = None
+        self._body = False
+        self._chunks = []
+        self._done = False
+
+    def request(self, path, headers):
+        """Operation sending a GET request and waiting for the response.
+
+        The value of the operation is a tuple with the status code, the
+        reason phrase and the headers of the response (`mimetools.Message`).
+        """
+        def operation(coroutine):
+            if self._error is None:
+                lines = ['GET %s HTTP/1.0' % path]
+                lines.extend('%s: %s' % header for header in headers)
+                self.push('\r\n'.join(lines) + '\r\n\r\n')
+            self._wait(coroutine)
+        return operation
+
+    def read(self):
+        """Operation waiting for the next chunk of the body.
+
+        The empty string is the value at the end of the body.
+        """
+        return self._wait
+
+    def collect_incoming_data(self, data):
+        if self._body:
+            self._chunks.append(data)
+        else:
+            self._data.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._data)
+        self._data = []
+        status_line, headers = (data.split('\r\n', 1) + [''])[:2]
+        try:
+            version, status, reason = (status_line.split(None, 2) + [''])[:3]
+            if not version.startswith('HTTP/'):
+                raise ValueError('Invalid version.')
+            status = int(status)
+        except ValueError:
+            self._fail(httplib.BadStatusLine(status_line))
+        else:
+            headers = mimetools.Message(cStringIO.StringIO(headers + '\r\n'))
+            self._response = (status, reason.strip(), headers)
+            self._body = True
+            self.set_terminator(None)
+            self._deliver()
+
+    def _handle_eof(self):
+        if not self._body:
+            _Channel._handle_eof(self)
+        else:
+            self._done = True
+            self.close()
+            self._deliver()
+
+    def _deliver(self):
+        if self._waiter is None:
+            return
+        if self._response is not None:
+            response, self._response = self._response, None
+            self._resume(response)
+        elif self._chunks:
+            data = ''.join(self._chunks)
+            self._chunks = []
+            self._resume(data)
+        elif self._done:
+            self._resume('')
+        else:
+            _Channel._deliver(self)
+
+
+class AsyncProtocolHandler(object):
+    """Protocol handler driven by an event loop.
+
+    Abstract class that should be subclassed by the handlers used by the
+    `EventLoopCrawler`.  The subclasses should set the `name` class
+    attribute, the name of the equivalent handler of the `SiteCrawler`.
+    """
+
+    name = ''
+
+    def __init__(self, sites_info, tasks, results, loop, bandwidth=None):
+        """Initialize the protocol handler.
+
+        The `loop` argument is the `EventLoop` running the coroutines and
+        `bandwidth` the `BandwidthLimiter` used to throttle the transfers
+        (`None` if the bandwidth is not limited).
+        """
+
+    def execute_batch(self, tasks, wait, callback):
+        """Start the execution of a batch of tasks for the same site.
+
+        The tasks are executed one after another waiting `wait` seconds
+        between them and reported as described in
+        `arachne.handler.ProtocolHandler.execute()`.  `callback` is called
+        without arguments once all the tasks are reported.
+        """
+        raise NotImplementedError('A subclass must override this method.')
+
+    def close(self):
+        """Release the resources used by the handler.
+        """
+
+    def _get_throttle(self, site_id):
+        """Return the function throttling the channels of a site.
+
+        `None` is returned if the handler does not limit the bandwidth.
+        """
+        if self._bandwidth is None:
+            return None
+        return lambda size: self._bandwidth.reserve(site_id, size)
+
+    @staticmethod
+    def _elapsed(start, throttled):
+        """Return the seconds since `start` without the delays of the
+        bandwidth limits.
+
+        `throttled` is the time the channels used since `start` stopped
+        reading (see `_Channel`).  Used to time the responses of the site.
+        """
+        return time.time() - start - throttled
+
+
+class AsyncFTPHandler(AsyncProtocolHandler):
+    """Handler for FTP sites.
+
+    Equivalent to `arachne.handler.FTPHandler`.  Logged-in sessions are kept
+    open between the batches of a site during `session_timeout` seconds.
+    """
+
+    name = 'ftp'
+
+    def __init__(self, sites_info, tasks, results, loop, bandwidth=None):
+        """Initialize the handler.
+        """
+        self._encoding = 'utf-8'
+        self._sites_info = sites_info
+        self._tasks = tasks
+        self._results = results
+        self._loop = loop
+        self._bandwidth = bandwidth
+        self._helper = FTPHandler(sites_info, tasks, results)
+        # Idle sessions of each site and the time they were released.
+        self._sessions = {}
+
+    def execute_batch(self, tasks, wait, callback):
+        """Start the execution of a batch of tasks using the same session.
+        """
+        Coroutine(self._execute_batch(tasks, wait, callback)).start()
+
+    def close(self):
+        """Close the idle sessions.
+        """
+        for sessions in self._sessions.itervalues():
+            for channel, released in sessions:
+                channel.close()
+        self._sessions.clear()
+
+    def _execute_batch(self, tasks, wait, callback):
+        """Coroutine executing a batch of tasks.
+
+        If the site becomes unreachable the remaining tasks of the batch are
+        reported as errors contacting the site.
+        """
+        try:
+            channel = self._get_session(tasks[0].site_id)
+            for i, task in enumerate(tasks):
+                if i > 0:
+                    yield self._loop.sleep(wait)
+                channel, site_error = yield self._execute(channel, task)
+                if site_error:
+                    for task in tasks[i + 1:]:
+                        self._tasks.report_error_site(task)
+                    break
+            if channel is not None:
+                self._release_session(tasks[0].site_id, channel)
+        finally:
+            callback()
+
+    def _execute(self, channel, task):
+        """Execute the task using the given session.
+
+        If `channel` is `None` a new session is opened.  It returns a tuple
+        like `arachne.handler.FTPHandler._execute()`.
+        """
+        url = task.url
+        start = time.time()
+        # Throttled time of the session before the task.
+        throttled = channel.throttled if channel is not None else 0
+        try:
+            results = None
+            if channel is not None:
+                try:
+                    results = yield self._visit(channel, task)
+                except socket.timeout:
+                    raise
+                except (socket.error, EOFError):
+                    # The session was closed by the server after the last
+                    # command.  Retry using a fresh connection.
+                    channel.close()
+                    channel = None
+            if results is None:
+                channel = _FTPChannel(self._loop,
+                                      self._get_throttle(task.site_id))
+                throttled = 0
+                yield self._connect(channel, url)
+                results = yield self._visit(channel, task)
+        except socket.timeout, error:
+            self._close_session(channel)
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+            yield Return((None, True))
+        except socket.error, error:
+            self._close_session(channel)
+            self._tasks.report_error_site(task)
+            if not isinstance(error, basestring):
+                error = error[-1]
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+            yield Return((None, True))
+        except EOFError:
+            self._close_session(channel)
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (Error reading data)' % url)
+            yield Return((None, True))
+        except ftplib.Error, error:
+            self._close_session(channel)
+            self._tasks.report_response_time(
+                task, self._elapsed(start, channel.throttled - throttled))
+            self._tasks.report_error_dir(task)
+            msg = 'Error visiting "%s" (%s)' % (url, str(error).strip())
+            logging.error(msg)
+            yield Return((None, False))
+        else:
+            self._tasks.report_response_time(
+                task, self._elapsed(start, channel.throttled - throttled))
+            self._helper._put_results(results)
+            self._tasks.report_done(task)
+            yield Return((channel, False))
+
+    def _get_session(self, site_id):
+        """Return an idle session of the site or `None`.
+        """
+        sessions = self._sessions.get(site_id, [])
+        max_idle = self._sites_info[site_id].get('session_timeout', 0)
+        now = time.time()
+        while sessions:
+            channel, released = sessions.pop()
+            if channel.reusable() and now - released < max_idle:
+                return channel
+            channel.quit()
+        return None
+
+    def _release_session(self, site_id, channel):
+        """Keep the session for the next batch or close it.
+        """
+        max_idle = self._sites_info[site_id].get('session_timeout', 0)
+        if max_idle > 0:
+            self._sessions.setdefault(site_id, []).append((channel,
+                                                           time.time()))
+            self._loop.call_later(max_idle, self._expire_sessions, site_id)
+        else:
+            channel.quit()
+
+    def _expire_sessions(self, site_id):
+        """Close the sessions of the site idle for too long.
+        """
+        max_idle = self._sites_info[site_id].get('session_timeout', 0)
+        now = time.time()
+        sessions = []
+        for channel, released in self._sessions.pop(site_id, []):
+            if channel.reusable() and now - released < max_idle:
+                sessions.append((channel, released))
+            else:
+                channel.quit()
+        if sessions:
+            self._sessions[site_id] = sessions
+
+    def _close_session(self, channel):
+        """Close a session that will not be reused.
+        """
+        if channel is not None:
+            channel.quit()
+
+    def _connect(self, channel, url):
+        """Coroutine opening a new session for the given URL.
+        """
+        address = yield self._loop.resolve(url.hostname.encode(self._encoding),
+                                           url.port or ftplib.FTP_PORT)
+        channel.connect_to(address)
+        yield channel.reply()
+        if url.username:
+            user = url.username.encode(self._encoding)
+            password = url.password.encode(self._encoding)
+        else:
+            user, password = 'anonymous', 'anonymous@'
+        reply = yield channel.command('USER %s' % user)
+        if reply[0] == '3':
+            reply = yield channel.command('PASS %s' % password)
+        if reply[0] != '2':
+            raise ftplib.error_reply(reply)
+
+    def _visit(self, channel, task):
+        """Coroutine listing the directory of the task.
+
+        It returns a list of results as `arachne.handler.FTPHandler._visit()`.
+        """
+        url = task.url
+        path = url.path.encode(self._encoding)
+        try:
+            yield self._void(channel, 'CWD %s' % path)
+        except ftplib.error_perm:
+            # Failed to change directory.
+            yield Return([CrawlResult(task, False)])
+        # It seems to be a valid directory.
+        site_info = self._sites_info[task.site_id]
+        results = []
+        if self._helper._is_recursive(task):
+            command = site_info.get('recursive_command', 'LIST -R')
+            tree = yield self._list_tree(channel, command, path,
+                                         task.site_id)
+            for subtask, entries in self._helper._walk_tree(
+                    task, tree, site_info['max_depth']):
+                result = yield self._create_result(channel, subtask, entries)
+                results.append(result)
+        else:
+            entries = yield self._list(channel, task.site_id)
+            result = yield self._create_result(channel, task, entries)
+            results.append(result)
+        yield Return(results)
+
+    def _create_result(self, channel, task, entries):
+        """Coroutine creating the result for the task.
+
+        See `arachne.handler.FTPHandler._create_result()`.
+        """
+        url = task.url
+        result = CrawlResult(task, True)
+        probes = {}
+        for entry_name, is_dir, line, facts in entries:
+            data = dict(facts)
+            if is_dir is None:
+                try:
+                    probed_line, is_dir = task.probes[entry_name]
+                    if probed_line != line:
+                        is_dir = None
+                except KeyError:
+                    pass
+                if is_dir is None:
+                    is_dir = yield self._probe(channel, url.join(entry_name))
+                probes[entry_name] = (line, is_dir)
+            data['is_dir'] = is_dir
+            result.add_entry(entry_name, data)
+        task.probes = probes
+        yield Return(result)
+
+    def _probe(self, channel, url):
+        """Coroutine checking if the given URL is a directory.
+        """
+        try:
+            yield self._void(channel, 'CWD %s'
+                             % url.path.encode(self._encoding))
+        except ftplib.error_perm:
+            yield Return(False)
+        else:
+            yield Return(True)
+
+    def _list_tree(self, channel, command, path, site_id):
+        """Coroutine returning the entries of the subtree of the current
+        directory.
+
+        See `arachne.handler.FTPHandler._list_tree()`.
+        """
+        if command.split()[0].upper() == 'STAT':
+            reply = yield channel.command(command)
+            lines = reply.splitlines()[1:-1]
+        else:
+            data = yield self._retrieve(channel, command, site_id)
+            lines = data.splitlines()
+        yield Return(self._helper._parse_tree(lines, path))
+
+    def _list(self, channel, site_id):
+        """Coroutine returning the entries of the current directory.
+
+        See `arachne.handler.FTPHandler._list()`.
+        """
+        features = yield self._get_features(channel, site_id)
+        if 'MLST' in features:
+            try:
+                data = yield self._retrieve(channel, 'MLSD', site_id)
+            except ftplib.error_perm:
+                features.discard('MLST')
+            else:
+                entries = []
+                for line in data.splitlines():
+                    entry = self._helper._parse_mlsd(line)
+                    if entry is not None:
+                        entries.append(entry[:2] + (line, entry[2]))
+                yield Return(entries)
+        data = yield self._retrieve(channel, 'LIST', site_id)
+        yield Return(self._helper._parse_listing(site_id, data))
+
+    def _get_features(self, channel, site_id):
+        """Coroutine returning the extensions supported by the server.
+
+        The features are shared with `arachne.handler.FTPHandler`.
+        """
+        features = FTPHandler._features.get(site_id)
+        if features is None:
+            features = set()
+            try:
+                reply = yield channel.command('FEAT')
+            except ftplib.error_perm:
+                pass
+            else:
+                for line in reply.splitlines()[1:-1]:
+                    words = line.split()
+                    if words:
+                        features.add(words[0].upper())
+            FTPHandler._features[site_id] = features
+        yield Return(features)
+
+    def _retrieve(self, channel, command, site_id):
+        """Coroutine returning the whole response to a listing command.
+
+        A passive data connection is used, as in `ftplib`.
+        """
+        yield self._void(channel, 'TYPE I')
+        if channel.socket.family == socket.AF_INET:
+            reply = yield channel.command('PASV')
+            host, port = ftplib.parse227(reply)
+        else:
+            reply = yield channel.command('EPSV')
+            host, port = ftplib.parse229(reply, channel.socket.getpeername())
+        data_channel = _DataChannel(self._loop, self._get_throttle(site_id))
+        try:
+            address = yield self._loop.resolve(host, port)
+            data_channel.connect_to(address)
+            reply = yield channel.command(command)
+            if reply[0] != '1':
+                raise ftplib.error_reply(reply)
+            data = yield data_channel.read_all()
+        finally:
+            data_channel.close()
+            # Counted as throttled time of the session.
+            channel.throttled += data_channel.throttled
+        reply = yield channel.reply()
+        if reply[0] != '2':
+            raise ftplib.error_reply(reply)
+        yield Return(data)
+
+    @staticmethod
+    def _void(channel, command):
+        """Coroutine sending a command that should be completed.
+        """
+        reply = yield channel.command(command)
+        if reply[0] != '2':
+            raise ftplib.error_reply(reply)
+
+
+class AsyncApacheHandler(AsyncProtocolHandler):
+    """Handler for sites using Apache autoindex.
+
+    Equivalent to `arachne.handler.ApacheHandler`.  Each directory page is
+    requested using a new HTTP/1.0 connection.
+    """
+
+    name = 'apache'
+
+    # Status codes of the redirections followed, and the maximum number of
+    # redirections for a page (the same used by urllib2).
+    _REDIRECTIONS = (301, 302, 303, 307)
+    _MAX_REDIRECTIONS = 10
+
+    def __init__(self, sites_info, tasks, results, loop, bandwidth=None):
+        """Initialize the handler.
+        """
+        self._encoding = 'utf-8'
+        self._sites_info = sites_info
+        self._tasks = tasks
+        self._results = results
+        self._loop = loop
+        self._bandwidth = bandwidth
+        self._helper = ApacheHandler(sites_info, tasks, results)
+
+    def execute_batch(self, tasks, wait, callback):
+        """Start the execution of a batch of tasks.
+        """
+        Coroutine(self._execute_batch(tasks, wait, callback)).start()
+
+    def close(self):
+        """Log the number of bytes transferred.
+        """
+        self._helper.close()
+
+    def _execute_batch(self, tasks, wait, callback):
+        """Coroutine executing a batch of tasks.
+        """
+        try:
+            for i, task in enumerate(tasks):
+                if i > 0:
+                    yield self._loop.sleep(wait)
+                yield self._execute(task)
+        finally:
+            callback()
+
+    def _execute(self, task):
+        """Coroutine executing a task.
+
+        The errors are reported as in `arachne.handler.ApacheHandler`.
+        """
+        url = task.url
+        location = self._helper._encode_url(url) + '/'
+        channel = None
+        start = time.time()
+        # Throttled time of the channels of the redirections.
+        throttled = 0
+        try:
+            for i in xrange(self._MAX_REDIRECTIONS + 1):
+                if channel is not None:
+                    throttled += channel.throttled
+                    channel.close()
+                channel, status, reason, response_headers = \
+                    yield self._request(task, location)
+                if (status not in self._REDIRECTIONS
+                    or 'location' not in response_headers):
+                    break
+                # Follow the redirection as urllib2 does.
+                location = urlparse.urljoin(location,
+                                            response_headers['location'])
+            if 200 <= status < 300:
+                max_size = self._sites_info[task.site_id]['max_page_size']
+                result = yield self._read_page(channel, task,
+                                               response_headers, max_size)
+            self._tasks.report_response_time(
+                task, self._elapsed(start, throttled + channel.throttled))
+            if status == 304:
+                # The directory was not modified since the last visit.
+                self._tasks.report_done(task)
+                self._tasks.put_visited(task, False, task.modified)
+            elif status == 404:
+                # The directory does not exists.
+                self._results.put(CrawlResult(task, False))
+                self._tasks.report_done(task)
+            elif not 200 <= status < 300:
+                self._tasks.report_error_dir(task)
+                logging.error('Error visiting "%s" (%s: %s)'
+                              % (url, status, reason))
+            else:
+                task.validators = self._helper._get_validators(
+                    response_headers)
+                self._results.put(result)
+                self._tasks.report_done(task)
+        except socket.timeout, error:
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+        except socket.error, error:
+            self._tasks.report_error_site(task)
+            if not isinstance(error, basestring):
+                error = error[-1]
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+        except (EOFError, httplib.HTTPException):
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (Error reading data)' % url)
+        except zlib.error, error:
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (Invalid compressed data: %s)'
+                          % (url, error))
+        except ListingError, error:
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+        finally:
+            if channel is not None:
+                channel.close()
+
+    def _request(self, task, location):
+        """Coroutine requesting a directory page.
+
+        It returns a tuple with a new channel, the status code, the reason
+        phrase and the headers of the response.  Only HTTP locations are
+        supported, `ListingError` is raised for redirections to others.
+        """
+        split_location = urlparse.urlsplit(location)
+        if split_location.scheme != 'http':
+            raise ListingError('Redirection to "%s" not supported.'
+                               % location)
+        path = split_location.path or '/'
+        if split_location.query:
+            path += '?' + split_location.query
+        headers = [('Host', split_location.netloc),
+                   ('User-agent', 'Arachne/%s' % __version__),
+                   ('Accept-encoding', 'gzip, deflate'),
+                   ('Connection', 'close')]
+        headers.extend(task.validators.iteritems())
+        channel = _HTTPChannel(self._loop, self._get_throttle(task.site_id))
+        try:
+            address = yield self._loop.resolve(
+                split_location.hostname,
+                split_location.port or httplib.HTTP_PORT)
+            channel.connect_to(address)
+            status, reason, response_headers = \
+                yield channel.request(path, headers)
+        except Exception:
+            channel.close()
+            raise
+        yield Return((channel, status, reason, response_headers))
+
+    def _read_page(self, channel, task, headers, max_size):
+        """Coroutine reading and parsing the directory page.
+
+        See `arachne.handler.ApacheHandler._read_page()`.
+        """
+        decompressor = self._helper._get_decompressor(headers)
+        result = CrawlResult(task, True)
+        received = decoded = 0
+        pending = ''
+        try:
+            while True:
+                data = yield channel.read()
+                if data:
+                    received += len(data)
+                    if decompressor is None:
+                        chunk = data
+                    else:
+                        chunk = decompressor.decompress(data,
+                                                        max_size - decoded + 1)
+                elif decompressor is not None:
+                    chunk = decompressor.flush()
+                else:
+                    chunk = ''
+                decoded += len(chunk)
+                if decoded > max_size:
+                    raise ListingError('The page is larger than %d bytes.'
+                                       % max_size)
+                if not data:
+                    break
+                chunk = pending + chunk
+                end = chunk.rfind('\n') + 1
+                self._helper._parse_lines(result, chunk, end)
+                pending = chunk[end:]
+        finally:
+            self._helper._count_transferred(task, received, decoded)
+        pending += chunk
+        self._helper._parse_lines(result, pending, len(pending))
+        yield Return(result)
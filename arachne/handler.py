@@ -29,15 +29,29 @@ socket.setdefaulttimeout(5 * 60)
 
 import os
 import re
+import time
+import zlib
 import errno
+import calendar
 import ftplib
 import urllib
 import urllib2
+import urlparse
 import logging
+import threading
+import subprocess
+import email.utils
 import htmlentitydefs
+import xml.etree.cElementTree as ElementTree
 
-from arachne import __version__
+from arachne import listing
+from arachne import content
+from arachne.error import ListingError
+from arachne.pool import FTPConnectionPool, HTTPConnectionPool
+from arachne.pool import build_http_opener
 from arachne.result import CrawlResult
+from arachne.task import CrawlTask
+from arachne.util import dirent
 
 
 class ProtocolHandler(object):
@@ -52,12 +66,21 @@ class ProtocolHandler(object):
 
     name = ''
 
-    def __init__(self, sites_info, tasks, results):
+    # Seconds the transfers of the handler slept in the functions returned
+    # by `_get_throttle()`.  Each crawler has its own handlers.
+    _throttled = 0
+
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
         """Initialize the protocol handler.
 
         The `sites_info` argument will be a dictionary mapping site ID to the
         information for the sites.  This can be useful to support advanced
-        settings for a site (e.g. proxy server).
+        settings for a site (e.g. proxy server).  The `contents` argument is
+        the `ContentManager` used to extract the content of the files, if
+        `None` handlers that index the content of files extract it inline.
+        The `bandwidth` argument is the `BandwidthLimiter` used to throttle
+        the transfers, `None` if the bandwidth is not limited.
         """
 
     def execute(self, task):
@@ -71,6 +94,127 @@ class ProtocolHandler(object):
         """
         raise NotImplementedError('A subclass must override this method.')
 
+    def execute_batch(self, tasks, wait):
+        """Execute a batch of tasks for the same site.
+
+        The tasks are executed one after another waiting `wait` seconds
+        between them.  Each task should be reported as in `execute()`.
+        Subclasses can override this method to share a connection between the
+        tasks of the batch.
+        """
+        for i, task in enumerate(tasks):
+            if i > 0:
+                time.sleep(wait)
+            self.execute(task)
+
+    def close(self):
+        """Release the resources used by the handler.
+
+        This method is invoked by the `SiteCrawler` when it stops.
+        """
+
+    def _get_throttle(self, site_id):
+        """Return a function throttling the transfers from a site.
+
+        The function should be called with the number of bytes received, it
+        waits if the bandwidth limits are exceeded.  `None` is returned if
+        the handler does not limit the bandwidth.
+        """
+        if self._bandwidth is None:
+            return None
+        def throttle(size):
+            self._throttled += self._bandwidth.throttle(site_id, size)
+        return throttle
+
+    def _clock(self):
+        """Return the current time without the delays of the bandwidth limits.
+
+        It is the current time minus the time the transfers of the handler
+        were throttled, used to time the responses of the site.
+        """
+        return time.time() - self._throttled
+
+    def _is_recursive(self, task):
+        """Check if the directory of the task should be listed recursively.
+
+        Only the first visit to the directory set in the `recursive_list`
+        option of the site is recursive.  The subdirectories are revisited
+        using independent tasks.
+        """
+        site_info = self._sites_info[task.site_id]
+        path = site_info.get('recursive_list')
+        if not path or task.revisit_count != -1:
+            return False
+        if not isinstance(path, unicode):
+            path = path.decode(self._encoding)
+        return task.url.path == u'/' + path.strip(u'/')
+
+    def _walk_tree(self, task, tree, max_depth):
+        """Walk the directories of a recursive listing.
+
+        `tree` should be a dictionary mapping the paths of the directories,
+        relative to the directory of the task (the empty string for the
+        directory itself), to lists of entries.  The entries are tuples where
+        the first two items are the name and a Boolean value indicating if it
+        is a directory.  It yields a tuple with a task and its entries for the
+        directory of the task and each subdirectory reachable from it, up to
+        `max_depth`.  Parents are always yielded before their children.
+        """
+        pending = [(task, '')]
+        while pending:
+            task, path = pending.pop(0)
+            entries = tree[path]
+            yield task, entries
+            for entry in entries:
+                name, is_dir = entry[0], entry[1]
+                subpath = '%s/%s' % (path, name) if path else name
+                if is_dir and subpath in tree:
+                    url = task.url.join(name)
+                    if url.path.count(u'/') <= max_depth:
+                        subtask = CrawlTask(task.site_id, url)
+                        pending.append((subtask, subpath))
+
+    def _tree_results(self, task, tree):
+        """Return the results of the directories of a recursive listing.
+
+        `tree` should be a dictionary as described in `_walk_tree()`, with
+        the entries as tuples of the name, a Boolean value indicating if it
+        is a directory and a dictionary with the data of the entry.  The
+        first result is the one of the directory of the task.
+        """
+        max_depth = self._sites_info[task.site_id]['max_depth']
+        results = []
+        for subtask, entries in self._walk_tree(task, tree, max_depth):
+            result = CrawlResult(subtask, True)
+            for entry_name, is_dir, data in entries:
+                data['is_dir'] = is_dir
+                result.add_entry(entry_name, data)
+            results.append(result)
+        return results
+
+    def _put_results(self, results):
+        """Put the results of a task in the `ResultQueue`.
+
+        The first result should be the one of the executed task, the others
+        the results of the subdirectories listed recursively.  These
+        subdirectories are reported to the `TaskQueue` as already listed.
+        """
+        for result in results[1:]:
+            self._tasks.report_listed(result.task)
+        for result in results:
+            self._results.put(result)
+
+    def _encode_url(self, url):
+        """Return the encoded URL, without the trailing slash.
+
+        Used by the handlers for HTTP based protocols.  The path is encoded
+        using the `_encoding` attribute of the handler.
+        """
+        encoded_url = str(url)
+        path_encoded = url.path.encode(self._encoding)
+        return '%s%s' % (encoded_url[:-len(path_encoded)],
+                         urllib.quote(path_encoded.rstrip('/')))
+
 
 class FileHandler(ProtocolHandler):
     """Handler for local files.
@@ -78,7 +222,8 @@ class FileHandler(ProtocolHandler):
 
     name = 'file'
 
-    def __init__(self, sites_info, tasks, results):
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
         """Initialize handler.
         """
         self._tasks = tasks
@@ -92,10 +237,15 @@ class FileHandler(ProtocolHandler):
         try:
             if os.path.isdir(url.path):
                 result = CrawlResult(task, True)
-                for entry_name in os.listdir(url.path):
+                for entry_name, entry_type in dirent.scandir(url.path):
                     data = {}
                     entry_url = url.join(entry_name)
-                    data['is_dir'] = os.path.isdir(entry_url.path)
+                    if entry_type in (dirent.DIR, dirent.FILE):
+                        data['is_dir'] = (entry_type == dirent.DIR)
+                    else:
+                        # Symbolic links are followed, the type of the target
+                        # is needed.
+                        data['is_dir'] = os.path.isdir(entry_url.path)
                     result.add_entry(entry_url.basename, data)
             else:
                 result = CrawlResult(task, False)
@@ -119,200 +269,521 @@ class FTPHandler(ProtocolHandler):
 
     name = 'ftp'
 
-    def __init__(self, sites_info, tasks, results):
+    # Logged-in sessions shared by the handlers of all the site crawlers.
+    _sessions = FTPConnectionPool()
+
+    # Extensions supported by the FTP server of each site.
+    _features = {}
+
+    # Parser for the LIST format used by the FTP server of each site.
+    _parsers = {}
+
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
         """Initialize the handler.
         """
         self._encoding = 'utf-8'
+        self._sites_info = sites_info
         self._tasks = tasks
         self._results = results
+        self._contents = contents
+        self._bandwidth = bandwidth
 
     def execute(self, task):
         """Execute the task and return the result.
         """
+        self.execute_batch([task], 0)
+
+    def execute_batch(self, tasks, wait):
+        """Execute a batch of tasks using the same session.
+
+        If the site becomes unreachable the remaining tasks of the batch are
+        reported as errors contacting the site.
+        """
+        ftp = self._get_session(tasks[0])
+        for i, task in enumerate(tasks):
+            if i > 0:
+                time.sleep(wait)
+            ftp, site_error = self._execute(ftp, task)
+            if site_error:
+                for task in tasks[i + 1:]:
+                    self._tasks.report_error_site(task)
+                break
+        if ftp is not None:
+            self._release_session(tasks[0], ftp)
+
+    def _execute(self, ftp, task):
+        """Execute the task using the given session.
+
+        If `ftp` is `None` a new session is opened.  It returns a tuple with
+        the session that can be used for the next task (`None` if it was
+        closed) and a Boolean value indicating if there was an error contacting
+        the site.
+        """
         url = task.url
+        start = self._clock()
         try:
-            ftp = ftplib.FTP()
-            if url.port:
-                ftp.connect(url.hostname.encode(self._encoding), url.port)
-            else:
-                ftp.connect(url.hostname.encode(self._encoding))
-            if url.username:
-                ftp.login(url.username.encode(self._encoding),
-                          url.password.encode(self._encoding))
-            else:
-                ftp.login()
-            try:
-                ftp.cwd(url.path.encode(self._encoding))
-            except ftplib.error_perm:
-                # Failed to change directory.
-                result = CrawlResult(task, False)
-            else:
-                # It seems to be a valid directory.
-                result = CrawlResult(task, True)
-                entries = []
-                callback = lambda line: entries.append(self._parse_list(line))
-                ftp.retrlines('LIST', callback)
-                for entry_name, is_dir in (entry for entry in entries
-                                           if entry is not None):
-                    data = {}
-                    if is_dir is not None:
-                        data['is_dir'] = is_dir
-                    else:
-                        # The parser does not known if this entry is a
-                        # directory or not.  Try to change directory, if error,
-                        # assume it is a file.
-                        try:
-                            entry_url = url.join(entry_name)
-                            ftp.cwd(entry_url.path.encode(self._encoding))
-                        except ftplib.error_perm:
-                            data['is_dir'] = False
-                        else:
-                            data['is_dir'] = True
-                    if not data['is_dir']:
-                        content = self._get_content(str(task.url.join(entry_name)))
-                        if content:
-                            data['content'] = content
-                    result.add_entry(entry_name, data)
-            ftp.quit()
+            results = None
+            if ftp is not None:
+                try:
+                    results = self._visit(ftp, task)
+                except socket.timeout:
+                    raise
+                except (socket.error, EOFError):
+                    # The session was closed by the server after the last
+                    # command.  Retry using a fresh connection.
+                    ftp.close()
+                    ftp = None
+            if results is None:
+                ftp = self._connect(url)
+                results = self._visit(ftp, task)
         except socket.timeout, error:
+            self._close_session(ftp)
             self._tasks.report_error_site(task)
             logging.error('Error visiting "%s" (%s)' % (url, error))
+            return None, True
         except socket.error, error:
+            self._close_session(ftp)
             self._tasks.report_error_site(task)
             if not isinstance(error, basestring):
                 error = error[1]
             logging.error('Error visiting "%s" (%s)' % (url, error))
+            return None, True
         except IOError, error:
+            self._close_session(ftp)
             self._tasks.report_error_site(task)
             logging.error('Error visiting "%s" (%s)' % (url, error.strerror))
+            return None, True
         except EOFError:
-            ftp.close()
+            self._close_session(ftp)
             self._tasks.report_error_site(task)
             logging.error('Error visiting "%s" (Error reading data)' % url)
+            return None, True
         except ftplib.Error, error:
+            self._close_session(ftp)
+            self._tasks.report_response_time(task, self._clock() - start)
+            self._tasks.report_error_dir(task)
+            msg = 'Error visiting "%s" (%s)' % (url, str(error).strip())
+            logging.error(msg)
+            return None, False
+        else:
+            self._tasks.report_response_time(task, self._clock() - start)
+            self._put_results(results)
+            self._tasks.report_done(task)
+            return ftp, False
+
+    def close(self):
+        """Close the idle sessions.
+        """
+        self._sessions.close()
+
+    def _get_session(self, task):
+        """Return a logged-in session from the pool.
+
+        `None` is returned if there is no usable session for the site of the
+        task.
+        """
+        site_info = self._sites_info[task.site_id]
+        max_idle = site_info.get('session_timeout', 0)
+        if max_idle > 0:
+            return self._sessions.get(task.site_id, max_idle)
+        else:
+            return None
+
+    def _release_session(self, task, ftp):
+        """Return the session to the pool or close it if reuse is disabled.
+        """
+        site_info = self._sites_info[task.site_id]
+        if site_info.get('session_timeout', 0) > 0:
+            self._sessions.put(task.site_id, ftp)
+        else:
+            self._close_session(ftp)
+
+    def _connect(self, url):
+        """Open a new FTP session for the given URL.
+        """
+        ftp = ftplib.FTP()
+        if url.port:
+            ftp.connect(url.hostname.encode(self._encoding), url.port)
+        else:
+            ftp.connect(url.hostname.encode(self._encoding))
+        try:
+            if url.username:
+                ftp.login(url.username.encode(self._encoding),
+                          url.password.encode(self._encoding))
+            else:
+                ftp.login()
+        except:
+            ftp.close()
+            raise
+        return ftp
+
+    def _close_session(self, ftp):
+        """Close a session that will not be returned to the pool.
+        """
+        if ftp is not None:
             try:
                 ftp.quit()
             except ftplib.Error:
                 ftp.close()
             except (IOError, EOFError, socket.timeout, socket.error):
                 # Ignore possible exceptions executing QUIT.
-                pass
-            self._tasks.report_error_dir(task)
-            msg = 'Error visiting "%s" (%s)' % (url, str(error).strip())
-            logging.error(msg)
+                ftp.close()
+
+    def _visit(self, ftp, task):
+        """List the directory of the task using the given session.
+
+        It returns a list of results.  It contains more than one result if
+        the directory was listed recursively.
+        """
+        url = task.url
+        try:
+            ftp.cwd(url.path.encode(self._encoding))
+        except ftplib.error_perm:
+            # Failed to change directory.
+            return [CrawlResult(task, False)]
+        # It seems to be a valid directory.
+        site_info = self._sites_info[task.site_id]
+        if self._is_recursive(task):
+            command = site_info.get('recursive_command', 'LIST -R')
+            tree = self._list_tree(ftp, command,
+                                   url.path.encode(self._encoding),
+                                   task.site_id)
+            return [self._create_result(ftp, subtask, entries)
+                    for subtask, entries
+                    in self._walk_tree(task, tree, site_info['max_depth'])]
         else:
-            self._results.put(result)
-            self._tasks.report_done(task)
+            entries = self._list(ftp, task.site_id)
+            return [self._create_result(ftp, task, entries)]
 
-    @staticmethod
-    def _parse_list(line):
-        """Parse lines from a LIST response.
+    def _create_result(self, ftp, task, entries):
+        """Create the result for the task from the entries of the listing.
+        """
+        url = task.url
+        result = CrawlResult(task, True)
+        probes = {}
+        for entry_name, is_dir, line, facts in entries:
+            data = dict(facts)
+            if is_dir is None:
+                # The parser does not known if this entry is a directory or
+                # not.  Reuse the answer of the last visit if the listing line
+                # did not change.
+                try:
+                    probed_line, is_dir = task.probes[entry_name]
+                    if probed_line != line:
+                        is_dir = None
+                except KeyError:
+                    pass
+                if is_dir is None:
+                    is_dir = self._probe(ftp, url.join(entry_name))
+                probes[entry_name] = (line, is_dir)
+            data['is_dir'] = is_dir
+            result.add_entry(entry_name, data)
+        task.probes = probes
+        self._add_contents(ftp, task, result)
+        return result
 
-        `None` is returned if could not parse the line, otherwise it returns a
-        tuple containing the name of the item and a Boolean value indicating if
-        it is a directory.  The Boolean value will be `None` if the parse could
-        not known if the item is a directory or not.
+    def _list_tree(self, ftp, command, path, site_id):
+        """Return the entries of the subtree of the current directory.
+
+        `command` should be a recursive listing command like LIST -R or
+        STAT -R, and `path` the encoded path of the current directory.  It
+        returns a dictionary as described in `_parse_tree()`.
         """
-        # Based on ftpparse.c and ftpparse.h by D. J. Bernstein.
-        if line.startswith(tuple('-dbclps')):
-            # UNIX-style listing.
-            try:
-                if line[0] == '-':
-                    is_dir = False
-                elif line[0] == 'd':
-                    is_dir = True
-                else:
-                    is_dir = None
-                data = line.split(None, 8)
-                if len(data) == 9:
-                    if line[0] == 'l':
-                        name = data[-1].split(' -> ')[0]
-                    else:
-                        name = data[-1]
-                else:
-                    raise ValueError('Invalid line format.')
-            except ValueError:
-                return None
+        throttle = self._get_throttle(site_id)
+        if command.split()[0].upper() == 'STAT':
+            # The listing is sent in the reply on the control connection.
+            reply = ftp.sendcmd(command)
+            if throttle is not None:
+                throttle(len(reply))
+            lines = reply.splitlines()[1:-1]
+        else:
+            lines = []
+            def callback(line):
+                lines.append(line)
+                if throttle is not None:
+                    throttle(len(line) + 2)
+            ftp.retrlines(command, callback)
+        return self._parse_tree(lines, path)
+
+    @classmethod
+    def _parse_tree(cls, lines, path):
+        """Parse the lines of a recursive listing.
+
+        The listing is split in sections by directory, each one starting with
+        the path of the directory followed by a colon.  It returns a
+        dictionary mapping the path of the directories, relative to `path`
+        (the empty string for the directory itself), to a list of tuples as
+        described in `_list()`.
+        """
+        tree = {'': []}
+        entries = tree['']
+        prefix = path.rstrip('/') + '/'
+        header = True
+        for line in lines:
+            if not line.strip():
+                # A blank line separates the sections.
+                header = True
+            elif header and line.endswith(':'):
+                dirpath = line[:-1]
+                if dirpath == path or dirpath + '/' == prefix:
+                    dirpath = ''
+                elif dirpath.startswith(prefix):
+                    dirpath = dirpath[len(prefix):]
+                elif dirpath == '.':
+                    dirpath = ''
+                elif dirpath.startswith('./'):
+                    dirpath = dirpath[2:]
+                entries = tree.setdefault(dirpath.strip('/'), [])
+                header = False
             else:
-                return (name, is_dir)
-        elif line.startswith(tuple('0123456789')):
-            # MSDOS format.
+                header = False
+                entry = cls._parse_list(line)
+                if entry is not None:
+                    entries.append(entry[:2] + (line, entry[2]))
+        return tree
+
+    def _probe(self, ftp, url):
+        """Check if the given URL is a directory.
+
+        Try to change directory, if error, assume it is a file.
+        """
+        try:
+            ftp.cwd(url.path.encode(self._encoding))
+        except ftplib.error_perm:
+            return False
+        else:
+            return True
+
+    def _list(self, ftp, site_id):
+        """Return the entries of the current directory.
+
+        The machine-readable MLSD listing is used if the server supports it,
+        otherwise it falls back to LIST.  It returns a list of tuples
+        containing the name of the entry, a Boolean value (or `None`)
+        indicating if it is a directory, the line of the listing and a
+        dictionary with the size and modification time of the entry if they
+        are known (see `arachne.listing.ListParser._get_facts()`).
+        """
+        features = self._get_features(ftp, site_id)
+        if 'MLST' in features:
             try:
-                line  = line[17:].lstrip()
-                if line.startswith('<DIR>'):
-                    is_dir = True
-                    name = line[15:]
-                else:
-                    is_dir = False
-                    name = line[line.index(' ') + 1:]
-            except (IndexError, ValueError):
-                return None
+                data = self._retrieve(ftp, 'MLSD', site_id)
+            except ftplib.error_perm:
+                # The feature was announced but the command is not
+                # implemented.  Do not try again with this site.
+                features.discard('MLST')
             else:
-                return (name, is_dir)
-        elif line.startswith('+'):
-            # Easily Parsed LIST Format.
+                entries = []
+                for line in data.splitlines():
+                    entry = self._parse_mlsd(line)
+                    if entry is not None:
+                        entries.append(entry[:2] + (line, entry[2]))
+                return entries
+        data = self._retrieve(ftp, 'LIST', site_id)
+        return self._parse_listing(site_id, data)
+
+    def _parse_listing(self, site_id, data):
+        """Return the entries of a LIST response as described in `_list()`.
+
+        The format of the listing is detected the first time the site is
+        listed and again if it changes.
+        """
+        parser = self._parsers.get(site_id)
+        entries = parser.parse(data) if parser is not None else []
+        if not entries and data.strip():
+            # First listing of the site or the format changed.
+            parser = listing.detect(data)
+            if parser is not None:
+                self._parsers[site_id] = parser
+                entries = parser.parse(data)
+        return entries
+
+    def _retrieve(self, ftp, command, site_id):
+        """Return the whole response to a listing command.
+        """
+        chunks = []
+        throttle = self._get_throttle(site_id)
+        def callback(chunk):
+            chunks.append(chunk)
+            if throttle is not None:
+                throttle(len(chunk))
+        ftp.retrbinary(command, callback)
+        return ''.join(chunks)
+
+    def _get_features(self, ftp, site_id):
+        """Return the set of extensions supported by the server of the site.
+
+        The FEAT command is sent only the first time the site is contacted,
+        the response is cached for the following requests.
+        """
+        try:
+            return self._features[site_id]
+        except KeyError:
+            features = set()
             try:
-                facts, name = line[1:].split('\t')
-                facts = facts.split(',')
-                is_dir = '/' in facts
-            except IndexError:
-                return None
+                response = ftp.sendcmd('FEAT')
+            except ftplib.error_perm:
+                # FEAT is not supported by the server.
+                pass
             else:
-                return (name, is_dir)
-        else:
-            # Could not parse the line.  Maybe because the format is unknown
-            # format or it contains additional information provided by the FTP
-            # server that can be ignored.
+                for line in response.splitlines()[1:-1]:
+                    words = line.split()
+                    if words:
+                        features.add(words[0].upper())
+            self._features[site_id] = features
+            return features
+
+    @staticmethod
+    def _parse_mlsd(line):
+        """Parse lines from a MLSD response.
+
+        `None` is returned if could not parse the line or if it is the entry
+        of the directory itself or its parent, otherwise it returns a tuple
+        like `_parse_list()`.  The Boolean value will be `None` for symbolic
+        links.  The size and modify facts are included in the dictionary.
+        """
+        try:
+            facts, name = line.split(' ', 1)
+        except ValueError:
             return None
+        facts = dict(fact.split('=', 1) for fact in facts.lower().split(';')
+                     if '=' in fact)
+        entry_type = facts.get('type')
+        if entry_type == 'dir':
+            is_dir = True
+        elif entry_type == 'file':
+            is_dir = False
+        elif entry_type in (None, 'cdir', 'pdir'):
+            return None
+        elif entry_type.startswith(('os.unix=symlink', 'os.unix=slink')):
+            is_dir = None
+        else:
+            # Other OS-specific types, like devices.
+            is_dir = False
+        entry_facts = {}
+        if is_dir is False and facts.get('size', '').isdigit():
+            entry_facts['size'] = int(facts['size'])
+        try:
+            mtime = time.strptime(facts['modify'][:14], '%Y%m%d%H%M%S')
+        except (KeyError, ValueError):
+            pass
+        else:
+            entry_facts['mtime'] = calendar.timegm(mtime)
+        return (name, is_dir, entry_facts)
 
     @staticmethod
-    def _get_content(url):
-        """Get the UTF-8 text to be indexed as the content of the file.
+    def _parse_list(line):
+        """Parse lines from a LIST response.
+
+        `None` is returned if could not parse the line, otherwise it returns a
+        tuple containing the name of the item, a Boolean value indicating if
+        it is a directory and a dictionary with the facts known about the
+        entry.  The Boolean value will be `None` if the parse could not known
+        if the item is a directory or not.  Each registered format is tried,
+        see the `arachne.listing` module.
+        """
+        return listing.parse_line(line)
+
+    def _add_contents(self, ftp, task, result):
+        """Add the text to be indexed as the content of the files.
+
+        The files can be read using the given session.  Subclasses should set
+        the `content` key in the data of the entries of the result.
         """
-        return u''
+
 
 class FTPContentHandler(FTPHandler):
     """A proof-of-concept FTP handler.
 
-    This class extends the FTP handler to support downloading the files
-    to index its content. Currently only the metadata of MP3 files
-    is indexed.
+    This class extends the FTP handler to index the content of the files.
+    Only the byte ranges needed by the content extractors are transferred.
+    Without a `ContentManager` the session that lists the directory is used.
+    Currently the metadata of MP3 files and the names of the files inside ZIP
+    archives are indexed.
     """
 
     name = 'ftp_content'
 
-    def __init__(self, sites_info, tasks, results):
-        super(FTPContentHandler, self).__init__(sites_info, tasks, results)
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
+        super(FTPContentHandler, self).__init__(sites_info, tasks, results,
+                                                contents, bandwidth)
+
+    def _add_contents(self, ftp, task, result):
+        """Add the text to be indexed as the content of the files.
+        """
+        site_id = task.site_id
+        entries = [data for name, data in result
+                   if not data['is_dir']
+                   and content.get_extractor(name) is not None]
+        if self._contents is None:
+            for data in entries:
+                entry_content = self._get_content(ftp, site_id, data)
+                if entry_content:
+                    data['content'] = entry_content
+        elif entries:
+            files = []
+            for data in entries:
+                path = data['url'].path.encode(self._encoding)
+                size, mtime = data.get('size'), data.get('mtime')
+                if size is None:
+                    size = self._get_size(ftp, path)
+                if mtime is None:
+                    mtime = self._get_mtime(ftp, path)
+                files.append((data['url'], path, size, mtime))
+            timeout = self._sites_info[site_id]['content_timeout']
+            contents = self._contents.get_contents(site_id, files, timeout)
+            for data, entry_content in zip(entries, contents):
+                if entry_content:
+                    data['content'] = entry_content
+
+    def _get_content(self, ftp, site_id, data):
+        """Extract the content of a file using the given session.
+        """
+        url = data['url']
+        extractor = content.get_extractor(url.basename)
+        budget = self._sites_info[site_id]['content_budget']
+        reader = content.FTPRangeReader(ftp, url.path.encode(self._encoding),
+                                        data.get('size'), budget,
+                                        self._get_throttle(site_id))
+        try:
+            return extractor.extract(reader)
+        except (IOError, EOFError, socket.error):
+            # The session can not be used anymore.
+            raise
+        except Exception, error:
+            logging.debug('Could not extract the content of "%s": %s',
+                          url, error)
+            return u''
 
     @staticmethod
-    def _get_content(url):
-        """Get the UTF-8 text to be indexed as the content of the file.
+    def _get_size(ftp, path):
+        """Return the size of a file using the SIZE command.
+
+        `None` is returned if the server does not support the command.
         """
-        content = u''
-        if url.lower().endswith(u'.mp3'):
-            try:
-                import tempfile
-                from mutagen.easyid3 import EasyID3
-                # Download the file.
-                remote_handler = urllib2.urlopen(url)
-                local_handler = tempfile.NamedTemporaryFile(delete = False)
-                local_name = local_handler.name
-                local_handler.write(remote_handler.read())
-                local_handler.close()
-                remote_handler.close()
-                # Extract the metadata.
-                metadata = []
-                audio = EasyID3(local_name)
-                for tag in (u'artist', u'album', u'title'):
-                    try:
-                        metadata.extend(audio[tag])
-                    except:
-                        pass
-                os.remove(local_name)
-                content = u' '.join(metadata)
-            except Exception:
-                pass
-        return content
+        try:
+            ftp.voidcmd('TYPE I')
+            return ftp.size(path)
+        except ftplib.error_perm:
+            return None
+
+    @staticmethod
+    def _get_mtime(ftp, path):
+        """Return the modification time of a file using the MDTM command.
+
+        `None` is returned if the server does not support the command.
+        """
+        try:
+            response = ftp.sendcmd('MDTM %s' % path)
+        except ftplib.error_perm:
+            return None
+        try:
+            mtime = time.strptime(response.split()[1][:14], '%Y%m%d%H%M%S')
+        except (IndexError, ValueError):
+            return None
+        return calendar.timegm(mtime)
 
 
 class ApacheHandler(ProtocolHandler):
@@ -321,49 +792,77 @@ class ApacheHandler(ProtocolHandler):
 
     name = 'apache'
 
-    _ENTRIES_RE = re.compile(r'alt="\[([^\]]+)\]".+<a[^>]+>([^<]+?)/?</a>.*[0-9]{2}-[a-zA-Z]{3}-[0-9]{4}', re.I)
+    _ENTRIES_RE = re.compile(r'alt="\[([^\]]+)\]".+<a[^>]+>([^<]+?)/?</a>.*?([0-9]{2}-[a-zA-Z]{3}-[0-9]{4}(?: [0-9]{2}:[0-9]{2})?)', re.I)
 
     _ENTITIES_RE = re.compile(r'&(\w+?);')
 
-    def __init__(self, sites_info, tasks, results):
+    # Persistent connections shared by the handlers of all the site crawlers.
+    _connections = HTTPConnectionPool()
+
+    # Size of the chunks read from the directory pages.
+    _CHUNK_SIZE = 64 * 1024
+
+    # Bytes received and bytes of the decoded directory pages of each site,
+    # and when they were last logged, shared by the handlers of all the site
+    # crawlers.  The totals are logged every _TRANSFERRED_INTERVAL seconds.
+    _transferred = {}
+    _transferred_mutex = threading.Lock()
+    _TRANSFERRED_INTERVAL = 600
+
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
         """Initialize the handler.
         """
         self._encoding = 'utf-8'
+        self._sites_info = sites_info
         self._tasks = tasks
         self._results = results
+        self._contents = contents
+        self._bandwidth = bandwidth
 
     def execute(self, task):
         """Execute the task and return the result.
         """
         url = task.url
-        encoded_url = str(url)
-        path_encoded = url.path.encode(self._encoding)
-        encoded_url = '%s%s/' % (encoded_url[:-len(path_encoded)],
-                                 urllib.quote(path_encoded.rstrip('/')))
-        opener = urllib2.build_opener()
-        opener.addheaders = [('User-agent', 'Arachne/%s' % __version__)]
+        encoded_url = self._encode_url(url) + '/'
+        site_info = self._sites_info[task.site_id]
+        max_idle = site_info.get('http_keepalive_timeout', 0)
+        opener = build_http_opener(self._connections, task.site_id, max_idle)
+        request = urllib2.Request(encoded_url)
+        for header, value in task.validators.iteritems():
+            request.add_header(header, value)
+        request.add_header('Accept-encoding', 'gzip, deflate')
+        start = self._clock()
         try:
-            handler = opener.open(encoded_url)
-            data = handler.read()
+            handler = opener.open(request)
+            max_size = self._sites_info[task.site_id]['max_page_size']
+            chunks = self._read_page(task, handler, max_size)
+            self._tasks.report_response_time(task, self._clock() - start)
             # Everything seems to be OK, add entries to the result.
-            result = CrawlResult(task, True)
-            for match in self._ENTRIES_RE.finditer(data):
-                entry_data = {}
-                entry_data['is_dir'] = (match.group(1).lower() == 'dir')
-                entry_name = self._ENTITIES_RE.sub(self._sub_entity, match.group(2))
-                result.add_entry(entry_name, entry_data)
+            result = self._parse_page(task, chunks)
+            task.validators = self._get_validators(handler.info())
             handler.close()
+            self._add_contents(opener, task, result)
             self._results.put(result)
             self._tasks.report_done(task)
         except urllib2.HTTPError, error:
-            if error.code == 404:
+            self._tasks.report_response_time(task, self._clock() - start)
+            if error.code == 304:
+                # The directory was not modified since the last visit.  It is
+                # rescheduled without generating a result.
+                error.close()
+                self._tasks.report_done(task)
+                self._tasks.put_visited(task, False, task.modified)
+            elif error.code == 404:
                 # The directory does not exists. Generate a not-found result
                 # because the entire directory tree should be removed from the
                 # index.
+                error.close()
                 result = CrawlResult(task, False)
                 self._results.put(result)
                 self._tasks.report_done(task)
             else:
+                error.close()
                 self._tasks.report_error_dir(task)
                 logging.error('Error visiting "%s" (%s: %s)' % (url, error.code, error.msg))
         except urllib2.URLError, error:
@@ -379,6 +878,181 @@ class ApacheHandler(ProtocolHandler):
             handler.close()
             self._tasks.report_error_site(task)
             logging.error('Error visiting "%s" (Error reading data)' % url)
+        except zlib.error, error:
+            handler.close()
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (Invalid compressed data: %s)'
+                          % (url, error))
+        except ListingError, error:
+            handler.close()
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (%s)' % (url, error))
+
+    def close(self):
+        """Close the idle connections.
+
+        The number of bytes transferred for the directory pages of each site
+        is logged the first time this method is called (they are also logged
+        periodically while the pages are read).
+        """
+        self._connections.close()
+        self._transferred_mutex.acquire()
+        try:
+            transferred = self._transferred.items()
+            self._transferred.clear()
+        finally:
+            self._transferred_mutex.release()
+        for site_id, (received, decoded, logged) in transferred:
+            self._log_transferred(site_id, received, decoded)
+
+    def _read_page(self, task, handler, max_size):
+        """Read the directory page from the given response.
+
+        It yields the decoded content of the page in chunks.  The content is
+        decompressed as it is received if the server used the gzip or deflate
+        content encodings.  `ListingError` is raised if the decoded page is
+        larger than `max_size` bytes.
+        """
+        decompressor = self._get_decompressor(handler.info())
+        throttle = self._get_throttle(task.site_id)
+        received = decoded = 0
+        try:
+            while True:
+                data = handler.read(self._CHUNK_SIZE)
+                if data:
+                    received += len(data)
+                    if throttle is not None:
+                        throttle(len(data))
+                    if decompressor is None:
+                        chunk = data
+                    else:
+                        # Limit the output to detect large pages before
+                        # decompressing all the data.
+                        chunk = decompressor.decompress(data,
+                                                        max_size - decoded + 1)
+                elif decompressor is not None:
+                    chunk = decompressor.flush()
+                else:
+                    chunk = ''
+                decoded += len(chunk)
+                if decoded > max_size:
+                    raise ListingError('The page is larger than %d bytes.'
+                                       % max_size)
+                if chunk:
+                    yield chunk
+                if not data:
+                    break
+        finally:
+            self._count_transferred(task, received, decoded)
+
+    @staticmethod
+    def _get_decompressor(headers):
+        """Return the decompressor for the content encoding of a response.
+
+        `None` is returned if the content is not compressed.
+        """
+        encoding = headers.getheader('Content-Encoding', '')
+        encoding = encoding.strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            return _DeflateDecompressor()
+        else:
+            return None
+
+    def _count_transferred(self, task, received, decoded):
+        """Add the bytes transferred for the page of a task to its site.
+
+        The totals of the site are logged if they were not logged in the last
+        `_TRANSFERRED_INTERVAL` seconds.
+        """
+        now = time.time()
+        totals = None
+        self._transferred_mutex.acquire()
+        try:
+            counters = self._transferred.setdefault(task.site_id, [0, 0, 0])
+            counters[0] += received
+            counters[1] += decoded
+            if now - counters[2] >= self._TRANSFERRED_INTERVAL:
+                counters[2] = now
+                totals = counters[:2]
+        finally:
+            self._transferred_mutex.release()
+        logging.debug('Received %d bytes for %d bytes of "%s"'
+                      % (received, decoded, task.url))
+        if totals is not None:
+            self._log_transferred(task.site_id, *totals)
+
+    def _log_transferred(self, site_id, received, decoded):
+        """Log the bytes transferred for the directory pages of a site.
+        """
+        logging.info('Received %d bytes for %d bytes of directory pages '
+                     'from "%s"' % (received, decoded,
+                                    self._sites_info[site_id]['url']))
+
+    def _parse_page(self, task, chunks):
+        """Parse the directory page and return the result.
+
+        The page is given as an iterable of chunks of data.  Entries are
+        added to the result as the complete lines of the page are available,
+        without keeping the whole page in memory.
+        """
+        result = CrawlResult(task, True)
+        pending = ''
+        for chunk in chunks:
+            data = pending + chunk
+            end = data.rfind('\n') + 1
+            self._parse_lines(result, data, end)
+            pending = data[end:]
+        self._parse_lines(result, pending, len(pending))
+        return result
+
+    def _parse_lines(self, result, data, end):
+        """Add to the result the entries of the page in `data[:end]`.
+        """
+        for match in self._ENTRIES_RE.finditer(data, 0, end):
+            entry_data = {}
+            entry_data['is_dir'] = (match.group(1).lower() == 'dir')
+            entry_name = self._ENTITIES_RE.sub(self._sub_entity, match.group(2))
+            mtime = self._parse_date(match.group(3))
+            if mtime is not None:
+                entry_data['mtime'] = mtime
+            result.add_entry(entry_name, entry_data)
+
+    @staticmethod
+    def _get_validators(headers):
+        """Return the validators of a directory page for the next request.
+        """
+        validators = {}
+        etag = headers.getheader('ETag')
+        if etag is not None:
+            validators['If-None-Match'] = etag
+        last_modified = headers.getheader('Last-Modified')
+        if last_modified is not None:
+            validators['If-Modified-Since'] = last_modified
+        return validators
+
+    def _add_contents(self, opener, task, result):
+        """Add the text to be indexed as the content of the files.
+
+        The files can be read using the given `urllib2.OpenerDirector`.
+        Subclasses should set the `content` key in the data of the entries of
+        the result.
+        """
+
+    @staticmethod
+    def _parse_date(date):
+        """Return the date of an entry as seconds since the epoch.
+
+        The date is in the time zone of the server, it is converted as if it
+        was UTC.  `None` is returned if the date is not valid.
+        """
+        for date_format in ('%d-%b-%Y %H:%M', '%d-%b-%Y'):
+            try:
+                return calendar.timegm(time.strptime(date, date_format))
+            except ValueError:
+                pass
+        return None
 
     @staticmethod
     def _sub_entity(match):
@@ -388,3 +1062,473 @@ class ApacheHandler(ProtocolHandler):
             return htmlentitydefs.entitydefs[match.group(1)]
         except KeyError:
             return match.group(0)
+
+
+class ApacheContentHandler(ApacheHandler):
+    """Handler for sites using Apache autoindex indexing the content of files.
+
+    The byte ranges needed by the content extractors are requested using
+    HTTP Range requests.  See `FTPContentHandler`.
+    """
+
+    name = 'apache_content'
+
+    def _add_contents(self, opener, task, result):
+        """Add the text to be indexed as the content of the files.
+        """
+        site_id = task.site_id
+        entries = [data for name, data in result
+                   if not data['is_dir']
+                   and content.get_extractor(name) is not None]
+        if self._contents is None:
+            for data in entries:
+                entry_content = self._get_content(opener, site_id, data)
+                if entry_content:
+                    data['content'] = entry_content
+        elif entries:
+            files = [(data['url'], self._encode_url(data['url']),
+                      data.get('size'), data.get('mtime'))
+                     for data in entries]
+            timeout = self._sites_info[site_id]['content_timeout']
+            contents = self._contents.get_contents(site_id, files, timeout)
+            for data, entry_content in zip(entries, contents):
+                if entry_content:
+                    data['content'] = entry_content
+            if None in contents:
+                # Request the whole page in the next visit to add the missing
+                # contents.
+                task.validators = {}
+
+    def _get_content(self, opener, site_id, data):
+        """Extract the content of a file using the given opener.
+        """
+        url = data['url']
+        extractor = content.get_extractor(url.basename)
+        budget = self._sites_info[site_id]['content_budget']
+        reader = content.HTTPRangeReader(opener, self._encode_url(url),
+                                         data.get('size'), budget,
+                                         self._get_throttle(site_id))
+        try:
+            return extractor.extract(reader)
+        except Exception, error:
+            logging.debug('Could not extract the content of "%s": %s',
+                          url, error)
+            return u''
+
+
+class WebDAVHandler(ProtocolHandler):
+    """Handler for WebDAV shares.
+
+    Directories are listed with PROPFIND requests.  The first visit to the
+    directory set in the `recursive_list` option of the site uses the
+    infinite depth, if the server allows it, to list the whole subtree with
+    a single request.
+    """
+
+    name = 'webdav'
+
+    _DAV_NS = '{DAV:}'
+
+    _PROPFIND_BODY = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<D:propfind xmlns:D="DAV:"><D:prop>'
+        '<D:resourcetype/><D:getcontentlength/><D:getlastmodified/>'
+        '</D:prop></D:propfind>')
+
+    # Persistent connections shared by the handlers of all the site crawlers.
+    _connections = HTTPConnectionPool()
+
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
+        """Initialize the handler.
+        """
+        self._encoding = 'utf-8'
+        self._sites_info = sites_info
+        self._tasks = tasks
+        self._results = results
+        self._bandwidth = bandwidth
+
+    def execute(self, task):
+        """Execute the task and return the result.
+        """
+        url = task.url
+        site_info = self._sites_info[task.site_id]
+        max_idle = site_info.get('http_keepalive_timeout', 0)
+        opener = build_http_opener(self._connections, task.site_id, max_idle)
+        start = self._clock()
+        try:
+            tree = None
+            if self._is_recursive(task):
+                try:
+                    tree = self._propfind(opener, task, 'infinity')
+                except urllib2.HTTPError, error:
+                    if error.code != 403:
+                        raise
+                    # Infinite depth not allowed by the server.
+                    error.close()
+                    logging.info('Could not list "%s" recursively' % url)
+            if tree is None:
+                tree = self._propfind(opener, task, '1')
+            if tree is None:
+                results = [CrawlResult(task, False)]
+            else:
+                results = self._tree_results(task, tree)
+        except urllib2.HTTPError, error:
+            self._tasks.report_response_time(task, self._clock() - start)
+            error.close()
+            if error.code == 404:
+                # The directory does not exists.
+                self._put_results([CrawlResult(task, False)])
+                self._tasks.report_done(task)
+            else:
+                self._tasks.report_error_dir(task)
+                logging.error('Error visiting "%s" (%s: %s)' % (url, error.code, error.msg))
+        except urllib2.URLError, error:
+            self._tasks.report_error_site(task)
+            reason = error.reason
+            if not isinstance(reason, basestring):
+                try:
+                    reason = reason[1]
+                except IndexError:
+                    reason = str(reason)
+            logging.error('Error visiting "%s" (%s)' % (url, reason))
+        except (socket.error, IOError, EOFError), error:
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (Error reading data)' % url)
+        except SyntaxError, error:
+            self._tasks.report_response_time(task, self._clock() - start)
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (Invalid response: %s)'
+                          % (url, error))
+        else:
+            self._tasks.report_response_time(task, self._clock() - start)
+            self._put_results(results)
+            self._tasks.report_done(task)
+
+    def close(self):
+        """Close the idle connections.
+        """
+        self._connections.close()
+
+    def _propfind(self, opener, task, depth):
+        """List the directory of the task with a PROPFIND request.
+
+        It returns a dictionary as described in `_walk_tree()`, with the
+        entries as tuples of the name, a Boolean value indicating if it is a
+        directory and a dictionary with the size and the modification time.
+        Only the directory of the task is included if `depth` is '1'.  `None`
+        is returned if the URL of the task is not a directory.
+        """
+        request = urllib2.Request(self._encode_url(task.url) + '/',
+                                  self._PROPFIND_BODY)
+        request.get_method = lambda: 'PROPFIND'
+        request.add_header('Depth', depth)
+        request.add_header('Content-type', 'application/xml; charset="utf-8"')
+        response = opener.open(request)
+        try:
+            throttle = self._get_throttle(task.site_id)
+            source = (response if throttle is None
+                      else _ThrottledFile(response, throttle))
+            return self._parse_multistatus(source, task.url.path,
+                                           depth != '1')
+        finally:
+            response.close()
+
+    def _parse_multistatus(self, response, path, recursive):
+        """Parse the multi-status response of a PROPFIND request.
+
+        The response is parsed as it is received.  See `_propfind()`.
+        """
+        dav = self._DAV_NS
+        base = path.rstrip(u'/')
+        tree = {}
+        entries = []
+        is_collection = None
+        for event, elem in ElementTree.iterparse(response):
+            if elem.tag != dav + 'response':
+                continue
+            href = elem.findtext(dav + 'href', '').strip()
+            href_path = urllib.unquote(urlparse.urlsplit(href)[2])
+            href_path = href_path.decode(self._encoding, 'replace')
+            href_path = href_path.rstrip(u'/')
+            if href_path != base and not href_path.startswith(base + u'/'):
+                elem.clear()
+                continue
+            is_dir, data = self._parse_props(elem)
+            elem.clear()
+            relpath = href_path[len(base) + 1:]
+            if not relpath:
+                is_collection = is_dir
+                continue
+            if is_dir and recursive:
+                tree.setdefault(relpath, [])
+            entries.append((relpath, is_dir, data))
+        if is_collection is False:
+            return None
+        tree.setdefault(u'', [])
+        for relpath, is_dir, data in entries:
+            dirname, name = os.path.split(relpath)
+            if dirname in tree:
+                tree[dirname].append((name, is_dir, data))
+        return tree
+
+    def _parse_props(self, elem):
+        """Return the data of an entry from its response element.
+        """
+        dav = self._DAV_NS
+        is_dir = False
+        data = {}
+        for propstat in elem.findall(dav + 'propstat'):
+            status = propstat.findtext(dav + 'status', '')
+            if status.split()[1:2] != ['200']:
+                continue
+            prop = propstat.find(dav + 'prop')
+            if prop is None:
+                continue
+            resourcetype = prop.find(dav + 'resourcetype')
+            if (resourcetype is not None
+                    and resourcetype.find(dav + 'collection') is not None):
+                is_dir = True
+            size = prop.findtext(dav + 'getcontentlength', '').strip()
+            if size.isdigit():
+                data['size'] = int(size)
+            modified = prop.findtext(dav + 'getlastmodified', '').strip()
+            date = email.utils.parsedate_tz(modified) if modified else None
+            if date is not None:
+                data['mtime'] = email.utils.mktime_tz(date)
+        if is_dir:
+            data.pop('size', None)
+        return is_dir, data
+
+
+class RsyncHandler(ProtocolHandler):
+    """Handler for modules of rsync daemons.
+
+    Directories are listed running the rsync client with the --list-only
+    option.  On the first visit to the directory set in the `recursive_list`
+    option of the site the whole subtree is listed with a single command.
+    The output of the client is parsed as it is received.
+    """
+
+    name = 'rsync'
+
+    _LINE_RE = re.compile(r'^([-dlcbps])\S{9}\s+[\d,.]+\s+'
+                          r'(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})\s(.+)$')
+
+    _ESCAPE_RE = re.compile(r'\\#([0-7]{3})')
+
+    # Exit codes of the rsync client for errors contacting the site (socket
+    # I/O, protocol and timeout errors).
+    _SITE_ERRORS = (5, 10, 12, 30, 35)
+
+    # Exit codes of the rsync client when some entries could not be listed.
+    _PARTIAL_ERRORS = (23, 24)
+
+    def __init__(self, sites_info, tasks, results, contents=None,
+                 bandwidth=None):
+        """Initialize the handler.
+        """
+        self._encoding = 'utf-8'
+        self._sites_info = sites_info
+        self._tasks = tasks
+        self._results = results
+        self._bandwidth = bandwidth
+
+    def execute(self, task):
+        """Execute the task and return the result.
+        """
+        url = task.url
+        recursive = self._is_recursive(task)
+        start = self._clock()
+        try:
+            tree, returncode, message = self._list(task, recursive)
+        except OSError, error:
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (Could not run rsync: %s)'
+                          % (url, error.strerror))
+            return
+        if returncode in self._SITE_ERRORS:
+            self._tasks.report_error_site(task)
+            logging.error('Error visiting "%s" (%s)' % (url, message))
+            return
+        self._tasks.report_response_time(task, self._clock() - start)
+        if returncode != 0 and returncode not in self._PARTIAL_ERRORS:
+            self._tasks.report_error_dir(task)
+            logging.error('Error visiting "%s" (%s)' % (url, message))
+        else:
+            if tree is None:
+                # The directory does not exist or it is not a directory.
+                results = [CrawlResult(task, False)]
+            else:
+                if returncode != 0:
+                    logging.info('Incomplete listing of "%s" (%s)'
+                                 % (url, message))
+                results = self._tree_results(task, tree)
+            self._put_results(results)
+            self._tasks.report_done(task)
+
+    def _list(self, task, recursive):
+        """Run the rsync client to list the directory of the task.
+
+        It returns a tuple with the tree of the directory as described in
+        `_walk_tree()` (`None` if the directory was not listed), the exit
+        code of the client and the last error message it printed.  Only the
+        directory of the task is included in the tree if `recursive` is
+        `False`.
+        """
+        site_info = self._sites_info[task.site_id]
+        url = task.url
+        args = [site_info.get('rsync_command', 'rsync'), '--list-only',
+                '--no-motd', '--timeout=%d' % socket.getdefaulttimeout()]
+        if recursive:
+            args.append('--recursive')
+        args.append(self._get_rsync_url(url))
+        env = dict(os.environ)
+        if url.password:
+            env['RSYNC_PASSWORD'] = url.password.encode(self._encoding)
+        # Errors are written to a temporary file to avoid blocking the client
+        # if the pipe is full.
+        stderr = os.tmpfile()
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stderr=stderr, close_fds=True, env=env)
+            try:
+                # Reading the output slowly also throttles the client.
+                throttle = self._get_throttle(task.site_id)
+                output = (process.stdout if throttle is None
+                          else _ThrottledFile(process.stdout, throttle))
+                tree = self._parse_tree(output, recursive)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            stderr.seek(0)
+            messages = [line.strip() for line in stderr if line.strip()]
+        finally:
+            stderr.close()
+        message = messages[-1] if messages else 'exit code %d' % returncode
+        return tree, returncode, message
+
+    def _get_rsync_url(self, url):
+        """Return the URL given to the rsync client, without password.
+        """
+        netloc = url.hostname
+        if url.port:
+            netloc += u':%d' % url.port
+        if url.username:
+            netloc = u'%s@%s' % (url.username, netloc)
+        path = url.path.rstrip(u'/') + u'/'
+        return (u'rsync://%s%s' % (netloc, path)).encode(self._encoding)
+
+    def _parse_tree(self, lines, recursive):
+        """Parse the output of the rsync client.
+
+        The paths of the entries are relative to the listed directory,
+        which is the entry with the path ".".  It returns a dictionary as
+        described in `_walk_tree()`, or `None` if the listed directory was
+        not found in the output.
+        """
+        tree = {}
+        entries = []
+        found = False
+        for line in lines:
+            entry = self._parse_line(line.rstrip('\r\n'))
+            if entry is None:
+                continue
+            relpath, is_dir, data = entry
+            if relpath == u'.':
+                found = is_dir
+                continue
+            if is_dir and recursive:
+                tree.setdefault(relpath, [])
+            entries.append(entry)
+        if not found:
+            return None
+        tree.setdefault(u'', [])
+        for relpath, is_dir, data in entries:
+            dirname, name = os.path.split(relpath)
+            if dirname in tree:
+                tree[dirname].append((name, is_dir, data))
+        return tree
+
+    def _parse_line(self, line):
+        """Parse a line of the output of the rsync client.
+
+        It returns a tuple with the relative path of the entry, a Boolean
+        value indicating if it is a directory and a dictionary with the size
+        and the modification time.  `None` is returned if the line is not
+        valid.  Symbolic links are not followed by rsync, they are indexed
+        as files.
+        """
+        match = self._LINE_RE.match(line)
+        if match is None:
+            return None
+        file_type, date, path = match.groups()
+        if file_type == 'l':
+            path = path.split(' -> ', 1)[0]
+        path = self._ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), path)
+        try:
+            path = path.decode(self._encoding)
+        except UnicodeDecodeError:
+            path = path.decode('latin-1')
+        is_dir = (file_type == 'd')
+        data = {}
+        if not is_dir:
+            size = line[10:].split()[0].replace(',', '').replace('.', '')
+            data['size'] = int(size)
+        try:
+            # The client prints the times in the local time zone.
+            data['mtime'] = int(time.mktime(time.strptime(
+                date, '%Y/%m/%d %H:%M:%S')))
+        except (ValueError, OverflowError):
+            pass
+        return path.rstrip(u'/'), is_dir, data
+
+
+class _ThrottledFile(object):
+    """File-like object throttling the data read from another file.
+
+    The `throttle` function is called with the number of bytes read (see
+    `ProtocolHandler._get_throttle()`).
+    """
+
+    def __init__(self, fileobj, throttle):
+        self._file = fileobj
+        self._throttle = throttle
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._throttle(len(data))
+        return data
+
+    def readline(self, size=-1):
+        line = self._file.readline(size)
+        self._throttle(len(line))
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+class _DeflateDecompressor(object):
+    """Decompressor for the deflate content encoding.
+
+    The standard requires the zlib format but some servers send raw deflate
+    data.  The format is detected with the first chunk of data.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+
+    def decompress(self, data, max_length=0):
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+            try:
+                return self._decompressor.decompress(data, max_length)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data, max_length)
+
+    def flush(self):
+        if self._decompressor is None:
+            return ''
+        return self._decompressor.flush()
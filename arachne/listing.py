@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Parsers for the responses of the FTP LIST command.
+"""
+
+# Based on ftpparse.c and ftpparse.h by D. J. Bernstein.
+
+import re
+import time
+import calendar
+import datetime
+
+
+class ListParser(object):
+    """Parser for a LIST format.
+
+    Abstract class that should be subclassed by each supported format.  The
+    subclasses should set the `name` attribute, the `_LINE_RE` attribute to a
+    compiled regular expression (using the `re.M` flag) matching a whole line
+    of the format, and override `_get_entry()`.
+
+    A given FTP server always uses the same format, so the parser is applied
+    to the whole listing at once instead of trying each format on every line.
+
+    Subclasses can override `_get_facts()` if the format includes the size or
+    modification time of the entries.
+    """
+
+    name = ''
+
+    _LINE_RE = None
+
+    def parse(self, data):
+        """Parse a whole LIST response.
+
+        It returns a list of tuples containing the name of the entry, a
+        Boolean value indicating if it is a directory (`None` if unknown), the
+        line of the listing and a dictionary with the facts known about the
+        entry (see `_get_facts()`).  Lines not matching the format are
+        ignored.
+        """
+        entries = []
+        for match in self._LINE_RE.finditer(data):
+            entry = self._get_entry(match)
+            if entry is not None:
+                entries.append(entry + (match.group(0).rstrip('\r'),
+                                        self._get_facts(match, entry[1])))
+        return entries
+
+    def parse_line(self, line):
+        """Parse a single line.
+
+        `None` is returned if the line does not match the format, otherwise it
+        returns a tuple containing the name of the entry, a Boolean value
+        indicating if it is a directory (`None` if unknown) and the dictionary
+        of facts.
+        """
+        match = self._LINE_RE.match(line)
+        if match is not None and match.end() == len(line):
+            entry = self._get_entry(match)
+            if entry is not None:
+                return entry + (self._get_facts(match, entry[1]), )
+        return None
+
+    def count(self, data):
+        """Return the number of lines of the listing matching the format.
+        """
+        return len(self._LINE_RE.findall(data))
+
+    def _get_entry(self, match):
+        """Return the name and type of the entry for a matched line.
+        """
+        raise NotImplementedError('A subclass must override this method.')
+
+    def _get_facts(self, match, is_dir):
+        """Return the facts known about the entry for a matched line.
+
+        The dictionary can contain the `size` in bytes (only for files) and
+        the modification time (`mtime`) as seconds since the epoch.  Servers
+        list times in their own time zone, they are converted as if they were
+        UTC, so they are only useful to detect changes.
+        """
+        return {}
+
+
+class UnixParser(ListParser):
+    """Parser for UNIX-style listings (`ls -l`).
+
+    Also used by many other servers, like Microsoft's FTP server for Windows.
+    """
+
+    name = 'unix'
+
+    _LINE_RE = re.compile(r'^(?P<type>[-dbclps])\S*'
+                          r'[ \t]+\S+[ \t]+\S+[ \t]+\S+'
+                          r'[ \t]+(?P<size>\S+)[ \t]+(?P<month>\S+)'
+                          r'[ \t]+(?P<day>\S+)[ \t]+(?P<time>\S+)'
+                          r'[ \t]+(?P<name>.+?)\r?$', re.M)
+
+    def _get_entry(self, match):
+        entry_type = match.group('type')
+        name = match.group('name')
+        if entry_type == '-':
+            is_dir = False
+        elif entry_type == 'd':
+            is_dir = True
+        else:
+            is_dir = None
+            if entry_type == 'l':
+                name = name.split(' -> ')[0]
+        return (name, is_dir)
+
+    def _get_facts(self, match, is_dir):
+        return _get_unix_facts(match, is_dir)
+
+
+class MSDOSParser(ListParser):
+    """Parser for MSDOS-style listings (`dir`).
+    """
+
+    name = 'msdos'
+
+    _LINE_RE = re.compile(r'^(?P<date>\d{2}-\d{2}-\d{2,4})'
+                          r'[ \t]+(?P<time>\d{1,2}:\d{2}(?:[AaPp][Mm])?)'
+                          r'[ \t]+(?:(?P<dir><DIR>)|(?P<size>[\d,]+))'
+                          r'[ \t]+(?P<name>.+?)\r?$', re.M)
+
+    def _get_entry(self, match):
+        return (match.group('name'), match.group('dir') is not None)
+
+    def _get_facts(self, match, is_dir):
+        facts = {}
+        size = match.group('size')
+        if size is not None:
+            facts['size'] = int(size.replace(',', ''))
+        month, day, year = map(int, match.group('date').split('-'))
+        if year < 70:
+            year += 2000
+        elif year < 100:
+            year += 1900
+        clock = match.group('time').upper()
+        hour, minute = map(int, clock.rstrip('APM').split(':'))
+        if clock.endswith('PM') and hour < 12:
+            hour += 12
+        elif clock.endswith('AM') and hour == 12:
+            hour = 0
+        mtime = _get_mtime(year, month, day, hour, minute)
+        if mtime is not None:
+            facts['mtime'] = mtime
+        return facts
+
+
+class EPLFParser(ListParser):
+    """Parser for the Easily Parsed LIST Format.
+    """
+
+    name = 'eplf'
+
+    _LINE_RE = re.compile(r'^\+(?P<facts>[^\t\r\n]*)\t(?P<name>.+?)\r?$', re.M)
+
+    def _get_entry(self, match):
+        facts = match.group('facts').split(',')
+        return (match.group('name'), '/' in facts)
+
+    def _get_facts(self, match, is_dir):
+        facts = {}
+        for fact in match.group('facts').split(','):
+            if fact[1:].isdigit():
+                if fact[0] == 'm':
+                    facts['mtime'] = int(fact[1:])
+                elif fact[0] == 's' and not is_dir:
+                    facts['size'] = int(fact[1:])
+        return facts
+
+
+class NetWareParser(ListParser):
+    """Parser for Novell NetWare listings.
+    """
+
+    name = 'netware'
+
+    _LINE_RE = re.compile(r'^(?P<type>[-d])[ \t]+\[[-A-Z]+\][ \t]+\S+'
+                          r'[ \t]+(?P<size>\d+)[ \t]+(?P<month>\S+)'
+                          r'[ \t]+(?P<day>\d{1,2})'
+                          r'[ \t]+(?P<time>\d{1,2}:\d{2}|\d{4})'
+                          r'[ \t]+(?P<name>.+?)\r?$', re.M)
+
+    def _get_entry(self, match):
+        return (match.group('name'), match.group('type') == 'd')
+
+    def _get_facts(self, match, is_dir):
+        return _get_unix_facts(match, is_dir)
+
+
+class VMSParser(ListParser):
+    """Parser for OpenVMS listings.
+
+    Long file names are followed by the rest of the entry in the next line.
+    Directories are the files with the `.DIR` extension.
+    """
+
+    name = 'vms'
+
+    _LINE_RE = re.compile(r'^(?P<name>[^ \t\r\n;]+);\d+(?:\r?\n)?'
+                          r'[ \t]+(?P<size>\d+)(?:/\d+)?'
+                          r'[ \t]+(?P<date>\d{1,2}-[A-Za-z]{3}-\d{4})'
+                          r'[ \t]+(?P<time>\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)'
+                          r'.*?\r?$', re.M)
+
+    def _get_entry(self, match):
+        name = match.group('name')
+        if name.upper().endswith('.DIR'):
+            return (name[:-4], True)
+        else:
+            return (name, False)
+
+    def _get_facts(self, match, is_dir):
+        # The size is given in blocks.
+        facts = {}
+        day, month, year = match.group('date').split('-')
+        month = _MONTHS.get(month.lower())
+        clock = match.group('time').split('.')[0].split(':')
+        if month is not None:
+            mtime = _get_mtime(int(year), month, int(day),
+                               *[int(value) for value in clock])
+            if mtime is not None:
+                facts['mtime'] = mtime
+        return facts
+
+
+_MONTHS = dict((name, number) for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct',
+     'nov', 'dec'), 1))
+
+
+def _get_mtime(year, month, day, hour=0, minute=0, second=0):
+    """Return the given date as seconds since the epoch.
+
+    `None` is returned if the date is not valid.
+    """
+    try:
+        date = datetime.datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+    return calendar.timegm(date.timetuple())
+
+
+def _get_unix_facts(match, is_dir):
+    """Return the facts for a line of a UNIX-style listing.
+
+    The date is listed with the time but without the year for recent entries
+    (modified in the last six months).
+    """
+    facts = {}
+    size = match.group('size')
+    if is_dir is False and size.isdigit():
+        facts['size'] = int(size)
+    month = _MONTHS.get(match.group('month').lower()[:3])
+    day = match.group('day')
+    clock = match.group('time')
+    if month is None or not day.isdigit():
+        return facts
+    if ':' in clock:
+        try:
+            hour, minute = map(int, clock.split(':'))
+        except ValueError:
+            return facts
+        now = time.gmtime()
+        year = now.tm_year
+        if (month, int(day)) > (now.tm_mon, now.tm_mday + 1):
+            # The entry was modified last year.
+            year -= 1
+        mtime = _get_mtime(year, month, int(day), hour, minute)
+    elif clock.isdigit():
+        mtime = _get_mtime(int(clock), month, int(day))
+    else:
+        mtime = None
+    if mtime is not None:
+        facts['mtime'] = mtime
+    return facts
+
+
+# Registered parsers.  More specific formats go first, they win when several
+# parsers understand the same number of lines.
+PARSERS = (EPLFParser(), MSDOSParser(), NetWareParser(), VMSParser(),
+           UnixParser())
+
+
+def detect(data):
+    """Detect the format of a LIST response.
+
+    It returns the registered parser that understands most lines of the
+    listing or `None` if no parser understands any line.
+    """
+    best_parser, best_count = None, 0
+    for parser in PARSERS:
+        count = parser.count(data)
+        if count > best_count:
+            best_parser, best_count = parser, count
+    return best_parser
+
+
+def parse_line(line):
+    """Parse a line of a listing in an unknown format.
+
+    It tries each registered parser.  See `ListParser.parse_line()`.
+    """
+    for parser in PARSERS:
+        entry = parser.parse_line(line)
+        if entry is not None:
+            return entry
+    return None
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pools of connections shared by the protocol handlers.
+"""
+
+import time
+import socket
+import ftplib
+import urllib
+import urllib2
+import httplib
+import threading
+
+from arachne import __version__
+
+
+class ConnectionPool(object):
+    """Connection pool.
+
+    Keeps idle connections grouped by a key (usually the site ID) so they can
+    be reused by the protocol handlers of all the site crawlers.  A connection
+    is owned by a single handler between `get()` and `put()`.
+
+    Subclasses can override `_is_alive()` and `_close()` to support a
+    specific kind of connection.
+    """
+
+    def __init__(self, size=4):
+        """Initialize the pool.
+
+        The `size` argument is the maximum number of idle connections kept for
+        each key.  If more connections are returned the oldest ones are closed.
+        """
+        self._size = size
+        self._idle = {}
+        self._mutex = threading.Lock()
+
+    def get(self, key, max_idle):
+        """Return an idle connection for the given key.
+
+        Connections that have been idle for more than `max_idle` seconds or
+        that do not pass the liveness check are closed and discarded.  `None`
+        is returned if there is no usable connection in the pool.
+        """
+        while True:
+            self._mutex.acquire()
+            try:
+                try:
+                    conn, released = self._idle[key].pop()
+                except (KeyError, IndexError):
+                    return None
+            finally:
+                self._mutex.release()
+            if time.time() - released > max_idle or not self._is_alive(conn):
+                self._close(conn)
+            else:
+                return conn
+
+    def put(self, key, conn):
+        """Return a connection to the pool.
+        """
+        self._mutex.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            idle.append((conn, time.time()))
+            expired = idle[:-self._size]
+            del idle[:-self._size]
+        finally:
+            self._mutex.release()
+        for conn, released in expired:
+            self._close(conn)
+
+    def close(self):
+        """Close all the idle connections in the pool.
+        """
+        self._mutex.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._mutex.release()
+        for conns in idle.itervalues():
+            for conn, released in conns:
+                self._close(conn)
+
+    def _is_alive(self, conn):
+        """Check if an idle connection can be used.
+        """
+        return True
+
+    def _close(self, conn):
+        """Close a connection removed from the pool.
+        """
+        conn.close()
+
+
+class FTPConnectionPool(ConnectionPool):
+    """Pool of logged-in FTP control connections.
+    """
+
+    def _is_alive(self, ftp):
+        """Check the FTP control connection with a NOOP command.
+        """
+        try:
+            ftp.voidcmd('NOOP')
+        except (ftplib.Error, socket.error, IOError, EOFError):
+            return False
+        else:
+            return True
+
+    def _close(self, ftp):
+        """Close the FTP session.
+        """
+        try:
+            ftp.quit()
+        except (ftplib.Error, socket.error, IOError, EOFError):
+            ftp.close()
+
+
+class HTTPConnectionPool(ConnectionPool):
+    """Pool of persistent HTTP/1.1 connections.
+
+    The connections are returned to the pool after reading the whole
+    response, if the server did not close them.  A connection closed by the
+    server while idle is detected when it is used (see `KeepAliveHandler`).
+    """
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """Handler for `urllib2` using the connections of a `HTTPConnectionPool`.
+
+    The requests are sent using an idle connection of the pool if there is
+    one.  If the connection was closed by the server the request is retried
+    once using a new connection.
+    """
+
+    def __init__(self, pool, key, max_idle):
+        """Initialize the handler.
+
+        Connections are taken from and returned to `pool` for the given
+        `key` (usually the site ID).  Connections idle for more than
+        `max_idle` seconds are not used.
+        """
+        urllib2.HTTPHandler.__init__(self)
+        self._pool = pool
+        self._key = key
+        self._max_idle = max_idle
+
+    def do_open(self, http_class, req):
+        """Send the request and return the response.
+        """
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (self._key, host)
+        conn = self._pool.get(key, self._max_idle)
+        try:
+            response = None
+            if conn is not None:
+                try:
+                    response = self._request(conn, req)
+                except socket.timeout:
+                    raise
+                except (socket.error, httplib.HTTPException):
+                    # The connection was closed by the server while idle.
+                    # Retry using a new connection.
+                    conn.close()
+                    conn = None
+            if response is None:
+                conn = http_class(host, timeout=req.timeout)
+                response = self._request(conn, req)
+        except (socket.error, httplib.HTTPException), error:
+            if conn is not None:
+                conn.close()
+            raise urllib2.URLError(error)
+        fp = socket._fileobject(_PooledResponse(self._pool, key, conn,
+                                                response), close=True)
+        resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+    @staticmethod
+    def _request(conn, req):
+        """Send the request using the given connection.
+        """
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((name, value)
+                            for name, value in req.headers.iteritems()
+                            if name not in headers))
+        headers = dict((name.title(), value)
+                       for name, value in headers.iteritems())
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse()
+
+
+class _PooledResponse(object):
+    """Response of a request sent by `KeepAliveHandler`.
+
+    When it is closed the connection is returned to the pool if the
+    response was completely read and the server keeps the connection open.
+    Otherwise the connection is closed.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def recv(self, size):
+        """Read up to `size` bytes of the body of the response.
+        """
+        return self._response.read(size)
+
+    def close(self):
+        """Release the connection.
+        """
+        response, self._response = self._response, None
+        if response is not None:
+            if response.isclosed() and not response.will_close:
+                self._pool.put(self._key, self._conn)
+            else:
+                response.close()
+                self._conn.close()
+
+
+def build_http_opener(pool=None, key=None, max_idle=0):
+    """Return the `urllib2.OpenerDirector` used for the HTTP requests.
+
+    If a pool is given and `max_idle` is greater than zero the persistent
+    connections of the pool are used for the given key.
+    """
+    if pool is not None and max_idle > 0:
+        opener = urllib2.build_opener(KeepAliveHandler(pool, key, max_idle))
+    else:
+        opener = urllib2.build_opener()
+    opener.addheaders = [('User-agent', 'Arachne/%s' % __version__)]
+    return opener
@@ -22,7 +22,6 @@
 
 import os
 import re
-import time
 import threading
 import logging
 
@@ -247,8 +246,13 @@ class IndexProcessor(ResultProcessor):
                     if data['is_dir']:
                         task = CrawlTask(result.task.site_id, data['url'])
                         self._tasks.put_new(task)
-            # Put a new task to visit the directory again.
-            self._tasks.put_visited(result.task, dir_changed)
+            # Put a new task to visit the directory again.  Subdirectories
+            # whose modification time does not change will not be revisited.
+            self._tasks.report_mtimes(result)
+            mtimes = [data['mtime'] for entry, data in result
+                      if data.get('mtime') is not None]
+            modified = max(mtimes) if mtimes else None
+            self._tasks.put_visited(result.task, dir_changed, modified)
         # Result sucessfully processed.
         self._results.report_done(result)
 
@@ -388,7 +392,6 @@ class ProcessorManager(threading.Thread):
         """Initialize the processor manager.
         """
         threading.Thread.__init__(self)
-        self._sleep = 1
         self._results = results
         self._processor = IndexProcessor(sites_info, database_dir, tasks, results)
         # Flag used to stop the loop started by the run() method.
@@ -404,7 +407,7 @@ class ProcessorManager(threading.Thread):
                     result = self._results.get()
                 except EmptyQueue:
                     self._processor.flush()
-                    time.sleep(self._sleep)
+                    self._results.wait()
                 else:
                     logging.info('Processing "%s"' % result.task.url)
                     self._processor.process(result)
@@ -416,3 +419,4 @@ class ProcessorManager(threading.Thread):
         """Order the main loop to end.
         """
         self._running = False
+        self._results.interrupt()
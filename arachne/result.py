@@ -152,6 +152,9 @@ class ResultQueue(object):
         for result_db_name in old_dbs:
             self._db_env.dbremove(result_db_name)
         self._mutex = threading.Lock()
+        # Condition notified when a result is put in the queue.
+        self._not_empty = threading.Condition(self._mutex)
+        self._interrupted = False
 
     def __len__(self):
         """Return the number of crawl results in the queue.
@@ -181,6 +184,7 @@ class ResultQueue(object):
             self._sites_db.put(key, site_id, txn)
             result_db.put(key, cPickle.dumps(result, 2), txn)
             txn.commit()
+            self._not_empty.notify()
         finally:
             self._mutex.release()
 
@@ -233,6 +237,33 @@ class ResultQueue(object):
         finally:
             self._mutex.release()
 
+    def wait(self, timeout=None):
+        """Wait until a result is available.
+
+        Returns immediately if the queue is not empty, otherwise when a
+        result is put, after `timeout` seconds if it is not `None`, or if
+        `interrupt()` is invoked.
+        """
+        self._mutex.acquire()
+        try:
+            if not self._interrupted and not self._sites_db:
+                self._not_empty.wait(timeout)
+        finally:
+            self._mutex.release()
+
+    def interrupt(self):
+        """Wake up the threads waiting for results.
+
+        The following calls to `wait()` return immediately.  Used to stop the
+        processor.
+        """
+        self._mutex.acquire()
+        try:
+            self._interrupted = True
+            self._not_empty.notifyAll()
+        finally:
+            self._mutex.release()
+
     def report_done(self, result):
         """Report a result as processed.
 
@@ -26,6 +26,7 @@ import time
 import glob
 import math
 import bsddb
+import socket
 import cPickle
 import logging
 import threading
@@ -49,6 +50,14 @@ class CrawlTask(object):
         self._revisit_wait = 0
         self._revisit_count = -1
         self._change_count = 0
+        self._probes = {}
+        self._mtime = None
+        self._validators = {}
+        self._visit_time = None
+        self._modified = None
+        self._modified_count = 0
+        self._modified_visit_count = 0
+        self._unmodified_time = 0
 
     def __getstate__(self):
         """Used by pickle when instances are serialized.
@@ -59,6 +68,14 @@ class CrawlTask(object):
             'revisit_wait': self._revisit_wait,
             'revisit_count': self._revisit_count,
             'change_count': self._change_count,
+            'probes': self._probes,
+            'mtime': self._mtime,
+            'validators': self._validators,
+            'visit_time': self._visit_time,
+            'modified': self._modified,
+            'modified_count': self._modified_count,
+            'modified_visit_count': self._modified_visit_count,
+            'unmodified_time': self._unmodified_time,
         }
 
     def __setstate__(self, state):
@@ -69,16 +86,50 @@ class CrawlTask(object):
         self._revisit_wait = state['revisit_wait']
         self._revisit_count = state['revisit_count']
         self._change_count = state['change_count']
+        # Tasks serialized by previous versions do not have all the keys.
+        self._probes = state.get('probes', {})
+        self._mtime = state.get('mtime')
+        self._validators = state.get('validators', {})
+        self._visit_time = state.get('visit_time')
+        self._modified = state.get('modified')
+        self._modified_count = state.get('modified_count', 0)
+        self._modified_visit_count = state.get('modified_visit_count', 0)
+        self._unmodified_time = state.get('unmodified_time', 0)
 
-    def report_visit(self, changed):
+    def report_visit(self, changed, modified=None):
         """Report that the directory was visited.
 
         The `changed` argument should be `True` if the content of the directory
         changed, `False` otherwise.  If it's the first time visited the value
-        of this argument will be ignored.
+        of this argument will be ignored.  The `modified` argument is the last
+        modification time of the content of the directory, if known, in the
+        clock of the server.  It is used to collect the data of the
+        last-modified estimator.
         """
+        now = int(time.time())
         if self._revisit_count >= 0 and changed:
             self._change_count += 1
+        if (self._revisit_count >= 0 and self._visit_time is not None
+                and modified is not None and self._modified is not None):
+            interval = max(0, now - self._visit_time)
+            if changed or modified > self._modified:
+                self._modified_count += 1
+                if modified > self._modified:
+                    # Listing times are in the clock (and often the local
+                    # time zone) of the server, only differences between
+                    # them are meaningful.  The previous visit was after the
+                    # previous modification, so the change happened at
+                    # most this long after it.
+                    unmodified = interval - (modified - self._modified)
+                else:
+                    # Entries were removed, the time is not known.
+                    unmodified = interval / 2
+                self._unmodified_time += min(interval, max(0, unmodified))
+            else:
+                self._unmodified_time += interval
+            self._modified_visit_count += 1
+        self._visit_time = now
+        self._modified = modified
         self._revisit_count += 1
 
     def reset_change_count(self):
@@ -89,6 +140,16 @@ class CrawlTask(object):
         """
         self._change_count = 0
 
+    def decay_modified_counts(self):
+        """Halve the counters of the last-modified estimator.
+
+        Used to give less weight to old visits, so the estimate follows
+        changes in the behavior of the directory.
+        """
+        self._modified_count /= 2.0
+        self._modified_visit_count /= 2.0
+        self._unmodified_time /= 2.0
+
     def _get_site_id(self):
         """Get method for the `site_id` property.
         """
@@ -129,6 +190,85 @@ class CrawlTask(object):
 
     change_count = property(_get_change_count)
 
+    def _get_probes(self):
+        """Get method for the `probes` property.
+        """
+        return self._probes
+
+    def _set_probes(self, probes):
+        """Set method for the `probes` property.
+        """
+        self._probes = probes
+
+    # Dictionary used by protocol handlers to remember how the entries of the
+    # directory were classified in the last visit.
+    probes = property(_get_probes, _set_probes)
+
+    def _get_mtime(self):
+        """Get method for the `mtime` property.
+        """
+        return self._mtime
+
+    def _set_mtime(self, mtime):
+        """Set method for the `mtime` property.
+        """
+        self._mtime = mtime
+
+    # Modification time of the directory, as listed in its parent directory,
+    # when it was last visited.  `None` if unknown.
+    mtime = property(_get_mtime, _set_mtime)
+
+    def _get_validators(self):
+        """Get method for the `validators` property.
+        """
+        return self._validators
+
+    def _set_validators(self, validators):
+        """Set method for the `validators` property.
+        """
+        self._validators = validators
+
+    # Dictionary mapping the headers of a conditional request (e.g.
+    # If-None-Match) to the validators of the content of the directory
+    # received in the last visit.  Used by the HTTP handlers.
+    validators = property(_get_validators, _set_validators)
+
+    def _get_modified(self):
+        """Get method for the `modified` property.
+        """
+        return self._modified
+
+    # Last modification time of the content of the directory known in the
+    # last visit.  `None` if unknown.
+    modified = property(_get_modified)
+
+    def _get_modified_count(self):
+        """Get method for the `modified_count` property.
+        """
+        return self._modified_count
+
+    # Number of visits with a known modification time that found changes.
+    modified_count = property(_get_modified_count)
+
+    def _get_modified_visit_count(self):
+        """Get method for the `modified_visit_count` property.
+        """
+        return self._modified_visit_count
+
+    # Number of visits with a known modification time.
+    modified_visit_count = property(_get_modified_visit_count)
+
+    def _get_unmodified_time(self):
+        """Get method for the `unmodified_time` property.
+        """
+        return self._unmodified_time
+
+    # Seconds known to be without changes in the visits with a known
+    # modification time: a lower bound of the time between the last change
+    # and the visit if the directory changed, the whole interval between
+    # visits otherwise.
+    unmodified_time = property(_get_unmodified_time)
+
 
 class TaskQueue(object):
     """Task queue.
@@ -155,11 +295,44 @@ class TaskQueue(object):
         self._sites_db.open(sites_db_name, bsddb.db.DB_BTREE,
                             bsddb.db.DB_CREATE | bsddb.db.DB_AUTO_COMMIT
                             | bsddb.db.DB_THREAD)
+        # Create the database for the modification times of the directories
+        # reported in the listings of their parents.  Keys are the site ID
+        # followed by the path of the directory.
+        mtimes_db_name = 'mtimes.db'
+        self._mtimes_db = bsddb.db.DB(self._db_env)
+        self._mtimes_db.open(mtimes_db_name, bsddb.db.DB_BTREE,
+                             bsddb.db.DB_CREATE | bsddb.db.DB_AUTO_COMMIT
+                             | bsddb.db.DB_THREAD)
+        # Create the database for the keys of the tasks of the directories of
+        # watched sites, used to find the task of a directory that changed.
+        # Keys are the site ID followed by the path of the directory.
+        watched_db_name = 'watched.db'
+        self._watched_db = bsddb.db.DB(self._db_env)
+        self._watched_db.open(watched_db_name, bsddb.db.DB_BTREE,
+                              bsddb.db.DB_CREATE | bsddb.db.DB_AUTO_COMMIT
+                              | bsddb.db.DB_THREAD)
+        # Create the database for the directories listed by recursive
+        # requests whose results are not processed yet (see
+        # `report_listed()`).  Keys are the site ID followed by the path of
+        # the directory.  It is kept on disk as the results.
+        listed_db_name = 'listed.db'
+        self._listed_db = bsddb.db.DB(self._db_env)
+        self._listed_db.open(listed_db_name, bsddb.db.DB_BTREE,
+                             bsddb.db.DB_CREATE | bsddb.db.DB_AUTO_COMMIT
+                             | bsddb.db.DB_THREAD)
         # Get the list of databases to purge sites that were removed from the
         # configuration file.
         old_dbs = [os.path.basename(db_path)
                    for db_path in glob.glob('%s/*.db' % db_home.rstrip('/'))]
         old_dbs.remove(sites_db_name)
+        old_dbs.remove(mtimes_db_name)
+        old_dbs.remove(watched_db_name)
+        old_dbs.remove(listed_db_name)
+        self._sites_info = sites_info
+        # Directories watched for changes and directories reported as
+        # changed whose tasks were not found in the queue.
+        self._watched = set()
+        self._changed = set()
         # Open or create databases for tasks.
         self._task_dbs = {}
         for site_id, info in sites_info.iteritems():
@@ -171,17 +344,57 @@ class TaskQueue(object):
             self._task_dbs[site_id] = task_db
             if task_db_name in old_dbs:
                 old_dbs.remove(task_db_name)
-                if site_id not in self._sites_db.values():
-                    self._sites_db.put(self._get_key(), site_id)
             else:
                 # New site added to the configuration file.
-                self._sites_db.put(self._get_key(), site_id)
                 self._put(CrawlTask(site_id, info['url']))
+        self._set_connections()
         for task_db_name in old_dbs:
             self._db_env.dbremove(task_db_name)
-        self._sites_info = sites_info
+            for db in (self._mtimes_db, self._watched_db, self._listed_db):
+                self._purge_site(db, task_db_name[:-len('.db')])
         self._revisits = 5
+        # Current request wait of each site.  The wait of the sites with the
+        # auto_request_wait option moves towards this number of times the
+        # response time of the site (see `report_response_time()`).
+        self._response_factor = 10
+        self._request_waits = dict((site_id, float(info['request_wait']))
+                                   for site_id, info in sites_info.iteritems())
+        # Sites on the same host share its connections and request wait (the
+        # host_max_connections and host_request_wait options).  It maps the
+        # ID of each site to its host and each host with limits to their
+        # values, the connections in use and when it can be contacted again.
+        self._site_hosts = {}
+        self._hosts = {}
+        for site_id, info in sites_info.iteritems():
+            host = self._get_host(info)
+            if host is not None:
+                self._site_hosts[site_id] = host
+                self._add_host_limits(host, info)
+        for site_id, host in self._site_hosts.items():
+            if host not in self._hosts:
+                del self._site_hosts[site_id]
+        # Tasks returned by get() that have not been reported.  It maps the id
+        # of the task to the record in its database and the number of claimed
+        # tasks, the wait and whether the site failed for its batch (shared
+        # by the tasks of the batch).
+        self._claims = {}
+        # Records of the claimed tasks, skipped when other connections to the
+        # same site get tasks.
+        self._claimed = set()
         self._mutex = threading.Lock()
+        # Condition notified when tasks are put or sites are released.  The
+        # crawlers wait for it using `wait()`.
+        self._ready = threading.Condition(self._mutex)
+        # Time when the first task becomes executable for the crawlers of
+        # each set of sites, computed when `get()` finds no executable tasks
+        # (see `get_wait()`).  None is used as key for all the sites.
+        self._next_ready = {}
+        # Timer that wakes up the crawlers waiting until the first task becomes
+        # executable, and the time when it expires.  A single timer is used
+        # for all the waiting crawlers, the earliest time wins.
+        self._timer = None
+        self._timer_deadline = None
+        self._interrupted = False
 
     def __len__(self):
         """Return the number of crawl tasks in the queue.
@@ -204,12 +417,17 @@ class TaskQueue(object):
             site_info = self._sites_info[site_id]
             max_depth = site_info['max_depth']
             current_depth = task.url.path.count(u'/')
-            if current_depth <= max_depth:
+            listed = self._get_mtime_key(site_id, task.url)
+            if self._listed_db.get(listed) is not None:
+                # The result of this directory is waiting to be processed.
+                self._listed_db.delete(listed)
+            elif current_depth <= max_depth:
                 self._put(task)
+                self._notify()
         finally:
             self._mutex.release()
 
-    def put_visited(self, task, changed):
+    def put_visited(self, task, changed, modified=None):
         """Put a task for a visited directory.
 
         If the directory is visited for the first time the `changed` argument
@@ -217,99 +435,128 @@ class TaskQueue(object):
         argument should be `True` if the directory changed, `False` otherwise.
         This information will be used to estimate the change frequency.  In
         both cases the `TaskQueue` will schedule a task to revisit the
-        directory.
+        directory.  The `modified` argument should be the newest modification
+        time of the entries of the directory, if known.  It is used by the
+        last-modified estimator (see the `revisit_estimator` option).
         """
         self._mutex.acquire()
         try:
-            site_id = task.site_id
-            site_info = self._sites_info[site_id]
-            task.report_visit(changed)
-            if task.revisit_count == 0:
-                # First visit.  Set default values.
-                task.revisit_wait = site_info['default_revisit_wait']
-                logging.info('Setting revisit frequency for "%s" to %s'
-                             % (task.url, secs_to_readable(task.revisit_wait)))
+            self._put_visited(task, changed, modified)
+            self._notify()
+        finally:
+            self._mutex.release()
+
+    def report_mtimes(self, result):
+        """Report the modification times of the subdirectories of a result.
+
+        Result processors should use this method before `put_visited()` with
+        the results having the `mtime` key in the data of the entries.  When
+        the task of a subdirectory becomes executable, it is rescheduled as
+        visited without changes if its modification time is the same as in
+        the last visit.
+        """
+        self._mutex.acquire()
+        try:
+            site_id = result.task.site_id
+            txn = self._db_env.txn_begin()
+            for entry, data in result:
+                if data['is_dir'] and data.get('mtime') is not None:
+                    key = self._get_mtime_key(site_id, data['url'])
+                    self._mtimes_db.put(key, str(data['mtime']), txn=txn)
+            txn.commit()
+        finally:
+            self._mutex.release()
+
+    def report_listed(self, task):
+        """Report a directory listed by a recursive request.
+
+        Protocol handlers should use this method for each subdirectory of a
+        task whose result was obtained from a recursive listing.  Until the
+        result is processed, tasks for the directory given to `put_new()` are
+        ignored, the directory will be scheduled by `put_visited()`.
+        """
+        self._mutex.acquire()
+        try:
+            self._listed_db.put(self._get_mtime_key(task.site_id, task.url),
+                                '')
+        finally:
+            self._mutex.release()
+
+    def report_watched(self, site_id, url, watched=True):
+        """Report if a directory is watched for changes.
+
+        Used by the `DirectoryWatcher` for the directories of the sites with
+        the `watch` option.  While a directory is watched it is revisited
+        after the `max_revisit_wait` interval, or when it is reported by
+        `report_changed()`.
+        """
+        self._mutex.acquire()
+        try:
+            if watched:
+                self._watched.add((site_id, url.path))
             else:
-                if task.revisit_count >= self._revisits:
-                    minimum = site_info['min_revisit_wait']
-                    maximum = site_info['max_revisit_wait']
-                    estimated = self._estimate_revisit_wait(task)
-                    task.revisit_wait = min(maximum, max(minimum, estimated))
-                    task.reset_change_count()
-                    logging.info('Changing revisit frequency for "%s" to %s'
-                                 % (task.url, secs_to_readable(task.revisit_wait)))
-                else:
-                    logging.info('Missing %s visits to "%s" before estimating change frequency.'
-                                 % (self._revisits - task.revisit_count,task.url))
-            self._put(task, task.revisit_wait)
+                self._watched.discard((site_id, url.path))
         finally:
             self._mutex.release()
 
-    def get(self):
-        """Return an executable task.
+    def report_changed(self, site_id, url):
+        """Report a change in the content of a directory.
 
-        Return a task executable right now.  The task should be reported later
-        as done or error using `report_done()`, `report_error_dir()` or
-        `report_error_site()`.  If there is not executable task an `EmptyQueue`
-        exception is raised.
+        The task of the directory becomes executable right now.  If the task
+        is not in the queue (e.g. it is being executed) the directory will be
+        visited again as soon as the task is put back in the queue.
         """
         self._mutex.acquire()
         try:
-            if not self._sites_db:
-                # Sites database is empty.
-                raise EmptyQueue('No sites.')
-            task = None
+            path = url.path
+            key = self._get_mtime_key(site_id, url)
+            task_key = self._watched_db.get(key)
             txn = self._db_env.txn_begin()
-            sites_cursor = self._sites_db.cursor(txn)
-            site_priority, site_id = sites_cursor.first()
-            while task is None:
-                site_priority, site_id = sites_cursor.current()
-                if site_priority > self._get_key():
-                    # The site cannot be visited right now.
-                    sites_cursor.close()
-                    txn.commit()
-                    raise EmptyQueue('No available sites.')
-                try:
-                    task_db = self._task_dbs[site_id]
-                except KeyError:
-                    # Got the ID of an old site.
-                    sites_cursor.delete()
-                    if not sites_cursor.next():
-                        # Last site in database checked.
-                        sites_cursor.close()
-                        txn.commit()
-                        raise EmptyQueue('No executable tasks.')
-                else:
-                    if not task_db:
-                        # The task database is empty.
-                        if not sites_cursor.next():
-                            # Last site in database checked.
-                            sites_cursor.close()
-                            txn.commit()
-                            raise EmptyQueue('No executable tasks.')
-                    else:
-                        task_cursor = task_db.cursor(txn)
-                        task_priority, pickled_task = task_cursor.first()
-                        if task_priority > self._get_key():
-                            # The task at the head of the database is not
-                            # executable right now.
-                            if not sites_cursor.next():
-                                # Last site in database checked.
-                                task_cursor.close()
-                                sites_cursor.close()
-                                txn.commit()
-                                raise EmptyQueue('No executable tasks.')
-                        else:
-                            # There is an executable task.
-                            sites_cursor.delete()
-                            task = cPickle.loads(pickled_task)
-                        task_cursor.close()
-            sites_cursor.close()
+            found = False
+            if task_key is not None:
+                task_cursor = self._task_dbs[site_id].cursor(txn)
+                record = task_cursor.set(task_key)
+                while record is not None and record[0] == task_key:
+                    task = cPickle.loads(record[1])
+                    if task.url.path == path:
+                        # Claimed tasks are put back later by the crawlers.
+                        found = record not in self._claimed
+                        if found and task_key > self._get_key():
+                            task_cursor.delete()
+                            self._put(task, 0, txn)
+                            self._notify()
+                            logging.info('Change detected in "%s"' % task.url)
+                        break
+                    record = task_cursor.next()
+                task_cursor.close()
+            if not found:
+                self._changed.add((site_id, path))
             txn.commit()
-            return task
         finally:
             self._mutex.release()
 
+    def get(self):
+        """Return an executable task.
+
+        Return a task executable right now.  The task should be reported later
+        as done or error using `report_done()`, `report_error_dir()` or
+        `report_error_site()`.  If there is not executable task an `EmptyQueue`
+        exception is raised.
+        """
+        return self._get(1)[0]
+
+    def get_batch(self, site_ids=None):
+        """Return a list of executable tasks for the same site.
+
+        Return up to `batch_size` tasks (an option of the site, 1 by default)
+        executable right now.  Each task should be reported as done or error
+        as the ones returned by `get()`.  The site is not handed to other
+        crawlers until the last task of the batch is reported.  If `site_ids`
+        is given only tasks of the sites in this set are returned.  If there
+        is not executable task an `EmptyQueue` exception is raised.
+        """
+        return self._get(None, site_ids)
+
     def report_done(self, task):
         """Report task as done.
 
@@ -320,14 +567,10 @@ class TaskQueue(object):
             site_id = task.site_id
             site_info = self._sites_info[site_id]
             txn = self._db_env.txn_begin()
-            site_key = self._get_key(site_info['request_wait'])
-            self._sites_db.put(site_key, site_id, txn)
-            task_db = self._task_dbs[site_id]
-            task_cursor = task_db.cursor(txn)
-            task_cursor.first()
-            task_cursor.delete()
-            task_cursor.close()
+            self._delete(task, txn)
+            self._release(task, self._get_request_wait(site_id), txn)
             txn.commit()
+            self._notify()
         finally:
             self._mutex.release()
 
@@ -340,14 +583,12 @@ class TaskQueue(object):
         self._mutex.acquire()
         try:
             # Do not remove the task from the database!
-            site_id = task.site_id
-            site_info = self._sites_info[site_id]
-            site_key = self._get_key(site_info['error_site_wait'])
-            self._sites_db.put(site_key, site_id)
+            site_info = self._sites_info[task.site_id]
+            self._release(task, site_info['error_site_wait'], error=True)
+            self._notify()
         finally:
             self._mutex.release()
 
-
     def report_error_dir(self, task):
         """Report error executing a task.
 
@@ -360,15 +601,104 @@ class TaskQueue(object):
             site_id = task.site_id
             site_info = self._sites_info[site_id]
             txn = self._db_env.txn_begin()
-            site_key = self._get_key(site_info['request_wait'])
-            self._sites_db.put(site_key, site_id, txn)
-            task_db = self._task_dbs[site_id]
-            task_cursor = task_db.cursor(txn)
-            task_cursor.first()
-            task_cursor.delete()
-            task_cursor.close()
+            self._delete(task, txn)
+            self._release(task, self._get_request_wait(site_id), txn)
             self._put(task, site_info['error_dir_wait'], txn)
             txn.commit()
+            self._notify()
+        finally:
+            self._mutex.release()
+
+    def report_response_time(self, task, seconds):
+        """Report the time the site took to respond to the request of a task.
+
+        Protocol handlers should use this method before reporting a task
+        returned by `get()` as done or as an error retrieving the directory.
+        The request wait of sites with the auto_request_wait option is moved
+        towards a multiple of the response time, within the bounds given by
+        the min_request_wait and max_request_wait options.  Errors contacting
+        the site double the request wait.
+        """
+        site_id = task.site_id
+        if self._sites_info[site_id].get('auto_request_wait'):
+            self._mutex.acquire()
+            try:
+                # The time may be negative if the handler did not wait for
+                # the whole delay of the bandwidth limits (e.g. the delay
+                # after the last block of an event-loop channel).
+                target = self._response_factor * max(0, seconds)
+                self._set_request_wait(
+                    site_id, (self._request_waits[site_id] + target) / 2)
+            finally:
+                self._mutex.release()
+
+    def get_request_wait(self, site_id):
+        """Return the current request wait of a site in seconds.
+
+        It is the value of the request_wait option, or the value computed
+        from the response times if the site uses auto_request_wait.
+        """
+        self._mutex.acquire()
+        try:
+            return self._get_request_wait(site_id)
+        finally:
+            self._mutex.release()
+
+    def get_wait(self, site_ids=None):
+        """Return the seconds to wait before trying to get a task again.
+
+        Crawlers should use this method after `get()` or `get_batch()` raised
+        `EmptyQueue`.  It returns 0 if a task may be executable now (e.g. a
+        task was put after the last call to `get()`) or the number of seconds
+        until the first task becomes executable.  `None` is returned if there
+        are not tasks for the sites in `site_ids` (see `get_batch()`), a task
+        should be put first.
+        """
+        self._mutex.acquire()
+        try:
+            return self._get_wait(site_ids)
+        finally:
+            self._mutex.release()
+
+    def wait(self, site_ids=None, timeout=None):
+        """Wait until a task may be executable.
+
+        Crawlers should use this method after `get()` or `get_batch()` raised
+        `EmptyQueue`.  It returns when a task is put in the queue, a site is
+        released or the first task becomes executable (see `get_wait()`),
+        after `timeout` seconds if it is not `None`, or if `interrupt()` is
+        invoked.
+        """
+        self._mutex.acquire()
+        try:
+            if self._interrupted:
+                return
+            seconds = self._get_wait(site_ids)
+            if seconds is None:
+                seconds = timeout
+            elif timeout is not None:
+                seconds = min(seconds, timeout)
+            if seconds is None:
+                self._ready.wait()
+            elif seconds > 0:
+                # Condition.wait() with a timeout polls, the timer wakes up
+                # the crawler instead.
+                self._set_timer(time.time() + seconds)
+                self._ready.wait()
+        finally:
+            self._mutex.release()
+
+    def interrupt(self):
+        """Wake up the crawlers waiting for tasks.
+
+        The following calls to `wait()` return immediately.  Used to stop the
+        crawlers.
+        """
+        self._mutex.acquire()
+        try:
+            self._interrupted = True
+            self._cancel_timer()
+            self._ready.notifyAll()
         finally:
             self._mutex.release()
 
@@ -378,6 +708,9 @@ class TaskQueue(object):
         self._mutex.acquire()
         try:
             self._sites_db.sync()
+            self._mtimes_db.sync()
+            self._watched_db.sync()
+            self._listed_db.sync()
             for task_db in self._task_dbs.itervalues():
                 task_db.sync()
         finally:
@@ -388,13 +721,488 @@ class TaskQueue(object):
         """
         self._mutex.acquire()
         try:
+            self._cancel_timer()
             self._sites_db.close()
+            self._mtimes_db.close()
+            self._watched_db.close()
+            self._listed_db.close()
             for task_db in self._task_dbs.itervalues():
                 task_db.close()
             self._db_env.close()
         finally:
             self._mutex.release()
 
+    def _get(self, max_tasks, site_ids=None):
+        """Return a list of executable tasks for the same site.
+
+        Internal method used by `get()` and `get_batch()`.  If `max_tasks` is
+        `None` the `batch_size` option of the site is used.  If `site_ids` is
+        not `None` the other sites are skipped.
+        """
+        self._mutex.acquire()
+        # Times when the tasks of the skipped sites become executable.
+        ready_times = []
+        try:
+            if not self._sites_db:
+                # Sites database is empty.
+                raise EmptyQueue('No sites.')
+            tasks = []
+            now = self._get_key()
+            txn = self._db_env.txn_begin()
+            sites_cursor = self._sites_db.cursor(txn)
+            site_priority, site_id = sites_cursor.first()
+            while not tasks:
+                site_priority, site_id = sites_cursor.current()
+                if site_priority > now:
+                    # The site cannot be visited right now.
+                    ready_times.extend(self._get_ready_times(sites_cursor,
+                                                             site_ids, txn))
+                    sites_cursor.close()
+                    txn.commit()
+                    raise EmptyQueue('No available sites.')
+                try:
+                    task_db = self._task_dbs[site_id]
+                except KeyError:
+                    # Got the ID of an old site.
+                    sites_cursor.delete()
+                    if not sites_cursor.next():
+                        # Last site in database checked.
+                        sites_cursor.close()
+                        txn.commit()
+                        raise EmptyQueue('No executable tasks.')
+                else:
+                    if not task_db or (site_ids is not None
+                                       and site_id not in site_ids):
+                        # The task database is empty or the site is
+                        # handled by other crawlers.
+                        if not sites_cursor.next():
+                            # Last site in database checked.
+                            sites_cursor.close()
+                            txn.commit()
+                            raise EmptyQueue('No executable tasks.')
+                    else:
+                        task_cursor = task_db.cursor(txn)
+                        record = self._skip_unchanged(task_cursor,
+                                                      task_cursor.first(),
+                                                      now, txn)
+                        host_ready = self._get_host_ready(site_id)
+                        if (record is None or record[0] > now
+                                or host_ready is None or host_ready > now):
+                            # The task at the head of the database is not
+                            # executable right now or the host of the site
+                            # can not be contacted.
+                            if record is not None and host_ready is not None:
+                                ready_times.append(int(max(record[0],
+                                                           host_ready)))
+                            if not sites_cursor.next():
+                                # Last site in database checked.
+                                task_cursor.close()
+                                sites_cursor.close()
+                                txn.commit()
+                                raise EmptyQueue('No executable tasks.')
+                        else:
+                            # There are executable tasks.  The connection
+                            # to the site will not be returned to the sites
+                            # database until all of them are reported.
+                            sites_cursor.delete()
+                            if max_tasks is None:
+                                site_info = self._sites_info[site_id]
+                                max_tasks = site_info.get('batch_size', 1)
+                            batch = [0, 0, False]
+                            while (record is not None and record[0] <= now
+                                   and len(tasks) < max_tasks):
+                                task = cPickle.loads(record[1])
+                                self._claims[id(task)] = (record, batch)
+                                self._claimed.add(record)
+                                tasks.append(task)
+                                record = self._skip_unchanged(
+                                    task_cursor, task_cursor.next(), now, txn)
+                            batch[0] = len(tasks)
+                            self._claim_host(site_id)
+                        task_cursor.close()
+            sites_cursor.close()
+            txn.commit()
+            return tasks
+        except EmptyQueue:
+            ready_key = frozenset(site_ids) if site_ids is not None else None
+            self._next_ready[ready_key] = min(ready_times or [None])
+            raise
+        finally:
+            self._mutex.release()
+
+    def _get_request_wait(self, site_id):
+        """Return the current request wait of a site in seconds.
+
+        Internal method used by `get_request_wait()` and to release the
+        tasks.
+        """
+        return int(round(self._request_waits[site_id]))
+
+    def _set_request_wait(self, site_id, seconds):
+        """Set the request wait of a site with the auto_request_wait option.
+
+        The value is kept within the bounds configured for the site.
+        """
+        site_info = self._sites_info[site_id]
+        old_wait = self._get_request_wait(site_id)
+        self._request_waits[site_id] = min(site_info['max_request_wait'],
+                                           max(site_info['min_request_wait'],
+                                               seconds))
+        new_wait = self._get_request_wait(site_id)
+        if new_wait != old_wait:
+            logging.info('Changing request wait for "%s" to %d seconds'
+                         % (site_info['url'], new_wait))
+
+    def _get_wait(self, site_ids):
+        """Return the seconds to wait before trying to get a task again.
+
+        Internal method used by `get_wait()` and `wait()`.
+        """
+        key = frozenset(site_ids) if site_ids is not None else None
+        try:
+            next_ready = self._next_ready[key]
+        except KeyError:
+            # Unknown, the queue changed after the last call to get().
+            return 0
+        if next_ready is None:
+            return None
+        return max(0, next_ready - time.time())
+
+    def _get_ready_times(self, sites_cursor, site_ids, txn):
+        """Return when the tasks of the sites not released yet are executable.
+
+        Starting at the current record of the cursor, it returns for each
+        site with tasks (only the sites in `site_ids` if it is not `None`)
+        the time when its first task becomes executable.  The sites that can
+        not be executable before the ones already checked are skipped, and
+        also the sites whose host has all its connections in use.
+        """
+        ready_times = []
+        record = sites_cursor.current()
+        while record is not None:
+            site_priority, site_id = record
+            if ready_times and int(site_priority) >= min(ready_times):
+                break
+            task_db = self._task_dbs.get(site_id)
+            if task_db and (site_ids is None or site_id in site_ids):
+                task_cursor = task_db.cursor(txn)
+                task_record = task_cursor.first()
+                while task_record is not None and task_record in self._claimed:
+                    task_record = task_cursor.next()
+                task_cursor.close()
+                host_ready = self._get_host_ready(site_id)
+                if task_record is not None and host_ready is not None:
+                    ready_times.append(int(max(site_priority, task_record[0],
+                                               host_ready)))
+            record = sites_cursor.next()
+        return ready_times
+
+    def _set_timer(self, deadline):
+        """Wake up the waiting crawlers at `deadline` at the latest.
+        """
+        if self._timer is None or deadline < self._timer_deadline:
+            self._cancel_timer()
+            self._timer = threading.Timer(max(0, deadline - time.time()),
+                                          self._timer_expired, (deadline,))
+            self._timer.setDaemon(True)
+            self._timer_deadline = deadline
+            self._timer.start()
+
+    def _cancel_timer(self):
+        """Cancel the timer set by `_set_timer()`, if any.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._timer_deadline = None
+
+    def _timer_expired(self, deadline):
+        """Wake up the crawlers when the timer expires.
+        """
+        self._mutex.acquire()
+        try:
+            # A cancelled timer may already be running.
+            if deadline == self._timer_deadline:
+                self._timer = None
+                self._timer_deadline = None
+            self._ready.notifyAll()
+        finally:
+            self._mutex.release()
+
+    def _notify(self):
+        """Wake up a crawler waiting for tasks.
+
+        Invoked when tasks are put in the queue or a site is released.  The
+        times computed for `get_wait()` are discarded.
+        """
+        self._next_ready.clear()
+        self._ready.notify()
+
+    def _put_visited(self, task, changed, modified=None, txn=None):
+        """Put a task for a visited directory.
+
+        Internal method used by `put_visited()` and `_skip_unchanged()`.
+        """
+        site_id = task.site_id
+        site_info = self._sites_info[site_id]
+        key = self._get_mtime_key(site_id, task.url)
+        if self._listed_db.get(key, txn=txn) is not None:
+            self._listed_db.delete(key, txn=txn)
+        # Remember the modification time of the directory for this visit.
+        # The reported value is consumed, only listings of the parent after
+        # this visit are compared with it.  If the parent was not listed
+        # since the last visit, the value is kept only if the directory did
+        # not change.
+        mtime = self._mtimes_db.get(key, txn=txn)
+        if mtime is not None:
+            self._mtimes_db.delete(key, txn=txn)
+            task.mtime = int(mtime)
+        elif changed:
+            task.mtime = None
+        if modified is not None and task.mtime is not None:
+            # Removing entries changes the modification time of the
+            # directory itself.
+            modified = max(modified, task.mtime)
+        task.report_visit(changed, modified)
+        if task.revisit_count == 0:
+            # First visit.  Set default values.
+            task.revisit_wait = site_info['default_revisit_wait']
+            logging.info('Setting revisit frequency for "%s" to %s'
+                         % (task.url, secs_to_readable(task.revisit_wait)))
+        elif (site_info.get('revisit_estimator') == 'last_modified'
+              and task.modified_visit_count > 0):
+            # The modification times are known, the estimate is updated
+            # after each visit.
+            minimum = site_info['min_revisit_wait']
+            maximum = site_info['max_revisit_wait']
+            estimated = self._estimate_revisit_wait_modified(task)
+            task.revisit_wait = min(maximum, max(minimum, estimated))
+            if task.modified_visit_count >= self._revisits:
+                task.decay_modified_counts()
+            logging.info('Changing revisit frequency for "%s" to %s'
+                         % (task.url, secs_to_readable(task.revisit_wait)))
+        else:
+            if task.revisit_count >= self._revisits:
+                minimum = site_info['min_revisit_wait']
+                maximum = site_info['max_revisit_wait']
+                estimated = self._estimate_revisit_wait(task)
+                task.revisit_wait = min(maximum, max(minimum, estimated))
+                task.reset_change_count()
+                logging.info('Changing revisit frequency for "%s" to %s'
+                             % (task.url, secs_to_readable(task.revisit_wait)))
+            else:
+                logging.info('Missing %s visits to "%s" before estimating change frequency.'
+                             % (self._revisits - task.revisit_count,task.url))
+        if (site_id, task.url.path) in self._watched:
+            # Changes are reported by the watcher.  The estimate is kept to
+            # be used if the directory is not watched anymore.
+            self._put(task, site_info['max_revisit_wait'], txn)
+        else:
+            self._put(task, task.revisit_wait, txn)
+
+    def _skip_unchanged(self, task_cursor, record, now, txn):
+        """Skip the executable tasks of unchanged directories.
+
+        Starting at the given record of the cursor, executable tasks of
+        previously visited directories whose modification time in the last
+        listing of the parent is the same as in the last visit are
+        rescheduled as visited without changes.  Tasks claimed by other
+        connections to the site are also skipped.  It returns the first record
+        not skipped.
+        """
+        while record is not None and record[0] <= now:
+            if record in self._claimed:
+                record = task_cursor.next()
+                continue
+            task = cPickle.loads(record[1])
+            if task.mtime is None or task.revisit_count < 0:
+                break
+            key = self._get_mtime_key(task.site_id, task.url)
+            mtime = self._mtimes_db.get(key, txn=txn)
+            if mtime is None or int(mtime) != task.mtime:
+                break
+            task_cursor.delete()
+            logging.info('Skipping unchanged directory "%s"' % task.url)
+            self._put_visited(task, False, task.modified, txn)
+            record = task_cursor.next()
+        return record
+
+    def _purge_site(self, db, site_id):
+        """Remove the directories of a removed site from a database.
+
+        Used for the databases whose keys are the site ID followed by the
+        path of a directory (modification times, watched and listed
+        directories).
+        """
+        txn = self._db_env.txn_begin()
+        cursor = db.cursor(txn)
+        record = cursor.set_range(site_id)
+        while record is not None and record[0].startswith(site_id):
+            cursor.delete()
+            record = cursor.next()
+        cursor.close()
+        txn.commit()
+
+    @staticmethod
+    def _get_mtime_key(site_id, url):
+        """Return the key of a directory in the modification times database.
+        """
+        return site_id + url.path.encode('utf-8')
+
+    def _delete(self, task, txn):
+        """Remove a task returned by `get()` from its database.
+        """
+        task_db = self._task_dbs[task.site_id]
+        task_cursor = task_db.cursor(txn)
+        try:
+            task_priority, pickled_task = self._claims[id(task)][0]
+        except KeyError:
+            task_cursor.first()
+        else:
+            if task_cursor.get_both(task_priority, pickled_task) is None:
+                task_cursor.first()
+        task_cursor.delete()
+        task_cursor.close()
+
+    def _release(self, task, seconds, txn=None, error=False):
+        """Release a task returned by `get()`.
+
+        The connection to the site used by the batch of the task is put back
+        in the sites database when the last of its claimed tasks is released.
+        It will be available after the greatest number of seconds given for
+        the tasks of the batch.  The connection to the host of the site is
+        also released.  If `error` is `True` the site could not be contacted,
+        the request wait of sites with the auto_request_wait option is
+        doubled once for the batch.
+        """
+        site_id = task.site_id
+        claim = self._claims.pop(id(task), None)
+        if claim is not None:
+            record, batch = claim
+            self._claimed.discard(record)
+            batch[0] -= 1
+            batch[1] = seconds = max(batch[1], seconds)
+            batch[2] = error = batch[2] or error
+            if batch[0] > 0:
+                return
+            self._release_host(site_id)
+        if error and self._sites_info[site_id].get('auto_request_wait'):
+            # The site may be overloaded.
+            self._set_request_wait(site_id, 2 * self._request_waits[site_id])
+        if txn is None:
+            self._sites_db.put(self._get_key(seconds), site_id)
+        else:
+            self._sites_db.put(self._get_key(seconds), site_id, txn)
+
+    def _set_connections(self):
+        """Set the number of connections to each site.
+
+        Each record of a site in the sites database is a connection that can
+        be used by a crawler to execute a batch of tasks, records are added
+        or removed to get the number given by the max_connections option of
+        the site.  The records are counted walking the database once.
+        """
+        txn = self._db_env.txn_begin()
+        sites_cursor = self._sites_db.cursor(txn)
+        connections = {}
+        record = sites_cursor.first()
+        while record is not None:
+            site_id = record[1]
+            info = self._sites_info.get(site_id)
+            if info is not None:
+                connections[site_id] = connections.get(site_id, 0) + 1
+                if connections[site_id] > info.get('max_connections', 1):
+                    sites_cursor.delete()
+            record = sites_cursor.next()
+        sites_cursor.close()
+        for site_id, info in self._sites_info.iteritems():
+            for i in xrange(connections.get(site_id, 0),
+                            info.get('max_connections', 1)):
+                self._sites_db.put(self._get_key(), site_id, txn)
+        txn.commit()
+
+    @staticmethod
+    def _get_host(site_info):
+        """Return the host used to group a site with the others.
+
+        It is the hostname of the URL of the site, or its IP address if the
+        site has the resolve_host option (the hostname is used if it can not
+        be resolved).  `None` is returned for local sites.
+        """
+        hostname = site_info['url'].hostname
+        if not hostname:
+            return None
+        if site_info.get('resolve_host'):
+            try:
+                return socket.gethostbyname(hostname)
+            except socket.error, error:
+                logging.warning('Could not resolve the host of "%s": %s'
+                                % (site_info['url'], error))
+        return hostname.lower()
+
+    def _add_host_limits(self, host, site_info):
+        """Add the host limits configured for a site to its host.
+
+        The most restrictive values of the sites on the host are used.  A
+        `host_max_connections` of 0 means no limit.
+        """
+        max_connections = site_info.get('host_max_connections', 0)
+        request_wait = site_info.get('host_request_wait', 0)
+        if max_connections > 0 or request_wait > 0:
+            host_info = self._hosts.setdefault(host, {
+                'max_connections': 0,
+                'request_wait': 0,
+                'connections': 0,
+                'ready': self._get_key(),
+            })
+            if max_connections > 0:
+                host_info['max_connections'] = min(
+                    host_info['max_connections'] or max_connections,
+                    max_connections)
+            host_info['request_wait'] = max(host_info['request_wait'],
+                                            request_wait)
+
+    def _get_host_ready(self, site_id):
+        """Return when the host of a site can be contacted again.
+
+        It returns a key that can be compared with the keys of the databases
+        (an empty string if the host has no limits), or `None` if all the
+        connections to the host are in use.
+        """
+        host = self._site_hosts.get(site_id)
+        if host is None:
+            return ''
+        host_info = self._hosts[host]
+        if 0 < host_info['max_connections'] <= host_info['connections']:
+            return None
+        return host_info['ready']
+
+    def _claim_host(self, site_id):
+        """Claim a connection to the host of a site for a batch of tasks.
+
+        The host can not be contacted by a batch of other site on the host
+        before its request wait.
+        """
+        host = self._site_hosts.get(site_id)
+        if host is not None:
+            host_info = self._hosts[host]
+            host_info['connections'] += 1
+            host_info['ready'] = self._get_key(host_info['request_wait'])
+
+    def _release_host(self, site_id):
+        """Release a connection to the host of a site.
+
+        The host can be contacted again after its request wait.
+        """
+        host = self._site_hosts.get(site_id)
+        if host is not None:
+            host_info = self._hosts[host]
+            host_info['connections'] -= 1
+            host_info['ready'] = self._get_key(host_info['request_wait'])
+            # Crawlers of the other sites on the host may be waiting for it.
+            self._next_ready.clear()
+            self._ready.notifyAll()
+
     def _put(self, task, seconds=0, txn=None):
         """Put a task in the queue.
 
@@ -405,10 +1213,21 @@ class TaskQueue(object):
         """
         site_id = task.site_id
         task_db = self._task_dbs[site_id]
+        if self._sites_info[site_id].get('watch'):
+            changed = (site_id, task.url.path)
+            if changed in self._changed:
+                # Changed while the task was not in the queue.
+                self._changed.remove(changed)
+                seconds = 0
+            task_key = self._get_key(seconds)
+            self._watched_db.put(self._get_mtime_key(site_id, task.url),
+                                 task_key, txn=txn)
+        else:
+            task_key = self._get_key(seconds)
         if txn is None:
-            task_db.put(self._get_key(seconds), cPickle.dumps(task, 2))
+            task_db.put(task_key, cPickle.dumps(task, 2))
         else:
-            task_db.put(self._get_key(seconds), cPickle.dumps(task, 2), txn)
+            task_db.put(task_key, cPickle.dumps(task, 2), txn)
 
     def _get_key(self, seconds=0):
         """Return a key for a site or task.
@@ -436,3 +1255,26 @@ class TaskQueue(object):
         else:
             new_wait = wait * visits
         return int(round(new_wait))
+
+    @staticmethod
+    def _estimate_revisit_wait_modified(task):
+        """Return an estimate revisit wait for the task using the last
+        modification times.
+        """
+        # This is the estimator for the case when the last modification date
+        # is known, proposed in the same paper.  It converges faster than the
+        # estimator that only sees if the directory changed.
+        changes = float(task.modified_count)
+        visits = float(task.modified_visit_count)
+        unmodified = float(max(1, task.unmodified_time))
+        if changes == 0:
+            # No change seen, the directory is at least this stable.
+            return int(round(unmodified))
+        if changes < visits:
+            rate = (changes - 1 - changes / (visits * math.log(1 - changes / visits))) / unmodified
+        else:
+            rate = 0
+        if rate <= 0:
+            # Too few visits for the bias correction.
+            rate = changes / unmodified
+        return int(round(1 / rate))
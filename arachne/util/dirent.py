@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Directory scanning without stat calls.
+
+On Linux the type of each entry is read from the directory stream (the
+`d_type` field of `struct dirent`), so the type of most entries is known
+without a `stat` call.  On other platforms, or if the C library can not be
+loaded, the type of all the entries is unknown.
+"""
+
+import os
+import sys
+import ctypes
+import ctypes.util
+
+
+# Types of the entries returned by `scandir()`.
+DIR, FILE, LINK, UNKNOWN = 'dir', 'file', 'link', None
+
+_DT_UNKNOWN, _DT_DIR, _DT_REG, _DT_LNK = 0, 4, 8, 10
+
+_TYPES = {_DT_DIR: DIR, _DT_REG: FILE, _DT_LNK: LINK}
+
+
+class _Dirent64(ctypes.Structure):
+    """The `struct dirent64` of the GNU C library.
+    """
+
+    _fields_ = [
+        ('d_ino', ctypes.c_uint64),
+        ('d_off', ctypes.c_int64),
+        ('d_reclen', ctypes.c_ushort),
+        ('d_type', ctypes.c_ubyte),
+        ('d_name', ctypes.c_char * 256),
+    ]
+
+
+def _load_libc():
+    """Return the C library with the needed functions, or `None`.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.opendir.argtypes = [ctypes.c_char_p]
+        libc.opendir.restype = ctypes.c_void_p
+        libc.readdir64.argtypes = [ctypes.c_void_p]
+        libc.readdir64.restype = ctypes.POINTER(_Dirent64)
+        libc.closedir.argtypes = [ctypes.c_void_p]
+        libc.closedir.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+def scandir(path):
+    """Return the entries of the directory at `path`.
+
+    It returns a list of tuples with the name of the entry and its type:
+    `DIR`, `FILE` (any other type of file), `LINK` (a symbolic link, the
+    type of the target is not known) or `UNKNOWN`.  The entries "." and ".."
+    are not included.  The names are unicode objects if `path` is an unicode
+    object, as returned by `os.listdir()`.  `OSError` is raised if the
+    directory can not be read.
+    """
+    if _libc is None:
+        return [(name, UNKNOWN) for name in os.listdir(path)]
+    if isinstance(path, unicode):
+        encoding = sys.getfilesystemencoding() or 'utf-8'
+        encoded_path = path.encode(encoding)
+    else:
+        encoding = None
+        encoded_path = path
+    dirp = _libc.opendir(encoded_path)
+    if not dirp:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+    try:
+        entries = []
+        while True:
+            ctypes.set_errno(0)
+            entry = _libc.readdir64(dirp)
+            if not entry:
+                error = ctypes.get_errno()
+                if error != 0:
+                    raise OSError(error, os.strerror(error), path)
+                break
+            name = entry.contents.d_name
+            if name in ('.', '..'):
+                continue
+            if encoding is not None:
+                try:
+                    name = name.decode(encoding)
+                except UnicodeDecodeError:
+                    # Keep the byte string, as os.listdir() does.
+                    pass
+            d_type = entry.contents.d_type
+            if d_type == _DT_UNKNOWN:
+                # Not supported by the file system.
+                entries.append((name, UNKNOWN))
+            else:
+                entries.append((name, _TYPES.get(d_type, FILE)))
+        return entries
+    finally:
+        _libc.closedir(dirp)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Minimal interface to the Linux inotify API.
+
+The system calls are invoked through ctypes.  `InotifyError` is raised when
+inotify is not available.
+"""
+
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+
+# Events (see inotify(7)).
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0x80000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyError(OSError):
+    """Error using the inotify API.
+    """
+
+
+def _load_libc():
+    """Return the C library with the inotify functions, or `None`.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+class Inotify(object):
+    """Inotify instance.
+
+    The events are read with `read()` when the file descriptor returned by
+    `fileno()` is readable (e.g. using `select()`).
+    """
+
+    def __init__(self):
+        """Create the inotify instance.
+        """
+        if _libc is None:
+            raise InotifyError(errno.ENOSYS, 'inotify is not available')
+        self._fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            self._raise_error()
+
+    def fileno(self):
+        """Return the file descriptor of the instance.
+        """
+        return self._fd
+
+    def add_watch(self, path, mask):
+        """Watch the file at `path` for the events in `mask`.
+
+        It returns the watch descriptor.  `InotifyError` is raised if the
+        watch could not be added, with `errno.ENOSPC` if the limit of watches
+        was reached.
+        """
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        wd = _libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            self._raise_error(path)
+        return wd
+
+    def rm_watch(self, wd):
+        """Remove a watch.
+        """
+        if _libc.inotify_rm_watch(self._fd, wd) < 0:
+            self._raise_error()
+
+    def read(self):
+        """Return the list of available events.
+
+        The events are tuples with the watch descriptor, the mask, the cookie
+        and the name of the file inside the watched directory (an empty string
+        for events of the watched file itself).  It returns an empty list if
+        there are no events.
+        """
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError, error:
+            if error.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        """Close the instance, removing all the watches.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    @staticmethod
+    def _raise_error(path=None):
+        error = ctypes.get_errno()
+        if path is None:
+            raise InotifyError(error, os.strerror(error))
+        raise InotifyError(error, os.strerror(error), path)
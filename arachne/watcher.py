@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Arachne: Search engine for files shared via FTP and similar protocols.
+# Copyright (C) 2008-2010 Yasser González Fernández <ygonzalezfernandez@gmail.com>
+# Copyright (C) 2008-2010 Ariel Hernández Amador <gnuaha7@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Watcher of the directories of local sites.
+"""
+
+import os
+import errno
+import select
+import logging
+import threading
+
+from arachne.util import dirent
+from arachne.util import inotify
+
+
+class DirectoryWatcher(threading.Thread):
+    """Directory watcher.
+
+    Watches with inotify the directories of the local sites (file:// URLs)
+    with the `watch` option and reports the directories that change to the
+    `TaskQueue`, so they are visited only when they change.  Directories that
+    can not be watched (e.g. when the limit of inotify watches is reached)
+    are polled as usual.  It runs in an independent thread of execution.
+    """
+
+    # Events of the watched directories that change the entries of the
+    # directory.
+    _MASK = (inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM
+             | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR)
+
+    def __init__(self, sites_info, tasks):
+        """Initialize the watcher.
+
+        `InotifyError` is raised if inotify is not available.
+        """
+        threading.Thread.__init__(self)
+        self._sleep = 1
+        self._sites_info = sites_info
+        self._tasks = tasks
+        self._inotify = inotify.Inotify()
+        # Map the watch descriptors to the site ID and URL of the directories
+        # and the paths of the watched directories to the watch descriptors.
+        self._watches = {}
+        self._paths = {}
+        # Sites where the limit of watches was reached.
+        self._exhausted = set()
+        # Flag used to stop the loop started by the run() method.
+        self._running = False
+
+    def run(self):
+        """Run the main loop.
+        """
+        try:
+            self._running = True
+            for site_id, site_info in self._sites_info.iteritems():
+                url = site_info['url']
+                if site_info.get('watch') and url.scheme == 'file':
+                    self._watch_tree(site_id, url)
+            while self._running:
+                readable = select.select([self._inotify], [], [],
+                                         self._sleep)[0]
+                if readable:
+                    self._process(self._inotify.read())
+            self._inotify.close()
+        except:
+            logging.exception('Unhandled exception, printing traceback')
+
+    def stop(self):
+        """Order the main loop to end.
+        """
+        self._running = False
+
+    def _process(self, events):
+        """Process the events read from inotify.
+
+        Each changed directory is reported once.
+        """
+        changed = []
+        for wd, mask, cookie, name in events:
+            if mask & inotify.IN_Q_OVERFLOW:
+                # Events were lost.  All the watched directories could have
+                # changed.
+                logging.error('Lost inotify events, revisiting all the '
+                              'watched directories')
+                changed.extend(self._watches.itervalues())
+                continue
+            try:
+                site_id, url = self._watches[wd]
+            except KeyError:
+                continue
+            if mask & inotify.IN_IGNORED:
+                # The directory was removed or unmounted.
+                self._unwatch(wd)
+                continue
+            if mask & inotify.IN_ISDIR:
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self._watch_tree(site_id, url.join(name))
+                elif mask & inotify.IN_MOVED_FROM:
+                    self._unwatch_tree(url.join(name))
+            changed.append((site_id, url))
+        reported = set()
+        for site_id, url in changed:
+            if url.path not in reported:
+                reported.add(url.path)
+                self._tasks.report_changed(site_id, url)
+
+    def _watch_tree(self, site_id, url):
+        """Watch a directory and its subdirectories.
+
+        Symbolic links to directories are not followed, they are polled.
+        """
+        site_info = self._sites_info[site_id]
+        max_depth = site_info['max_depth']
+        pending = [url]
+        while pending and site_id not in self._exhausted:
+            url = pending.pop()
+            if url.path in self._paths:
+                continue
+            try:
+                wd = self._inotify.add_watch(url.path, self._MASK)
+            except inotify.InotifyError, error:
+                if error.errno == errno.ENOSPC:
+                    self._exhausted.add(site_id)
+                    logging.error('Limit of inotify watches reached, polling '
+                                  'the remaining directories of "%s"'
+                                  % site_info['url'])
+                continue
+            self._watches[wd] = (site_id, url)
+            self._paths[url.path] = wd
+            self._tasks.report_watched(site_id, url)
+            if url.path.count(u'/') >= max_depth:
+                continue
+            try:
+                entries = dirent.scandir(url.path)
+            except OSError:
+                continue
+            for name, entry_type in entries:
+                if entry_type == dirent.DIR:
+                    pending.append(url.join(name))
+                elif entry_type == dirent.UNKNOWN:
+                    suburl = url.join(name)
+                    if (os.path.isdir(suburl.path)
+                            and not os.path.islink(suburl.path)):
+                        pending.append(suburl)
+
+    def _unwatch_tree(self, url):
+        """Stop watching a directory and its subdirectories.
+        """
+        prefix = url.path + u'/'
+        for path in self._paths.keys():
+            if path == url.path or path.startswith(prefix):
+                wd = self._paths[path]
+                try:
+                    self._inotify.rm_watch(wd)
+                except inotify.InotifyError:
+                    pass
+                self._unwatch(wd)
+
+    def _unwatch(self, wd):
+        """Forget a watch removed from inotify.
+        """
+        try:
+            site_id, url = self._watches.pop(wd)
+        except KeyError:
+            return
+        self._paths.pop(url.path, None)
+        self._tasks.report_watched(site_id, url, False)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import zlib
+import gzip
+import optparse
+import unittest
+import mimetools
+import cStringIO
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.error import ListingError
+from arachne.handler import ApacheHandler
+from arachne.task import CrawlTask
+from arachne.url import URL
+
+
+class FakeResponse(object):
+
+    def __init__(self, data, encoding=None):
+        self._data = cStringIO.StringIO(data)
+        headers = 'Content-Encoding: %s\r\n' % encoding if encoding else ''
+        self._headers = mimetools.Message(cStringIO.StringIO(headers + '\r\n'))
+
+    def info(self):
+        return self._headers
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+class TestApacheHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._url = URL('http://media.matcomm.uh.cu/')
+        self._sites_info = {self._site_id: {'url': self._url}}
+        self._handler = ApacheHandler(self._sites_info, None, None)
+        self._task = CrawlTask(self._site_id, self._url)
+        self._page = ''.join('<img src="/icons/folder.gif" alt="[DIR]"> '
+                             '<a href="%d/">%d/</a> 18-Jun-2008 20:57 -\n'
+                             % (i, i) for i in xrange(10000))
+
+    def _read_page(self, data, encoding=None, max_size=None):
+        if max_size is None:
+            max_size = len(self._page)
+        response = FakeResponse(data, encoding)
+        return ''.join(self._handler._read_page(self._task, response,
+                                                max_size))
+
+    def test_read_page(self):
+        self.assertEquals(self._read_page(self._page), self._page)
+
+    def test_read_page_gzip(self):
+        data = cStringIO.StringIO()
+        gzip_file = gzip.GzipFile(fileobj=data, mode='wb')
+        gzip_file.write(self._page)
+        gzip_file.close()
+        self.assertEquals(self._read_page(data.getvalue(), 'gzip'),
+                          self._page)
+
+    def test_read_page_deflate(self):
+        data = zlib.compress(self._page)
+        self.assertEquals(self._read_page(data, 'deflate'), self._page)
+        # Raw deflate data sent by some servers.
+        self.assertEquals(self._read_page(data[2:-4], 'deflate'), self._page)
+
+    def test_read_page_max_size(self):
+        self.assertRaises(ListingError, self._read_page, self._page,
+                          max_size=len(self._page) - 1)
+        data = zlib.compress(self._page)
+        self.assertRaises(ListingError, self._read_page, data, 'deflate',
+                          len(self._page) - 1)
+
+    def test_parse_page(self):
+        # Chunks splitting the lines at different positions.
+        for size in (7, 100, len(self._page)):
+            chunks = [self._page[i:i + size]
+                      for i in xrange(0, len(self._page), size)]
+            result = self._handler._parse_page(self._task, chunks)
+            self.assertEquals(len(result), 10000)
+            data = result['9999']
+            self.assertTrue(data['is_dir'])
+            self.assertEquals(data['mtime'], 1213822620)
+
+    def test_transferred(self):
+        ApacheHandler._transferred.clear()
+        data = zlib.compress(self._page)
+        self._read_page(data, 'deflate')
+        self.assertEquals(ApacheHandler._transferred[self._site_id][:2],
+                          [len(data), len(self._page)])
+        # The totals were logged with the first page.
+        self.assertTrue(ApacheHandler._transferred[self._site_id][2] > 0)
+
+    def tearDown(self):
+        ApacheHandler._transferred.clear()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
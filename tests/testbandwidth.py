@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import optparse
+import multiprocessing
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.bandwidth import TokenBucket, BandwidthLimiter
+from arachne.url import URL
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self._rate = 1000
+        self._bucket = TokenBucket(self._rate)
+
+    def test_consume(self):
+        # The bucket starts full.
+        self.assertEquals(self._bucket.consume(self._rate), (0, 0))
+        delay, added = self._bucket.consume(self._rate / 2)
+        self.assertTrue(0.4 < delay <= 0.5)
+        self.assertTrue(0.4 < added <= 0.5)
+        time.sleep(delay)
+        self.assertTrue(self._bucket.consume(self._rate / 10)[0] <= 0.1)
+
+    def test_consume_debt(self):
+        self._bucket.consume(2 * self._rate)
+        # Only the tokens of the last call are added to the wait.
+        delay, added = self._bucket.consume(self._rate / 2)
+        self.assertTrue(1.4 < delay <= 1.5)
+        self.assertEquals(added, 0.5)
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self._limited_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._other_id = 'a78e6853355ad5cdc751ad678d15339382f9ed21'
+        self._sites_info = {
+            self._limited_id: {'url': URL('ftp://deltha.uh.cu/'),
+                               'max_rate': 1000},
+            self._other_id: {'url': URL('ftp://atlantis.uh.cu/'),
+                             'max_rate': 0},
+        }
+
+    def test_site_limit(self):
+        bandwidth = BandwidthLimiter(self._sites_info)
+        self.assertEquals(bandwidth.reserve(self._limited_id, 1000), 0)
+        self.assertTrue(bandwidth.reserve(self._limited_id, 500) > 0.4)
+        # Other sites are not limited.
+        self.assertEquals(bandwidth.reserve(self._other_id, 100000), 0)
+        self.assertTrue(bandwidth.get_throttled(self._limited_id) > 0.4)
+        self.assertEquals(bandwidth.get_throttled(self._other_id), 0)
+
+    def test_global_limit(self):
+        bandwidth = BandwidthLimiter(self._sites_info, 2000)
+        self.assertEquals(bandwidth.reserve(self._other_id, 2000), 0)
+        # The limit of the site and the global limit are both applied.
+        self.assertTrue(bandwidth.reserve(self._limited_id, 1000) > 0.4)
+        self.assertTrue(bandwidth.reserve(self._other_id, 1000) > 0.9)
+
+    def test_throttled_time(self):
+        bandwidth = BandwidthLimiter(self._sites_info)
+        bandwidth.reserve(self._limited_id, 1500)
+        self.assertTrue(bandwidth.reserve(self._limited_id, 500) > 0.9)
+        # The debt of previous transfers is not counted again.
+        self.assertTrue(0.9 < bandwidth.get_throttled(self._limited_id) <= 1)
+
+    def test_throttle(self):
+        bandwidth = BandwidthLimiter(self._sites_info)
+        start = time.time()
+        delay = bandwidth.throttle(self._limited_id, 1500)
+        self.assertTrue(0.4 < delay <= 0.5)
+        self.assertTrue(time.time() - start >= delay)
+
+    def test_shared(self):
+        bandwidth = BandwidthLimiter(self._sites_info)
+        # The tokens taken by a forked process are shared.
+        process = multiprocessing.Process(target=bandwidth.reserve,
+                                          args=(self._limited_id, 1500))
+        process.start()
+        process.join()
+        self.assertTrue(bandwidth.reserve(self._limited_id, 500) > 0.9)
+        self.assertTrue(0.9 < bandwidth.get_throttled(self._limited_id) <= 1)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import optparse
+import unittest
+import threading
+import BaseHTTPServer
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.pool import ConnectionPool, HTTPConnectionPool
+from arachne.pool import build_http_opener
+
+
+class FakeConnection(object):
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnectionPool(ConnectionPool):
+
+    def _is_alive(self, conn):
+        return conn.alive
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self._key = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._size = 2
+        self._pool = FakeConnectionPool(self._size)
+
+    def test_get_empty(self):
+        self.assertEquals(self._pool.get(self._key, 60), None)
+
+    def test_reuse(self):
+        conn = FakeConnection()
+        self._pool.put(self._key, conn)
+        self.assertTrue(self._pool.get(self._key, 60) is conn)
+        self.assertEquals(self._pool.get(self._key, 60), None)
+        self.assertFalse(conn.closed)
+
+    def test_keys(self):
+        self._pool.put(self._key, FakeConnection())
+        self.assertEquals(self._pool.get(self._key[::-1], 60), None)
+
+    def test_idle_timeout(self):
+        conn = FakeConnection()
+        self._pool.put(self._key, conn)
+        time.sleep(1.5)
+        self.assertEquals(self._pool.get(self._key, 1), None)
+        self.assertTrue(conn.closed)
+
+    def test_dead_connection(self):
+        alive, dead = FakeConnection(), FakeConnection(False)
+        self._pool.put(self._key, alive)
+        self._pool.put(self._key, dead)
+        self.assertTrue(self._pool.get(self._key, 60) is alive)
+        self.assertTrue(dead.closed)
+
+    def test_size(self):
+        conns = [FakeConnection() for i in xrange(self._size + 1)]
+        for conn in conns:
+            self._pool.put(self._key, conn)
+        self.assertTrue(conns[0].closed)
+        for conn in conns[1:]:
+            self.assertFalse(conn.closed)
+
+    def test_close(self):
+        conn = FakeConnection()
+        self._pool.put(self._key, conn)
+        self._pool.close()
+        self.assertTrue(conn.closed)
+        self.assertEquals(self._pool.get(self._key, 60), None)
+
+
+class KeepAliveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Close the connection without notifying the client.
+        self.close_connection = self.server.drop_connections
+
+    def log_message(self, *args):
+        pass
+
+
+class TestKeepAliveHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                 KeepAliveRequestHandler)
+        self._server.connections = 0
+        self._server.drop_connections = False
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self._url = 'http://127.0.0.1:%d' % self._server.server_port
+        self._pool = HTTPConnectionPool(2)
+
+    def _open(self, path):
+        opener = build_http_opener(self._pool, 'site', 60)
+        response = opener.open(self._url + path)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def test_reuse(self):
+        self.assertEquals(self._open('/a'), '/a')
+        self.assertEquals(self._open('/b'), '/b')
+        self.assertEquals(self._server.connections, 1)
+
+    def test_stale_connection(self):
+        self._server.drop_connections = True
+        self.assertEquals(self._open('/a'), '/a')
+        time.sleep(0.5)
+        self.assertEquals(self._open('/b'), '/b')
+        self.assertEquals(self._server.connections, 2)
+
+    def tearDown(self):
+        self._pool.close()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import ftplib
+import shutil
+import tempfile
+import struct
+import zipfile
+import StringIO
+import optparse
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.error import ContentError
+from arachne.content import RangeReader, FTPRangeReader
+from arachne.content import ID3Extractor, ZipExtractor
+from arachne.content import get_extractor, ContentManager
+from arachne.url import URL
+
+
+class StringRangeReader(RangeReader):
+
+    def __init__(self, data, budget=None):
+        RangeReader.__init__(self, budget=budget)
+        self._data = data
+        self.requests = []
+
+    def _read(self, offset, length):
+        self.requests.append((offset, length))
+        return self._data[offset:offset + length]
+
+    def _request_size(self):
+        return len(self._data)
+
+
+class FakeFTP(object):
+    """FTP session replying to the commands used by `FTPRangeReader`.
+    """
+
+    def __init__(self, data, abort_replies):
+        self._data = data
+        self._abort_replies = abort_replies
+        self.replies = []
+
+    def voidcmd(self, command):
+        return '200 OK'
+
+    def transfercmd(self, command, rest=None):
+        return FakeDataConnection(self._data[rest or 0:])
+
+    def voidresp(self):
+        reply = self.replies.pop(0)
+        if not reply.startswith('2'):
+            raise ftplib.error_temp(reply)
+        return reply
+
+    def abort(self):
+        self.replies = list(self._abort_replies)
+        reply = self.replies.pop(0)
+        if reply[:3] not in ('426', '225', '226'):
+            raise ftplib.error_proto(reply)
+        return reply
+
+    def putcmd(self, line):
+        self.replies.append(line == 'NOOP' and '200 OK' or '502 Unknown')
+
+    def getmultiline(self):
+        return self.replies.pop(0)
+
+
+class FakeDataConnection(object):
+
+    def __init__(self, data):
+        self._data = data
+
+    def recv(self, size):
+        data, self._data = self._data[:size], self._data[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class TestFTPRangeReader(unittest.TestCase):
+
+    def test_abort(self):
+        for replies in (['426 Aborted', '226 Abort successful'],
+                        ['226 Transfer complete', '225 No transfer'],
+                        ['451 Error', '226 Abort successful']):
+            ftp = FakeFTP('x' * 100000, replies)
+            reader = FTPRangeReader(ftp, '/file', 100000)
+            self.assertEquals(reader.read(10, 100), 'x' * 100)
+            # All the replies were read.
+            self.assertEquals(ftp.replies, [])
+
+    def test_end_of_file(self):
+        ftp = FakeFTP('x' * 100, [])
+        ftp.replies = ['226 Transfer complete']
+        reader = FTPRangeReader(ftp, '/file', 100)
+        self.assertEquals(reader.read(90, 100), 'x' * 10)
+        self.assertEquals(ftp.replies, [])
+
+    def test_throttle(self):
+        blocks = []
+        ftp = FakeFTP('x' * 100000, ['226 Transfer complete'])
+        reader = FTPRangeReader(ftp, '/file', 100000, None, blocks.append)
+        self.assertEquals(len(reader.read(0, 20000)), 20000)
+        # Each block is throttled as it is received.
+        self.assertEquals(blocks, [8192, 8192, 3616])
+
+
+def syncsafe(value):
+    return ''.join(chr((value >> shift) & 0x7f) for shift in (21, 14, 7, 0))
+
+
+def id3v2(version, frames, padding=0):
+    data = ''
+    for frame_id, text in frames:
+        body = '\x03' + text.encode('utf-8')
+        if version == 2:
+            data += frame_id + struct.pack('>I', len(body))[1:] + body
+        elif version == 3:
+            data += frame_id + struct.pack('>I', len(body)) + '\x00\x00' + body
+        else:
+            data += frame_id + syncsafe(len(body)) + '\x00\x00' + body
+    data += '\x00' * padding
+    return 'ID3' + chr(version) + '\x00\x00' + syncsafe(len(data)) + data
+
+
+def id3v1(title, artist, album):
+    return 'TAG' + ''.join(value.encode('latin-1').ljust(30, '\x00')
+                           for value in (title, artist, album)) + '\x00' * 35
+
+
+class TestID3Extractor(unittest.TestCase):
+
+    def setUp(self):
+        self._extractor = ID3Extractor()
+        self._audio = '\xff\xfb' * 50000
+
+    def test_id3v2(self):
+        frames = {
+            2: [('TT2', u'Yesterday'), ('TP1', u'The Beatles'),
+                ('TAL', u'Help!')],
+            3: [('TIT2', u'Yesterday'), ('TPE1', u'The Beatles'),
+                ('TALB', u'Help!')],
+            4: [('TIT2', u'Yesterday'), ('TPE1', u'The Beatles'),
+                ('TALB', u'Help!')],
+        }
+        for version in (2, 3, 4):
+            data = id3v2(version, frames[version], 1024) + self._audio
+            reader = StringRangeReader(data)
+            self.assertEquals(self._extractor.extract(reader),
+                              u'The Beatles Help! Yesterday')
+            # Only the head of the file is read.
+            self.assertEquals(len(reader.requests), 1)
+            self.assertEquals(reader.requests[0][0], 0)
+
+    def test_id3v1(self):
+        data = self._audio + id3v1(u'Yesterday', u'The Beatles', u'Help!')
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader),
+                          u'The Beatles Help! Yesterday')
+        self.assertEquals(reader.requests[-1], (len(data) - 128, 128))
+        self.assertTrue(sum(length for offset, length in reader.requests)
+                        < len(data) / 10)
+
+    def test_id3v1_fallback(self):
+        data = (id3v2(3, [('TIT2', u'Ñandú')]) + self._audio +
+                id3v1(u'', u'Ana Belén', u''))
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader), u'Ana Belén Ñandú')
+
+    def test_large_tag(self):
+        # The text frames precede a picture larger than the first read.
+        frames = [('TIT2', u'Yesterday'), ('APIC', 'x' * 100000)]
+        data = id3v2(3, frames) + self._audio
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader), u'Yesterday')
+        self.assertTrue(sum(length for offset, length in reader.requests)
+                        < 100000)
+
+    def test_no_tags(self):
+        reader = StringRangeReader(self._audio)
+        self.assertEquals(self._extractor.extract(reader), u'')
+
+
+class TestZipExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self._extractor = ZipExtractor()
+        self._names = [u'The Beatles/Help!/13. Yesterday.mp3',
+                       u'The Beatles/Help!/front.png',
+                       u'Ana Belén/Ñandú.txt']
+
+    def _create_zip(self, names, comment=''):
+        buffer = StringIO.StringIO()
+        archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED)
+        for name in names:
+            archive.writestr(zipfile.ZipInfo(name), os.urandom(50000))
+        archive.comment = comment
+        archive.close()
+        return buffer.getvalue()
+
+    def test_names(self):
+        data = self._create_zip(self._names)
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader).split(u'\n'),
+                          self._names)
+        # Only the tail of the archive is read.
+        self.assertEquals(len(reader.requests), 1)
+
+    def test_large_central_directory(self):
+        names = [u'%04d.txt' % i for i in xrange(500)]
+        data = self._create_zip(names)
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader).split(u'\n'), names)
+        self.assertEquals(len(reader.requests), 2)
+
+    def test_comment(self):
+        data = self._create_zip(self._names, 'x' * 20000)
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader).split(u'\n'),
+                          self._names)
+
+    def test_prepended_data(self):
+        data = os.urandom(1000) + self._create_zip(self._names)
+        reader = StringRangeReader(data)
+        self.assertEquals(self._extractor.extract(reader).split(u'\n'),
+                          self._names)
+
+    def test_budget(self):
+        names = [u'%04d.txt' % i for i in xrange(500)]
+        data = self._create_zip(names)
+        reader = StringRangeReader(data, 10000)
+        extracted = self._extractor.extract(reader).split(u'\n')
+        self.assertTrue(0 < len(extracted) < len(names))
+        self.assertEquals(extracted, names[:len(extracted)])
+        self.assertTrue(sum(length for offset, length in reader.requests)
+                        <= 10000)
+        reader = StringRangeReader(data, 1000)
+        self.assertRaises(ContentError, self._extractor.extract, reader)
+
+    def test_invalid(self):
+        reader = StringRangeReader(os.urandom(100000).replace('PK', 'XX'))
+        self.assertRaises(ContentError, self._extractor.extract, reader)
+
+
+class TestGetExtractor(unittest.TestCase):
+
+    def test_get_extractor(self):
+        self.assertTrue(isinstance(get_extractor(u'Yesterday.MP3'),
+                                   ID3Extractor))
+        self.assertTrue(isinstance(get_extractor(u'Help!.zip'), ZipExtractor))
+        self.assertEquals(get_extractor(u'front.png'), None)
+
+
+class TestContentManager(unittest.TestCase):
+
+    def setUp(self):
+        self._db_home = tempfile.mkdtemp()
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._sites_info = {
+            self._site_id: {
+                'url': URL('http://127.0.0.1:1/', True),
+                'content_budget': 262144,
+            },
+        }
+        self._urls = [URL('http://127.0.0.1:1/%d.mp3' % i) for i in xrange(3)]
+        self._max_entries = 2
+        self._contents = ContentManager(self._sites_info, 1, self._db_home,
+                                        self._max_entries)
+
+    def _get_contents(self, urls, size=1024, mtime=1234567890):
+        files = [(url, str(url), size, mtime) for url in urls]
+        return self._contents.get_contents(self._site_id, files, 0)
+
+    def _store(self, url, size=1024, mtime=1234567890):
+        self._contents._store(str(url), size, mtime,
+                              (url.basename, None))
+
+    def test_cached(self):
+        self._store(self._urls[0])
+        self.assertEquals(self._get_contents(self._urls[:1]),
+                          [self._urls[0].basename])
+
+    def test_changed(self):
+        self._store(self._urls[0])
+        self.assertEquals(self._get_contents(self._urls[:1], size=2048),
+                          [None])
+        self.assertEquals(self._get_contents(self._urls[:1], mtime=0), [None])
+
+    def test_unknown_size_and_mtime(self):
+        self._store(self._urls[0], None, None)
+        self.assertEquals(self._get_contents(self._urls[:1], None, None),
+                          [None])
+
+    def test_errors_not_cached(self):
+        contents = self._contents.get_contents(
+            self._site_id, [(self._urls[0], str(self._urls[0]), 1024, 0)], 10)
+        self.assertEquals(contents, [None])
+        self.assertEquals(self._get_contents(self._urls[:1], mtime=0), [None])
+
+    def test_eviction(self):
+        self._store(self._urls[0])
+        self._store(self._urls[1])
+        # The first file becomes the most recently used.
+        self._get_contents(self._urls[:1])
+        self._store(self._urls[2])
+        contents = [url.basename for url in self._urls]
+        self.assertEquals(self._get_contents(self._urls),
+                          [contents[0], None, contents[2]])
+
+    def test_persistence(self):
+        self._store(self._urls[0])
+        self._contents.close()
+        self._contents = ContentManager(self._sites_info, 1, self._db_home,
+                                        self._max_entries)
+        self.assertEquals(self._get_contents(self._urls[:1]),
+                          [self._urls[0].basename])
+
+    def tearDown(self):
+        self._contents.close()
+        shutil.rmtree(self._db_home)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
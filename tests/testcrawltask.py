@@ -2,6 +2,7 @@
 
 import os
 import sys
+import time
 import pickle
 import optparse
 import unittest
@@ -27,14 +28,35 @@ class TestCrawlTask(unittest.TestCase):
         self.assertEquals(self._task.revisit_wait, 0)
         self.assertEquals(self._task.revisit_count, -1)
         self.assertEquals(self._task.change_count, 0)
+        self.assertEquals(self._task.probes, {})
+        self.assertEquals(self._task.mtime, None)
+        self.assertEquals(self._task.validators, {})
+        self.assertEquals(self._task.modified, None)
+        self.assertEquals(self._task.modified_count, 0)
+        self.assertEquals(self._task.modified_visit_count, 0)
+        self.assertEquals(self._task.unmodified_time, 0)
 
     def test_pickling(self):
+        self._task.probes = {'bin': ('lrwxrwxrwx 1 0 0 7 Jan 25 bin -> usr/bin',
+                                     True)}
+        self._task.mtime = 1234567890
+        self._task.validators = {'If-None-Match': '"2f-4a1b"'}
+        self._task.report_visit(True, 1234567890)
+        self._task.report_visit(True, 1234567891)
         task = pickle.loads(pickle.dumps(self._task))
         self.assertEquals(self._task.site_id, task.site_id)
         self.assertEquals(str(self._task.url), str(task.url))
         self.assertEquals(self._task.revisit_wait, task.revisit_wait)
         self.assertEquals(self._task.revisit_count, task.revisit_count)
         self.assertEquals(self._task.change_count, task.change_count)
+        self.assertEquals(self._task.probes, task.probes)
+        self.assertEquals(self._task.mtime, task.mtime)
+        self.assertEquals(self._task.validators, task.validators)
+        self.assertEquals(self._task.modified, task.modified)
+        self.assertEquals(self._task.modified_count, task.modified_count)
+        self.assertEquals(self._task.modified_visit_count,
+                          task.modified_visit_count)
+        self.assertEquals(self._task.unmodified_time, task.unmodified_time)
 
     def test_revisit_wait(self):
         self._task.report_visit(True)
@@ -64,6 +86,43 @@ class TestCrawlTask(unittest.TestCase):
         self.assertEquals(self._task.revisit_count, 4)
         self.assertEquals(self._task.change_count, 2)
 
+    def test_report_visit_modified(self):
+        self._task.report_visit(True, 1234567890)
+        self.assertEquals(self._task.modified, 1234567890)
+        self.assertEquals(self._task.modified_visit_count, 0)
+        # Visits without modification time are not counted.
+        self._task.report_visit(True)
+        self._task.report_visit(False, 1234567890)
+        self.assertEquals(self._task.modified_visit_count, 0)
+        self._task.report_visit(False, 1234567890)
+        self._task.report_visit(False, 1234567891)
+        self._task.report_visit(True, 1234567891)
+        self.assertEquals(self._task.modified_visit_count, 3)
+        self.assertEquals(self._task.modified_count, 2)
+        self._task.decay_modified_counts()
+        self.assertEquals(self._task.modified_visit_count, 1.5)
+        self.assertEquals(self._task.modified_count, 1)
+
+    def test_report_visit_server_clock(self):
+        # Only differences between listing times are used, the clock of the
+        # server may be far from ours.
+        now = [1234567890]
+        real_time = time.time
+        time.time = lambda: now[0]
+        try:
+            self._task.report_visit(True, 1000)
+            now[0] += 3600
+            self._task.report_visit(True, 1600)
+            self.assertEquals(self._task.unmodified_time, 3000)
+            now[0] += 3600
+            self._task.report_visit(False, 1600)
+            self.assertEquals(self._task.unmodified_time, 6600)
+            now[0] += 3600
+            self._task.report_visit(True, 86400)
+            self.assertEquals(self._task.unmodified_time, 6600)
+        finally:
+            time.time = real_time
+
 
 def main():
     parser = optparse.OptionParser()
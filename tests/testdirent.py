@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import optparse
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.util import dirent
+
+
+class TestDirent(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = os.path.join(TESTDIR, 'testdirent')
+        os.makedirs(os.path.join(self._dir, 'The Beatles'))
+        open(os.path.join(self._dir, 'front.png'), 'w').close()
+        open(os.path.join(self._dir, u'Café.mp3'.encode('utf-8')), 'w').close()
+        os.symlink('The Beatles', os.path.join(self._dir, 'beatles'))
+
+    def test_scandir(self):
+        entries = dict(dirent.scandir(unicode(self._dir)))
+        # Same names returned by os.listdir().
+        self.assertEquals(set(entries), set(os.listdir(unicode(self._dir))))
+        types = (entries[u'The Beatles'], entries[u'front.png'],
+                 entries[u'beatles'])
+        if dirent.UNKNOWN not in types:
+            self.assertEquals(types, (dirent.DIR, dirent.FILE, dirent.LINK))
+
+    def test_scandir_str(self):
+        entries = dict(dirent.scandir(self._dir))
+        self.assertTrue(u'Café.mp3'.encode('utf-8') in entries)
+
+    def test_scandir_error(self):
+        self.assertRaises(OSError, dirent.scandir,
+                          os.path.join(self._dir, 'missing'))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import gzip
+import socket
+import optparse
+import unittest
+import threading
+import cStringIO
+import SocketServer
+import BaseHTTPServer
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.bandwidth import BandwidthLimiter
+from arachne.eventloop import EventLoop, Coroutine, Return
+from arachne.eventloop import AsyncFTPHandler, AsyncApacheHandler
+from arachne.task import CrawlTask
+from arachne.url import URL
+
+
+class FTPRequestHandler(SocketServer.StreamRequestHandler):
+    """Minimal FTP server listing the directories in `server.listings`.
+    """
+
+    def handle(self):
+        self._send('220 Ready')
+        data_server = None
+        while True:
+            line = self.rfile.readline().strip()
+            if not line:
+                break
+            self.server.commands.append(line)
+            command, arg = (line.split(' ', 1) + [''])[:2]
+            command = command.upper()
+            if command == 'USER':
+                self._send('331 Password required')
+            elif command == 'PASS':
+                self._send('230 Logged in')
+            elif command == 'FEAT':
+                self._send('211-Features:\r\n MDTM\r\n211 End')
+            elif command == 'CWD':
+                if arg in self.server.listings:
+                    self._cwd = arg
+                    self._send('250 OK')
+                else:
+                    self._send('550 No such directory')
+            elif command == 'TYPE':
+                self._send('200 OK')
+            elif command == 'PASV':
+                data_server = socket.socket()
+                data_server.bind(('127.0.0.1', 0))
+                data_server.listen(1)
+                port = data_server.getsockname()[1]
+                self._send('227 Entering Passive Mode (127,0,0,1,%d,%d)'
+                           % (port >> 8, port & 0xFF))
+            elif command == 'LIST':
+                self._send('150 Here comes the listing')
+                conn = data_server.accept()[0]
+                conn.sendall(self.server.listings[self._cwd])
+                conn.close()
+                data_server.close()
+                self._send('226 Done')
+            elif command == 'QUIT':
+                self._send('221 Bye')
+                break
+            else:
+                self._send('502 Not implemented')
+
+    def _send(self, reply):
+        self.wfile.write(reply + '\r\n')
+
+
+class ApacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Minimal server of Apache autoindex pages.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        page = self.server.pages.get(self.path)
+        etag = '"%s"' % self.path
+        if self.path in self.server.redirections:
+            self.send_response(301)
+            self.send_header('Location', self.server.redirections[self.path])
+            self.end_headers()
+        elif page is None:
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.getheader('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            encoding = self.headers.getheader('Accept-encoding', '')
+            if 'gzip' in encoding and self.server.compress:
+                data = cStringIO.StringIO()
+                gzip_file = gzip.GzipFile(fileobj=data, mode='wb')
+                gzip_file.write(page)
+                gzip_file.close()
+                page = data.getvalue()
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            self.wfile.write(page)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+        self.done, self.listed, self.errors, self.visited = [], [], [], []
+        self.response_times = []
+
+    def report_done(self, task):
+        self.done.append(task)
+
+    def report_listed(self, task):
+        self.listed.append(task)
+
+    def report_error_site(self, task):
+        self.errors.append(task)
+
+    def report_response_time(self, task, seconds):
+        self.response_times.append((task, seconds))
+
+    report_error_dir = report_error_site
+
+    def put_visited(self, task, changed, modified=None):
+        self.visited.append((task, changed))
+
+
+class FakeResults(list):
+
+    def put(self, result):
+        self.append(result)
+
+
+class TestCoroutine(unittest.TestCase):
+
+    def setUp(self):
+        self._loop = EventLoop()
+
+    def test_return(self):
+        values = []
+        def add(x, y):
+            yield self._loop.sleep(0)
+            yield Return(x + y)
+        def main():
+            values.append((yield add(1, 2)))
+        Coroutine(main()).start()
+        self._loop.run_once(1)
+        self.assertEquals(values, [3])
+
+    def test_error(self):
+        errors = []
+        def fail():
+            yield self._loop.sleep(0)
+            raise ValueError('Invalid value.')
+        def main():
+            try:
+                yield fail()
+            except ValueError, error:
+                errors.append(str(error))
+        Coroutine(main()).start()
+        self._loop.run_once(1)
+        self.assertEquals(errors, ['Invalid value.'])
+
+    def test_resolve(self):
+        addresses = []
+        def main():
+            addresses.append((yield self._loop.resolve('localhost', 80)))
+            addresses.append((yield self._loop.resolve('localhost', 80)))
+        Coroutine(main()).start()
+        while len(addresses) < 2:
+            self._loop.run_once(1)
+        self.assertEquals(addresses[0][-1][1], 80)
+        # The second address is taken from the cache.
+        self.assertTrue(addresses[1] is addresses[0])
+
+
+class TestAsyncHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._tasks = FakeTasks()
+        self._results = FakeResults()
+        self._loop = EventLoop()
+        self._servers = []
+
+    def _start_ftp(self):
+        server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                 FTPRequestHandler)
+        server.daemon_threads = True
+        server.commands = []
+        server.listings = {
+            '/': 'drwxr-xr-x   12 1000     1000         4096 Jun 18 20:57 The Beatles\r\n'
+                 '-rw-r--r--    1 1000     1000          110 Jul 04 16:44 front.png\r\n',
+            '/The Beatles': '-r--r--r--    1 0        0         1978805 Aug 23  2007 13. Yesterday.mp3\r\n'
+                            'lrwxrwxrwx    1 0        0               7 Jan 25 00:17 bin -> usr/bin\r\n',
+        }
+        self._start(server)
+        self._url = URL('ftp://127.0.0.1:%d/' % server.server_address[1])
+        self._sites_info = {self._site_id: {'url': self._url,
+                                            'max_depth': 100,
+                                            'session_timeout': 60}}
+        return server
+
+    def _start_apache(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                           ApacheRequestHandler)
+        server.requests = []
+        server.compress = False
+        server.redirections = {}
+        server.pages = {
+            '/The%20Beatles/':
+                '<html><body><table>\n'
+                '<tr><td><img src="/icons/folder.gif" alt="[DIR]"></td>'
+                '<td><a href="Help%21/">Help!/</a></td>'
+                '<td align="right">18-Jun-2008 20:57  </td></tr>\n'
+                '<tr><td><img src="/icons/sound2.gif" alt="[SND]"></td>'
+                '<td><a href="13.%20Yesterday.mp3">13. Yesterday.mp3</a></td>'
+                '<td align="right">23-Aug-2007 00:00  </td></tr>\n'
+                '</table></body></html>\n',
+        }
+        self._start(server)
+        self._url = URL('http://127.0.0.1:%d/' % server.server_address[1])
+        self._sites_info = {self._site_id: {'url': self._url,
+                                            'max_depth': 100,
+                                            'max_page_size': 16777216}}
+        return server
+
+    def _start(self, server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self._servers.append(server)
+
+    def _execute(self, handler, tasks, wait=0):
+        done = []
+        handler.execute_batch(tasks, wait, lambda: done.append(True))
+        while not done:
+            self._loop.run_once(1)
+
+    def _entries(self, result):
+        return sorted((name, data['is_dir']) for name, data in result)
+
+    def test_ftp_execute(self):
+        server = self._start_ftp()
+        handler = AsyncFTPHandler(self._sites_info, self._tasks, self._results,
+                                  self._loop)
+        tasks = [CrawlTask(self._site_id, self._url),
+                 CrawlTask(self._site_id, self._url.join('The Beatles'))]
+        self._execute(handler, tasks)
+        self.assertEquals(self._tasks.done, tasks)
+        self.assertEquals(self._entries(self._results[0]),
+                          [('The Beatles', True), ('front.png', False)])
+        # The symbolic link is probed.
+        self.assertEquals(self._entries(self._results[1]),
+                          [('13. Yesterday.mp3', False), ('bin', False)])
+        self.assertTrue('CWD /The Beatles/bin' in server.commands)
+        self.assertEquals([task for task, seconds
+                           in self._tasks.response_times], tasks)
+        # The session is reused by the next batch.
+        self._execute(handler, [CrawlTask(self._site_id, self._url)])
+        self.assertEquals(len(self._results), 3)
+        self.assertEquals(server.commands.count('USER anonymous'), 1)
+        handler.close()
+
+    def test_ftp_execute_not_found(self):
+        self._start_ftp()
+        handler = AsyncFTPHandler(self._sites_info, self._tasks, self._results,
+                                  self._loop)
+        task = CrawlTask(self._site_id, self._url.join('Help!'))
+        self._execute(handler, [task])
+        self.assertEquals(self._tasks.done, [task])
+        self.assertFalse(self._results[0].found)
+        handler.close()
+
+    def test_ftp_execute_error_site(self):
+        self._start_ftp()
+        # Nothing should be listening in the port of a closed socket.
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = URL('ftp://127.0.0.1:%d/' % sock.getsockname()[1])
+        sock.close()
+        self._sites_info[self._site_id]['url'] = url
+        handler = AsyncFTPHandler(self._sites_info, self._tasks, self._results,
+                                  self._loop)
+        tasks = [CrawlTask(self._site_id, url), CrawlTask(self._site_id, url)]
+        self._execute(handler, tasks)
+        self.assertEquals(self._tasks.errors, tasks)
+        self.assertEquals(self._results, [])
+
+    def test_apache_execute(self):
+        server = self._start_apache()
+        handler = AsyncApacheHandler(self._sites_info, self._tasks,
+                                     self._results, self._loop)
+        task = CrawlTask(self._site_id, self._url.join('The Beatles'))
+        self._execute(handler, [task])
+        self.assertEquals(self._tasks.done, [task])
+        self.assertEquals(self._entries(self._results[0]),
+                          [('13. Yesterday.mp3', False), ('Help!', True)])
+        self.assertEquals(task.validators,
+                          {'If-None-Match': '"/The%20Beatles/"'})
+        # Not modified.
+        self._execute(handler, [task])
+        self.assertEquals(len(self._results), 1)
+        self.assertEquals(self._tasks.visited, [(task, False)])
+        self.assertEquals(server.requests, ['/The%20Beatles/'] * 2)
+
+    def test_apache_execute_gzip(self):
+        server = self._start_apache()
+        server.compress = True
+        handler = AsyncApacheHandler(self._sites_info, self._tasks,
+                                     self._results, self._loop)
+        self._execute(handler, [CrawlTask(self._site_id,
+                                          self._url.join('The Beatles'))])
+        self.assertEquals(self._entries(self._results[0]),
+                          [('13. Yesterday.mp3', False), ('Help!', True)])
+
+    def test_apache_execute_redirection(self):
+        server = self._start_apache()
+        server.redirections['/Beatles/'] = '/The%20Beatles/'
+        handler = AsyncApacheHandler(self._sites_info, self._tasks,
+                                     self._results, self._loop)
+        task = CrawlTask(self._site_id, self._url.join('Beatles'))
+        self._execute(handler, [task])
+        self.assertEquals(self._tasks.done, [task])
+        self.assertEquals(self._entries(self._results[0]),
+                          [('13. Yesterday.mp3', False), ('Help!', True)])
+        self.assertEquals(server.requests, ['/Beatles/', '/The%20Beatles/'])
+        # Redirection loops are errors of the directory.
+        server.redirections['/Beatles/'] = '/Beatles/'
+        self._execute(handler, [task])
+        self.assertEquals(self._tasks.errors, [task])
+
+    def test_apache_execute_throttled(self):
+        self._start_apache()
+        self._sites_info[self._site_id]['max_rate'] = 128
+        bandwidth = BandwidthLimiter(self._sites_info)
+        handler = AsyncApacheHandler(self._sites_info, self._tasks,
+                                     self._results, self._loop, bandwidth)
+        start = time.time()
+        self._execute(handler, [CrawlTask(self._site_id,
+                                          self._url.join('The Beatles'))])
+        # The response takes more than 2 seconds at 128 bytes per second.
+        self.assertTrue(time.time() - start > 2)
+        self.assertEquals(self._entries(self._results[0]),
+                          [('13. Yesterday.mp3', False), ('Help!', True)])
+        self.assertTrue(bandwidth.get_throttled(self._site_id) > 1)
+        # The throttled time is not part of the response time of the site.
+        self.assertTrue(self._tasks.response_times[0][1] < 1)
+
+    def test_apache_execute_not_found(self):
+        self._start_apache()
+        handler = AsyncApacheHandler(self._sites_info, self._tasks,
+                                     self._results, self._loop)
+        task = CrawlTask(self._site_id, self._url.join('Help!'))
+        self._execute(handler, [task])
+        self.assertEquals(self._tasks.done, [task])
+        self.assertFalse(self._results[0].found)
+
+    def tearDown(self):
+        self._loop.close()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import time
 import optparse
 import unittest
 
@@ -10,6 +11,8 @@ SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
 sys.path.insert(0, SRCDIR)
 
 from arachne.handler import FTPHandler
+from arachne.task import CrawlTask
+from arachne.url import URL
 
 
 class TestFTPHandler(unittest.TestCase):
@@ -50,11 +53,107 @@ class TestFTPHandler(unittest.TestCase):
             ('total 14786', None),
             ('Total of 11 Files, 10966 Blocks', None),
         )
+        self._mlsd_responses = (
+            ('type=dir;modify=20080618205700;UNIX.mode=0755; The Beatles',
+             ('The Beatles', True)),
+            ('Type=file;Size=1978805;Modify=20070823000000; 13. Yesterday.mp3',
+             ('13. Yesterday.mp3', False)),
+            ('type=OS.unix=slink:/usr/bin;modify=20100125001700; bin',
+             ('bin', None)),
+            ('type=OS.unix=symlink;modify=20100125001700; lib',
+             ('lib', None)),
+            ('type=file;size=110; name with  spaces ',
+             ('name with  spaces ', False)),
+            # Lines that should be ignored.
+            ('type=cdir;modify=20080618205700; .', None),
+            ('type=pdir;modify=20080618205700; ..', None),
+            ('modify=20080618205700; unknown', None),
+            ('invalid', None),
+        )
+        self._recursive_response = (
+            '.:',
+            'total 8',
+            'drwxr-xr-x    3 0        0            4096 Jun 18 20:57 The Beatles',
+            '-rw-r--r--    1 0        0             110 Jul 04 16:44 front.png',
+            '',
+            './The Beatles:',
+            'total 4',
+            'drwxr-xr-x    2 0        0            4096 Nov 07  2007 Help!',
+            '',
+            './The Beatles/Help!:',
+            'total 2',
+            '-r--r--r--    1 0        0         1978805 Aug 23  2007 13. Yesterday.mp3',
+        )
         self._handler = FTPHandler([], None, None)
 
     def test_parse_list(self):
         for line, parsed_line in self._list_responses:
-            self.assertEquals(self._handler._parse_list(line), parsed_line)
+            entry = self._handler._parse_list(line)
+            if entry is not None:
+                entry = entry[:2]
+            self.assertEquals(entry, parsed_line)
+
+    def test_parse_list_facts(self):
+        facts = (
+            ('drwxr-xr-x    2 0        0            4096 Nov 07  2007 Help!',
+             {'mtime': 1194393600}),
+            ('-r--r--r--    1 0        0         1978805 Aug 23  2007 13. Yesterday.mp3',
+             {'size': 1978805, 'mtime': 1187827200}),
+            ('01-29-08  09:16AM       <DIR>          The Beatles',
+             {'mtime': 1201598160}),
+            ('12-14-07  06:44PM              2161652 front.png',
+             {'size': 2161652, 'mtime': 1197657840}),
+            ('+i8388621.48594,m825718503,r,s280,\t13. Yesterday.mp3',
+             {'size': 280, 'mtime': 825718503}),
+        )
+        for line, entry_facts in facts:
+            self.assertEquals(self._handler._parse_list(line)[2], entry_facts)
+        # Recent entries are listed without the year.
+        entry = self._handler._parse_list(
+            'drwxr-xr-x   12 1000     1000         4096 Jun 18 20:57 The Beatles')
+        self.assertTrue(time.time() - 366 * 86400 < entry[2]['mtime']
+                        < time.time() + 2 * 86400)
+
+    def test_parse_tree(self):
+        tree = self._handler._parse_tree(self._recursive_response, '/pub')
+        self.assertEquals(sorted(tree.keys()),
+                          ['', 'The Beatles', 'The Beatles/Help!'])
+        self.assertEquals([entry[:2] for entry in tree['']],
+                          [('The Beatles', True), ('front.png', False)])
+        self.assertEquals([entry[:2] for entry in tree['The Beatles/Help!']],
+                          [('13. Yesterday.mp3', False)])
+        # Absolute paths in the section headers.
+        lines = [line.replace('./', '/pub/') for line in self._recursive_response]
+        self.assertEquals(self._handler._parse_tree(lines, '/pub'), tree)
+
+    def test_walk_tree(self):
+        task = CrawlTask('aa958756e769188be9f76fbdb291fe1b2ddd4777',
+                         URL('ftp://deltha.uh.cu/pub'))
+        tree = self._handler._parse_tree(self._recursive_response, '/pub')
+        walk = [(str(subtask.url), entries) for subtask, entries
+                in self._handler._walk_tree(task, tree, 100)]
+        self.assertEquals(walk, [
+            ('ftp://deltha.uh.cu/pub', tree['']),
+            ('ftp://deltha.uh.cu/pub/The Beatles', tree['The Beatles']),
+            ('ftp://deltha.uh.cu/pub/The Beatles/Help!',
+             tree['The Beatles/Help!']),
+        ])
+        # The subdirectories deeper than the maximum depth are not walked.
+        walk = list(self._handler._walk_tree(task, tree, 2))
+        self.assertEquals(len(walk), 2)
+
+    def test_parse_mlsd(self):
+        for line, parsed_line in self._mlsd_responses:
+            entry = self._handler._parse_mlsd(line)
+            if entry is not None:
+                entry = entry[:2]
+            self.assertEquals(entry, parsed_line)
+
+    def test_parse_mlsd_facts(self):
+        entry = self._handler._parse_mlsd(self._mlsd_responses[1][0])
+        self.assertEquals(entry[2], {'size': 1978805, 'mtime': 1187827200})
+        entry = self._handler._parse_mlsd(self._mlsd_responses[0][0])
+        self.assertEquals(entry[2], {'mtime': 1213822620})
 
 
 def main():
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import optparse
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne import listing
+
+
+class TestListing(unittest.TestCase):
+
+    def setUp(self):
+        self._listings = {
+            'unix': (
+                'total 14786\r\n'
+                'drwxr-xr-x   12 1000     1000         4096 Jun 18 20:57 The Beatles\r\n'
+                '-r--r--r--    1 0        0         1978805 Aug 23  2007 13. Yesterday.mp3\r\n'
+                'lrwxrwxrwx    1 0        0               7 Jan 25 00:17 bin -> usr/bin\r\n',
+                [('The Beatles', True), ('13. Yesterday.mp3', False),
+                 ('bin', None)]),
+            'msdos': (
+                '01-29-08  09:16AM       <DIR>          The Beatles\r\n'
+                '12-14-07  06:44PM              2161652 front.png\r\n',
+                [('The Beatles', True), ('front.png', False)]),
+            'eplf': (
+                '+i8388621.29609,m824255902,/,\tThe Beatles\r\n'
+                '+i8388621.48594,m825718503,r,s280,\t13. Yesterday.mp3\r\n',
+                [('The Beatles', True), ('13. Yesterday.mp3', False)]),
+            'netware': (
+                'd [RWCEAFMS] Admin                     512 Jan 29 09:16 The Beatles\r\n'
+                '- [RWCEAFMS] Admin                 2161652 Dec 14  2007 front.png\r\n',
+                [('The Beatles', True), ('front.png', False)]),
+            'vms': (
+                'Directory DISK$USER:[ANONYMOUS]\r\n'
+                '\r\n'
+                'BEATLES.DIR;1            1/3          5-MAR-1993 18:09:01  [GROUP,OWNER]  (RWED,RWED,RE,)\r\n'
+                'FRONT.PNG;2              5/6         14-DEC-2007 18:44:00  [GROUP,OWNER]  (RWED,RWED,R,)\r\n'
+                'A_VERY_LONG_NAME_FOR_A_FILE.TXT;1\r\n'
+                '                         9/9         14-DEC-2007 18:44:00  [GROUP,OWNER]  (RWED,RWED,R,)\r\n'
+                '\r\n'
+                'Total of 3 files, 15/18 blocks.\r\n',
+                [('BEATLES', True), ('FRONT.PNG', False),
+                 ('A_VERY_LONG_NAME_FOR_A_FILE.TXT', False)]),
+        }
+
+    def test_detect(self):
+        for name, (data, entries) in self._listings.iteritems():
+            self.assertEquals(listing.detect(data).name, name)
+        self.assertEquals(listing.detect('total 0\r\n'), None)
+
+    def test_parse(self):
+        for name, (data, entries) in self._listings.iteritems():
+            parser = listing.detect(data)
+            self.assertEquals([entry[:2] for entry in parser.parse(data)],
+                              entries)
+
+    def test_parse_facts(self):
+        data, entries = self._listings['vms']
+        parser = listing.detect(data)
+        self.assertEquals([entry[3] for entry in parser.parse(data)],
+                          [{'mtime': 731354941}, {'mtime': 1197657840},
+                           {'mtime': 1197657840}])
+
+    def test_parse_lines(self):
+        # The line is returned without the line terminator.
+        data, entries = self._listings['unix']
+        parser = listing.detect(data)
+        lines = data.split('\r\n')[1:]
+        self.assertEquals([entry[2] for entry in parser.parse(data)],
+                          lines[:len(entries)])
+
+    def test_parse_line(self):
+        for name, (data, entries) in self._listings.iteritems():
+            if name != 'vms':
+                lines = [line for line in data.split('\r\n')
+                         if listing.parse_line(line) is not None]
+                self.assertEquals([listing.parse_line(line)[:2]
+                                   for line in lines], entries)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
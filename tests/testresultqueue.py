@@ -2,9 +2,11 @@
 
 import os
 import sys
+import time
 import shutil
 import optparse
 import unittest
+import threading
 
 TESTDIR = os.path.dirname(os.path.abspath(__file__))
 SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
@@ -125,6 +127,30 @@ class TestResultQueue(unittest.TestCase):
         self.assertEquals(str(result.task.url), str(returned.task.url))
         self._queue.report_done(returned)
 
+    def test_wait(self):
+        # Wait until a result is put by other thread.
+        timer = threading.Timer(0.5, self._queue.put, [self._results[0]])
+        timer.start()
+        start = time.time()
+        self._queue.wait(10)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEquals(str(self._queue.get().task.url),
+                          str(self._results[0].task.url))
+        timer.join()
+        # The queue is not empty.
+        start = time.time()
+        self._queue.wait(10)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_interrupt(self):
+        timer = threading.Timer(0.5, self._queue.interrupt)
+        timer.start()
+        start = time.time()
+        self._queue.wait(10)
+        self.assertTrue(time.time() - start < 5)
+        timer.join()
+        self.assertRaises(EmptyQueue, self._queue.get)
+
     def _clear_queue(self, remain=0):
         # Remove results from the queue until the specified number of results
         # (default 0) remains in the queue.
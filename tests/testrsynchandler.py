@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import optparse
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.handler import RsyncHandler
+from arachne.task import CrawlTask
+from arachne.url import URL
+
+
+# Fake rsync client printing the listing of a module.
+RSYNC_SCRIPT = r"""#!%(python)s
+import sys
+listing = {
+    '/': [
+        'drwxr-xr-x          4,096 2008/06/18 20:57:00 .',
+        '-rw-r--r--            110 2008/07/04 16:44:00 front.png',
+        'lrwxrwxrwx              7 2008/01/25 00:17:00 bin -> usr/bin',
+        'drwxr-xr-x          4,096 2008/06/18 20:57:00 The Beatles',
+    ],
+    '/The Beatles/': [
+        'drwxr-xr-x          4,096 2008/06/18 20:57:00 .',
+        '-r--r--r--      1,978,805 2007/08/23 00:00:00 13. Yesterday.mp3',
+        'drwxr-xr-x          4,096 2007/11/07 00:00:00 Help!',
+        '-r--r--r--            100 2007/11/07 00:00:00 Caf\\#303\\#251.mp3',
+    ],
+    '/The Beatles/Help!/': [
+        'drwxr-xr-x          4,096 2007/11/07 00:00:00 .',
+        '-r--r--r--      2,161,652 2007/11/07 00:00:00 01. Help!.mp3',
+    ],
+}
+url = sys.argv[-1]
+path = url[url.index('/', len('rsync://')) + len('/music'):]
+if path not in listing:
+    sys.stderr.write('rsync: change_dir "%%s" (in music) failed: '
+                     'No such file or directory (2)\n' %% path)
+    sys.exit(23)
+if '--recursive' in sys.argv:
+    for dirpath in sorted(listing):
+        if dirpath.startswith(path):
+            prefix = dirpath[len(path):]
+            for line in listing[dirpath]:
+                if prefix and line.endswith(' .'):
+                    # Listed in the parent directory.
+                    continue
+                elif prefix:
+                    line = line[:46] + prefix + line[46:]
+                print line
+else:
+    print '\n'.join(listing[path])
+"""
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+        self.done, self.listed, self.errors = [], [], []
+
+    def report_done(self, task):
+        self.done.append(task)
+
+    def report_listed(self, task):
+        self.listed.append(task)
+
+    def report_error_site(self, task):
+        self.errors.append(task)
+
+    def report_response_time(self, task, seconds):
+        pass
+
+    report_error_dir = report_error_site
+
+
+class FakeResults(list):
+
+    def put(self, result):
+        self.append(result)
+
+
+class TestRsyncHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = os.path.join(TESTDIR, 'testrsynchandler')
+        os.mkdir(self._dir)
+        self._rsync = os.path.join(self._dir, 'rsync')
+        rsync_file = open(self._rsync, 'w')
+        rsync_file.write(RSYNC_SCRIPT % {'python': sys.executable})
+        rsync_file.close()
+        os.chmod(self._rsync, 0755)
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._url = URL('rsync://mirrors.uh.cu/music/')
+        self._sites_info = {self._site_id: {'url': self._url,
+                                            'max_depth': 100,
+                                            'rsync_command': self._rsync}}
+        self._tasks = FakeTasks()
+        self._results = FakeResults()
+        self._handler = RsyncHandler(self._sites_info, self._tasks,
+                                     self._results)
+
+    def _entries(self, result):
+        return sorted((name, data['is_dir'], data.get('size'))
+                      for name, data in result)
+
+    def test_execute(self):
+        task = CrawlTask(self._site_id, self._url.join('The Beatles'))
+        self._handler.execute(task)
+        self.assertEquals(self._tasks.done, [task])
+        self.assertEquals(len(self._results), 1)
+        self.assertEquals(self._entries(self._results[0]),
+                          [(u'13. Yesterday.mp3', False, 1978805),
+                           (u'Café.mp3', False, 100),
+                           (u'Help!', True, None)])
+        mtime = self._results[0]['Help!']['mtime']
+        self.assertEquals(time.localtime(mtime)[:3], (2007, 11, 7))
+
+    def test_execute_not_found(self):
+        task = CrawlTask(self._site_id, self._url.join('Help!'))
+        self._handler.execute(task)
+        self.assertEquals(self._tasks.done, [task])
+        self.assertFalse(self._results[0].found)
+
+    def test_execute_recursive(self):
+        self._sites_info[self._site_id]['recursive_list'] = '/music'
+        task = CrawlTask(self._site_id, self._url)
+        self._handler.execute(task)
+        self.assertEquals([result.task.url.path for result in self._results],
+                          [u'/music', u'/music/The Beatles',
+                           u'/music/The Beatles/Help!'])
+        self.assertEquals(self._entries(self._results[0]),
+                          [(u'The Beatles', True, None),
+                           (u'bin', False, 7),
+                           (u'front.png', False, 110)])
+        self.assertEquals(self._entries(self._results[2]),
+                          [(u'01. Help!.mp3', False, 2161652)])
+        self.assertEquals(len(self._tasks.listed), 2)
+
+    def test_execute_error(self):
+        self._sites_info[self._site_id]['rsync_command'] = \
+            os.path.join(self._dir, 'missing')
+        task = CrawlTask(self._site_id, self._url)
+        self._handler.execute(task)
+        self.assertEquals(self._tasks.errors, [task])
+        self.assertEquals(self._results, [])
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import time
 import shutil
 import optparse
 import unittest
+import threading
 import itertools
 
 TESTDIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +14,7 @@ SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
 sys.path.insert(0, SRCDIR)
 
 from arachne.error import EmptyQueue
+from arachne.result import CrawlResult
 from arachne.task import CrawlTask, TaskQueue
 from arachne.url import URL
 
@@ -188,6 +190,276 @@ class TestTaskQueue(unittest.TestCase):
         time.sleep(self._error_dir_wait)
         self.assertEquals(str(task.url), str(self._queue.get().url))
 
+    def test_report_listed(self):
+        task_list = self._tasks.values()[0]
+        self._queue.report_listed(task_list[0])
+        # The listed directories are kept when the queue is opened again.
+        self._queue.close()
+        self._queue = TaskQueue(self._sites_info, self._db_home)
+        for task in task_list:
+            self._queue.put_new(task)
+        self.assertEquals(len(self._queue), self._num_sites + len(task_list) - 1)
+        # Only the first task for the directory is ignored.
+        self._queue.put_new(task_list[0])
+        self.assertEquals(len(self._queue), self._num_sites + len(task_list))
+
+    def test_get_batch_site_ids(self):
+        # Only the tasks of the given sites are returned.
+        self.assertRaises(EmptyQueue, self._queue.get_batch, set())
+        site_id = self._sites_info.keys()[-1]
+        batch = self._queue.get_batch(set([site_id]))
+        self.assertEquals([task.site_id for task in batch], [site_id])
+        self.assertRaises(EmptyQueue, self._queue.get_batch, set([site_id]))
+        self._queue.report_done(batch[0])
+        for i in xrange(self._num_sites - 1):
+            self.assertNotEquals(self._queue.get().site_id, site_id)
+
+    def test_get_batch(self):
+        self._clear_queue()
+        site_id, task_list = self._tasks.items()[0]
+        self._sites_info[site_id]['batch_size'] = 3
+        for task in task_list:
+            self._queue.put_new(task)
+        time.sleep(self._request_wait)
+        batch = self._queue.get_batch()
+        self.assertEquals([str(task.url) for task in batch],
+                          [str(task.url) for task in task_list[:3]])
+        # The site is not available until the whole batch is reported.
+        self._queue.report_done(batch[1])
+        self._queue.report_error_dir(batch[2])
+        self.assertRaises(EmptyQueue, self._queue.get)
+        self._queue.report_done(batch[0])
+        self.assertRaises(EmptyQueue, self._queue.get)
+        time.sleep(self._request_wait)
+        batch = self._queue.get_batch()
+        self.assertEquals([str(task.url) for task in batch],
+                          [str(task.url) for task in task_list[3:6]])
+        self.assertEquals(len(self._queue), len(task_list) - 2)
+
+    def test_max_connections(self):
+        self._clear_queue()
+        site_id, task_list = self._tasks.items()[0]
+        self._sites_info[site_id]['max_connections'] = 2
+        self._queue.close()
+        self._queue = TaskQueue(self._sites_info, self._db_home)
+        for task in task_list[:4]:
+            self._queue.put_new(task)
+        time.sleep(self._request_wait)
+        first = self._queue.get()
+        second = self._queue.get()
+        self.assertEquals([str(first.url), str(second.url)],
+                          [str(task.url) for task in task_list[:2]])
+        # Both connections are being used.
+        self.assertRaises(EmptyQueue, self._queue.get)
+        self.assertEquals(self._queue.get_wait(), None)
+        # Each connection waits for its own request wait.
+        self._queue.report_done(first)
+        self.assertRaises(EmptyQueue, self._queue.get)
+        time.sleep(self._request_wait)
+        third = self._queue.get()
+        self.assertEquals(str(third.url), str(task_list[2].url))
+        self._queue.report_done(second)
+        self._queue.report_done(third)
+        # Reducing the number of connections.
+        self._sites_info[site_id]['max_connections'] = 1
+        self._queue.close()
+        self._queue = TaskQueue(self._sites_info, self._db_home)
+        time.sleep(self._request_wait)
+        self._queue.get()
+        self.assertRaises(EmptyQueue, self._queue.get)
+
+    def test_auto_request_wait(self):
+        site_id, other_site_id = self._sites_info.keys()[:2]
+        info = self._sites_info[site_id]
+        info['auto_request_wait'] = True
+        info['min_request_wait'] = 1
+        info['max_request_wait'] = 8
+        task = self._queue.get_batch(set([site_id]))[0]
+        self.assertEquals(self._queue.get_request_wait(site_id),
+                          self._request_wait)
+        # The wait moves towards ten times the response time.
+        self._queue.report_response_time(task, 0.6)
+        self.assertEquals(self._queue.get_request_wait(site_id), 4)
+        self._queue.report_response_time(task, 0.6)
+        self.assertEquals(self._queue.get_request_wait(site_id), 5)
+        # Errors contacting the site double the wait, within the bounds.
+        self._queue.report_error_site(task)
+        self.assertEquals(self._queue.get_request_wait(site_id), 8)
+        for i in xrange(10):
+            self._queue.report_response_time(task, 0)
+        self.assertEquals(self._queue.get_request_wait(site_id), 1)
+        # Sites without the option use request_wait.
+        other_task = CrawlTask(other_site_id,
+                               self._sites_info[other_site_id]['url'])
+        self._queue.report_response_time(other_task, 10)
+        self.assertEquals(self._queue.get_request_wait(other_site_id),
+                          self._request_wait)
+
+    def test_auto_request_wait_batch(self):
+        site_id = self._sites_info.keys()[0]
+        info = self._sites_info[site_id]
+        info['auto_request_wait'] = True
+        info['min_request_wait'] = 1
+        info['max_request_wait'] = 60
+        info['batch_size'] = 3
+        for task in self._tasks[site_id][:2]:
+            self._queue.put_new(task)
+        batch = self._queue.get_batch(set([site_id]))
+        self.assertEquals(len(batch), 3)
+        # The wait is doubled once for the batch, not for each task.
+        for task in batch:
+            self._queue.report_error_site(task)
+        self.assertEquals(self._queue.get_request_wait(site_id),
+                          2 * self._request_wait)
+
+    def test_host_limits(self):
+        site_id = 'a78e6853355ad5cdc751ad678d15339382f9ed21'
+        other_site_id = '3f3c35b4e6d2fdd5d4e7e2e5d6b3e0a7c1a2b4c9'
+        other_info = dict(self._sites_info[site_id],
+                          url=URL('ftp://Atlantis.uh.cu/pub/'))
+        self._sites_info[other_site_id] = other_info
+        self._sites_info[site_id]['host_max_connections'] = 1
+        other_info['host_request_wait'] = self._request_wait
+        self._queue.close()
+        self._queue = TaskQueue(self._sites_info, self._db_home)
+        site_ids = set([site_id, other_site_id])
+        first = self._queue.get_batch(site_ids)[0]
+        # The connection to the host is being used.
+        self.assertRaises(EmptyQueue, self._queue.get_batch, site_ids)
+        self.assertEquals(self._queue.get_wait(site_ids), None)
+        # The other site waits for the request wait of the host.
+        self._queue.report_done(first)
+        self.assertRaises(EmptyQueue, self._queue.get_batch, site_ids)
+        self.assertTrue(self._queue.get_wait(site_ids) > 0)
+        time.sleep(self._request_wait)
+        second = self._queue.get_batch(site_ids)[0]
+        self.assertEquals(set([first.site_id, second.site_id]), site_ids)
+        # Sites on other hosts are not limited.
+        third = self._queue.get_batch()[0]
+        self.assertFalse(third.site_id in site_ids)
+
+    def test_report_mtimes(self):
+        self._clear_queue()
+        site_id, task_list = self._tasks.items()[0]
+        parent = CrawlTask(site_id, self._sites_info[site_id]['url'])
+        task = task_list[0]
+        def report_mtime(mtime):
+            result = CrawlResult(parent, True)
+            result.add_entry(task.url.basename, {'is_dir': True,
+                                                 'mtime': mtime})
+            self._queue.report_mtimes(result)
+        def visit():
+            task = self._queue.get()
+            self._queue.report_done(task)
+            self._queue.put_visited(task, False)
+        self._queue.put_new(task)
+        time.sleep(self._request_wait)
+        visit()
+        # The modification time of the first visit is not known.
+        report_mtime(1234567890)
+        time.sleep(self._default_revisit_wait)
+        visit()
+        # Unchanged directory.
+        report_mtime(1234567890)
+        time.sleep(self._default_revisit_wait)
+        self.assertRaises(EmptyQueue, self._queue.get)
+        self.assertEquals(len(self._queue), 1)
+        # The parent was not listed again since the last visit.
+        time.sleep(self._default_revisit_wait)
+        visit()
+        report_mtime(1234567890)
+        time.sleep(self._default_revisit_wait)
+        self.assertRaises(EmptyQueue, self._queue.get)
+        # Changed directory.
+        report_mtime(1234567891)
+        time.sleep(self._default_revisit_wait)
+        self.assertEquals(str(self._queue.get().url), str(task.url))
+
+    def test_estimate_revisit_wait_modified(self):
+        class Task(object):
+            def __init__(self, changes, visits, unmodified):
+                self.modified_count = changes
+                self.modified_visit_count = visits
+                self.unmodified_time = unmodified
+        estimate = TaskQueue._estimate_revisit_wait_modified
+        self.assertEquals(estimate(Task(2, 4, 1000)), 581)
+        # Changes found in all visits.
+        self.assertEquals(estimate(Task(3, 3, 300)), 100)
+        # No changes found.
+        self.assertEquals(estimate(Task(0, 4, 500)), 500)
+
+    def test_put_visited_modified(self):
+        self._clear_queue(remain=1)
+        site_id = self._queue.get().site_id
+        self._queue.close()
+        self._sites_info[site_id]['revisit_estimator'] = 'last_modified'
+        self._sites_info[site_id]['max_revisit_wait'] = 60
+        self._queue = TaskQueue(self._sites_info, self._db_home)
+        task = self._queue.get()
+        self._queue.report_done(task)
+        self._queue.put_visited(task, True, 1234567890)
+        time.sleep(self._default_revisit_wait)
+        task = self._queue.get()
+        self._queue.report_done(task)
+        # The estimate is updated since the second visit, the directory was
+        # not modified during the whole interval.
+        self._queue.put_visited(task, False, 1234567890)
+        self.assertEquals(task.modified_visit_count, 1)
+        self.assertEquals(task.modified_count, 0)
+        self.assertTrue(task.revisit_wait >= self._default_revisit_wait)
+
+    def test_report_changed(self):
+        self._clear_queue()
+        site_id, task_list = self._tasks.items()[0]
+        self._sites_info[site_id]['watch'] = True
+        self._sites_info[site_id]['max_revisit_wait'] = 60
+        task = task_list[0]
+        self._queue.put_new(task)
+        time.sleep(self._request_wait)
+        task = self._queue.get()
+        self._queue.report_done(task)
+        self._queue.report_watched(site_id, task.url)
+        self._queue.put_visited(task, True)
+        time.sleep(self._default_revisit_wait)
+        # Watched directories are not revisited until they change.
+        self.assertRaises(EmptyQueue, self._queue.get)
+        self._queue.report_changed(site_id, task.url)
+        task = self._queue.get()
+        self.assertEquals(str(task.url), str(task_list[0].url))
+        # Changes reported while the task is executed.
+        self._queue.report_changed(site_id, task.url)
+        self._queue.report_done(task)
+        self._queue.put_visited(task, False)
+        time.sleep(self._request_wait)
+        self.assertEquals(str(self._queue.get().url), str(task.url))
+
+    def test_wait(self):
+        self._clear_queue()
+        self.assertRaises(EmptyQueue, self._queue.get)
+        # There are not tasks, wait until a task is put.
+        self.assertEquals(self._queue.get_wait(), None)
+        start = time.time()
+        self._queue.wait(timeout=0.5)
+        self.assertTrue(0.4 < time.time() - start < 2)
+        site_id, task_list = self._tasks.items()[0]
+        timer = threading.Timer(0.5, self._queue.put_new, [task_list[0]])
+        timer.start()
+        start = time.time()
+        self._queue.wait(timeout=10)
+        self.assertTrue(time.time() - start < 2)
+        timer.join()
+        # The site is executable after the request wait.
+        self.assertEquals(self._queue.get_wait(), 0)
+        self.assertRaises(EmptyQueue, self._queue.get)
+        self.assertTrue(0 < self._queue.get_wait() <= self._request_wait)
+        self._queue.wait()
+        self._queue.report_done(self._queue.get())
+        # Interrupted.
+        self._queue.interrupt()
+        start = time.time()
+        self._queue.wait()
+        self.assertTrue(time.time() - start < 1)
+
     def _clear_queue(self, remain=0):
         # Remove tasks from the queue until the specified number of tasks
         # (default 0) remains in the queue.
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import optparse
+import unittest
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.url import URL
+from arachne.util.inotify import InotifyError
+from arachne.watcher import DirectoryWatcher
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+        self.watched = set()
+        self.changed = []
+
+    def report_watched(self, site_id, url, watched=True):
+        if watched:
+            self.watched.add(url.path)
+        else:
+            self.watched.discard(url.path)
+
+    def report_changed(self, site_id, url):
+        self.changed.append(url.path)
+
+
+class TestDirectoryWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = os.path.join(TESTDIR, 'testwatcher')
+        os.makedirs(os.path.join(self._dir, 'The Beatles', 'Help!'))
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._url = URL('file://%s' % self._dir, True)
+        self._sites_info = {self._site_id: {'url': self._url,
+                                            'max_depth': 100,
+                                            'watch': True}}
+        self._tasks = FakeTasks()
+        try:
+            self._watcher = DirectoryWatcher(self._sites_info, self._tasks)
+        except InotifyError:
+            self._watcher = None
+        else:
+            self._watcher.start()
+            self._wait(lambda: len(self._tasks.watched) == 3)
+
+    def _wait(self, condition):
+        # Wait for the watcher thread.
+        for i in xrange(50):
+            if condition():
+                break
+            time.sleep(0.1)
+
+    def test_watched(self):
+        if self._watcher is not None:
+            self.assertEquals(self._tasks.watched,
+                              set([self._url.path,
+                                   self._url.join('The Beatles').path,
+                                   self._url.join('The Beatles/Help!').path]))
+
+    def test_changed(self):
+        if self._watcher is not None:
+            beatles = self._url.join('The Beatles')
+            open(os.path.join(beatles.path, 'front.png'), 'w').close()
+            self._wait(lambda: self._tasks.changed)
+            self.assertEquals(self._tasks.changed, [beatles.path])
+
+    def test_new_directory(self):
+        if self._watcher is not None:
+            os.mkdir(os.path.join(self._dir, 'Abbey Road'))
+            self._wait(lambda: len(self._tasks.watched) == 4)
+            self.assertTrue(self._url.join('Abbey Road').path
+                            in self._tasks.watched)
+            self.assertEquals(self._tasks.changed, [self._url.path])
+            shutil.rmtree(os.path.join(self._dir, 'The Beatles'))
+            self._wait(lambda: len(self._tasks.watched) == 2)
+            self.assertEquals(self._tasks.watched,
+                              set([self._url.path,
+                                   self._url.join('Abbey Road').path]))
+
+    def tearDown(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher.join()
+        shutil.rmtree(self._dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import urllib
+import optparse
+import unittest
+import threading
+import BaseHTTPServer
+import email.utils
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+SRCDIR = os.path.abspath(os.path.join(TESTDIR, os.path.pardir))
+sys.path.insert(0, SRCDIR)
+
+from arachne.handler import WebDAVHandler
+from arachne.task import CrawlTask
+from arachne.url import URL
+
+
+class WebDAVRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Minimal WebDAV server answering PROPFIND requests for a directory.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_PROPFIND(self):
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        self.server.requests.append((self.path,
+                                     self.headers.getheader('Depth')))
+        depth = self.headers.getheader('Depth')
+        path = os.path.join(self.server.root,
+                            urllib.unquote(self.path).strip('/'))
+        if depth == 'infinity' and not self.server.allow_infinity:
+            self._send(403, '')
+        elif not os.path.exists(path):
+            self._send(404, '')
+        else:
+            responses = [self._response(self.path.rstrip('/'), path)]
+            if os.path.isdir(path):
+                responses.extend(self._walk(self.path.rstrip('/'), path,
+                                            depth == 'infinity'))
+            self._send(207, '<?xml version="1.0" encoding="utf-8"?>'
+                       '<D:multistatus xmlns:D="DAV:">%s</D:multistatus>'
+                       % ''.join(responses))
+
+    def _walk(self, href, path, recursive):
+        for name in sorted(os.listdir(path)):
+            subhref = '%s/%s' % (href, urllib.quote(name))
+            subpath = os.path.join(path, name)
+            yield self._response(subhref, subpath)
+            if recursive and os.path.isdir(subpath):
+                for response in self._walk(subhref, subpath, recursive):
+                    yield response
+
+    def _response(self, href, path):
+        if os.path.isdir(path):
+            props = '<D:resourcetype><D:collection/></D:resourcetype>'
+            href += '/'
+        else:
+            props = ('<D:resourcetype/><D:getcontentlength>%d'
+                     '</D:getcontentlength>' % os.path.getsize(path))
+        props += ('<D:getlastmodified>%s</D:getlastmodified>'
+                  % email.utils.formatdate(os.path.getmtime(path),
+                                           usegmt=True))
+        return ('<D:response><D:href>%s</D:href><D:propstat><D:prop>%s'
+                '</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>'
+                '</D:response>' % (href, props))
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/xml; charset="utf-8"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+        self.done, self.listed, self.errors = [], [], []
+
+    def report_done(self, task):
+        self.done.append(task)
+
+    def report_listed(self, task):
+        self.listed.append(task)
+
+    def report_error_site(self, task):
+        self.errors.append(task)
+
+    def report_response_time(self, task, seconds):
+        pass
+
+    report_error_dir = report_error_site
+
+
+class FakeResults(list):
+
+    def put(self, result):
+        self.append(result)
+
+
+class TestWebDAVHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._root = os.path.join(TESTDIR, 'testwebdavhandler')
+        os.makedirs(os.path.join(self._root, 'The Beatles', 'Help!'))
+        for name in ('front.png', 'The Beatles/13. Yesterday.mp3',
+                     'The Beatles/Help!/01. Help!.mp3'):
+            open(os.path.join(self._root, name), 'wb').write('x' * 110)
+        self._server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                 WebDAVRequestHandler)
+        self._server.root = self._root
+        self._server.requests = []
+        self._server.allow_infinity = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self._site_id = 'aa958756e769188be9f76fbdb291fe1b2ddd4777'
+        self._url = URL('http://127.0.0.1:%d/' % self._server.server_port)
+        self._sites_info = {self._site_id: {'url': self._url,
+                                            'max_depth': 100,
+                                            'http_keepalive_timeout': 5}}
+        self._tasks = FakeTasks()
+        self._results = FakeResults()
+        self._handler = WebDAVHandler(self._sites_info, self._tasks,
+                                      self._results)
+
+    def _entries(self, result):
+        return sorted((name, data['is_dir'], data.get('size'))
+                      for name, data in result)
+
+    def test_execute(self):
+        task = CrawlTask(self._site_id, self._url.join('The Beatles'))
+        self._handler.execute(task)
+        self.assertEquals(self._tasks.done, [task])
+        self.assertEquals(len(self._results), 1)
+        self.assertEquals(self._entries(self._results[0]),
+                          [('13. Yesterday.mp3', False, 110),
+                           ('Help!', True, None)])
+        self.assertEquals(self._server.requests, [('/The%20Beatles/', '1')])
+
+    def test_execute_not_found(self):
+        task = CrawlTask(self._site_id, self._url.join('Help!'))
+        self._handler.execute(task)
+        self.assertEquals(self._tasks.done, [task])
+        self.assertFalse(self._results[0].found)
+        task = CrawlTask(self._site_id, self._url.join('front.png'))
+        self._handler.execute(task)
+        self.assertFalse(self._results[1].found)
+
+    def test_execute_recursive(self):
+        self._sites_info[self._site_id]['recursive_list'] = '/'
+        task = CrawlTask(self._site_id, self._url)
+        self._handler.execute(task)
+        self.assertEquals(self._server.requests, [('/', 'infinity')])
+        self.assertEquals([result.task.url.path for result in self._results],
+                          [u'/', u'/The Beatles', u'/The Beatles/Help!'])
+        self.assertEquals(self._entries(self._results[2]),
+                          [('01. Help!.mp3', False, 110)])
+        self.assertEquals(len(self._tasks.listed), 2)
+        # Fall back to depth 1 if the server does not allow infinity.
+        del self._results[:]
+        self._server.requests = []
+        self._server.allow_infinity = False
+        self._handler.execute(CrawlTask(self._site_id, self._url))
+        self.assertEquals(self._server.requests,
+                          [('/', 'infinity'), ('/', '1')])
+        self.assertEquals(len(self._results), 1)
+        self.assertEquals(self._entries(self._results[0]),
+                          [('The Beatles', True, None),
+                           ('front.png', False, 110)])
+
+    def tearDown(self):
+        self._handler.close()
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._root)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-v', dest='verbosity', default='2',
+                      type='choice', choices=['0', '1', '2'],
+                      help='verbosity level: 0 = minimal, 1 = normal, 2 = all')
+    options = parser.parse_args()[0]
+    module = os.path.basename(__file__)[:-3]
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    runner = unittest.TextTestRunner(verbosity=int(options.verbosity))
+    result = runner.run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()